@@ -3,6 +3,7 @@ NagConf - Management Console Menu for modifying, building, and deleting
 Nagios configuration files.
 
 Usage: python nagconf.py -c /my-config/dir
+       python nagconf.py -m /etc/nagios/nagios.cfg
 """
 
 import logging
@@ -11,13 +12,40 @@ import inspect
 import gc
 import os
 import itertools
-import operator
-import pprint
+import copy
 import re
+import multiprocessing
+import hashlib
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 import ncClasses
-from ncClasses import NagObjFlex
+from ncClasses import new_nag_obj
 
 sversion = 'v0.1'
+# below this much config the process pool costs more than it saves
+parallelMinBytes = 4 * 1024 * 1024
+# large files are split into chunks of about this size for the pool
+parallelChunkBytes = 8 * 1024 * 1024
+# below this many inheriting objects the process pool costs more than it saves
+parallelMinObjects = 100000
+# objects per inheritance task handed to the pool
+parallelInheritChunk = 5000
+# write_cfg_tree() layouts (besides a number, for shards of that many objects)
+treeLayouts = ('type', 'hostgroup')
+# fingerprints of what we last wrote to an output directory
+outputManifestName = '.nagconf.manifest'
+# interval_length (seconds per interval unit) the load simulator assumes
+intervalLength = 60
 scriptfilename = os.path.basename(sys.argv[0])
 defaultlogfilename = scriptfilename + '.log'
 
@@ -68,450 +96,793 @@ def giveupthefunc():
     return funcs[0] if funcs else None
 
 
-def get_config(options):
-    """ Another sample functio """
+# precompiled patterns for the block tokenizer
+r_def = re.compile('(define )(?P<defname>[a-zA-Z_]*)({| *{)')
+r_prop = re.compile('( *)(?P<prop>[a-zA-Z_]*)( *)(?P<val>.*)')
+
+
+def iter_cfg_dir(dir, seen=None):
+    """ Lazily yields every file ending in .cfg under dir,
+    descending into subdirectories the same way Nagios does for
+    cfg_dir. Each directory is read with a single scandir() call
+    (entries are sorted so the order is repeatable) and symlink
+    loops are only walked once.
+    """
+    if seen is None:
+        seen = set()
+    realdir = os.path.realpath(dir)
+    if realdir in seen:
+        return
+    seen.add(realdir)
+    if scandir is not None:
+        entries = sorted(((e.name, e.path, e.is_dir()) for e in scandir(dir)))
+    else:
+        entries = sorted(((n, os.path.join(dir, n), os.path.isdir(os.path.join(dir, n)))
+                          for n in os.listdir(dir)))
+    for name, path, isdir in entries:
+        if isdir:
+            for f in iter_cfg_dir(path, seen):
+                yield f
+        elif name.endswith('.cfg'):
+            yield path
+
+
+def iter_main_cfg_files(maincfg):
+    """ Lazily yields the object config files referenced by the
+    cfg_file= and cfg_dir= directives of a main nagios.cfg. Relative
+    paths are taken relative to the directory nagios.cfg is in, like
+    Nagios does. A file reachable more than once is only yielded once.
+    """
     thisfunc = str(giveupthefunc())
-    logging.debug(thisfunc + "Number of files in cfgdir = " + str(len(os.listdir(options.cfgdir))))
-    numcfgfiles = 0
-    dir = options.cfgdir
-    cfgrawtext = []
-    cfgfiles = []
-    for fname in os.listdir(dir):
-        if '.cfg' in fname:
-            numcfgfiles += 1
-            cfgfiles.append(fname)
-    logging.debug(thisfunc + "Number of cfg files in cfgidr = " + str(numcfgfiles))
-    files = [os.path.join(dir, f) for f in cfgfiles]
+    basedir = os.path.dirname(os.path.abspath(maincfg))
+    seenfiles = set()
+    seendirs = set()
+    with open(maincfg, 'r') as mc:
+        for line in mc:
+            line = line.strip()
+            if not line or line[0] in '#;' or '=' not in line:
+                continue
+            key, val = line.split('=', 1)
+            key = key.strip()
+            path = os.path.join(basedir, val.strip())
+            if key == 'cfg_file':
+                found = [path]
+            elif key == 'cfg_dir':
+                found = iter_cfg_dir(path, seendirs)
+            else:
+                continue
+            for f in found:
+                if os.path.normpath(f) not in seenfiles:
+                    seenfiles.add(os.path.normpath(f))
+                    yield f
+    logging.debug(thisfunc + "Number of cfg files referenced by '%s' = %s" % (maincfg, len(seenfiles)))
+
+
+def iter_config_files(options):
+    """ Lazily yields the .cfg files to load: the ones referenced by
+    options.maincfg (a nagios.cfg) if given, otherwise every .cfg
+    file under options.cfgdir.
+    """
+    if getattr(options, 'maincfg', None):
+        return iter_main_cfg_files(options.maincfg)
+    return iter_cfg_dir(options.cfgdir)
+
+
+def get_config_files(options):
+    """ Returns the list of .cfg files to load
+    """
+    thisfunc = str(giveupthefunc())
+    cfgfiles = list(iter_config_files(options))
+    logging.debug(thisfunc + "Number of cfg files = " + str(len(cfgfiles)))
+    return cfgfiles
+
+
+def iter_recorded(iterable, record):
+    """ Passes iterable through unchanged, appending
+    each item to the list record along the way.
+    """
+    for item in iterable:
+        record.append(item)
+        yield item
+
+
+def iter_config_lines(files):
+    """ Lazily yields the lines of every file in files.
+    Since niether us nor Nagios cares about individual files
+    we're going to strip out comments as we go. Only one line
+    is ever held in memory at a time.
+    """
     cfglines = 0
     for f in files:
         with open(f, 'r') as cf:
-            ''' now we're reading the files we actually care about.
-            Since niether us nor Nagios cares about individual files
-            we're going to strip out comments 
-            '''
             for line in cf:
                 cfglines += 1
                 if '#' not in line:
-                    cfgrawtext.append(line)
-    logging.debug(thisfunc + "Number of lines of raw config: " + str(cfglines))
-    return cfgrawtext
+                    yield line
+    logging.debug("iter_config_lines(): Number of lines of raw config: " + str(cfglines))
+
+
+def get_config(options):
+    """ Returns a lazy iterator over the raw config lines
+    of every .cfg file to load
+    """
+    return iter_config_lines(iter_config_files(options))
+
+
+def iter_nag_blocks(raw):
+    """ Single pass block tokenizer. Takes an iterable of raw
+    Nagios config lines and yields a (definition, [(prop, val), ...])
+    tuple as soon as each 'define ... { }' block closes, so memory
+    use is bounded by the size of one block rather than the input.
+    """
+    block = None
+    for line in raw:
+        line = line.replace('\t', ' ')
+        r_def_match = r_def.search(line)
+        if r_def_match:
+            block = (r_def_match.group('defname'), [])
+        elif '}' in line:
+            if block is not None:
+                yield block
+            block = None
+        elif block is not None and line.strip():
+            r_prop_match = r_prop.match(line)
+            val = r_prop_match.group('val')
+            # chop off trailing ';' comments
+            if ';' in val:
+                val = val[:val.rindex(';')]
+            block[1].append((r_prop_match.group('prop'), val))
+
+
+def build_nag_obj(block, sourcefile=None):
+    """ Turns a tokenized (definition, props) block into an object
+    of the matching class (NagObjHost, NagObjService, ... or
+    NagObjFlex for unknown types) remembering the file it was read from.
+    """
+    definition, props = block
+    # create blank new object of the right class for this definition
+    currObj = new_nag_obj(definition, sourcefile)
+    for prop, val in props:
+        if definition == 'timeperiod' and prop not in ncClasses.timeperiodProps:
+            # 'december 25 00:00-24:00' is prop 'december 25', not 'december'
+            split = ncClasses.split_daterange(prop + ' ' + val)
+            if split is not None:
+                prop, val = split
+        # first have to set the prop as a NagObjSuperProp() since this is new prop
+        setattr(currObj, prop, ncClasses.NagObjSuperProp(val))
+    return currObj
+
+
+def iter_nag_objs(raw, sourcefile=None):
+    """ Takes an iterable of raw Nagios config lines and yields
+    a classed object (see build_nag_obj()) as each block closes.
+    """
+    for block in iter_nag_blocks(raw):
+        yield build_nag_obj(block, sourcefile)
+
+
+def iter_file_objs(files):
+    """ Same as iter_nag_objs() but reads files one at a time
+    so every object knows which file it came from.
+    """
+    for f in files:
+        for obj in iter_nag_objs(iter_config_lines([f]), f):
+            yield obj
 
 
 def classify_config(raw):
     ''' Takes raw Nagios config text and processes 
-    it into rudimentary objects (NagObjFlex)
+    it into classed objects (NagObjHost, ... or NagObjFlex)
     properties based on stuff between the {} in the text
     returns a list of those objects
     '''
-    import re
-    # first scrub the rawtext to remove tabs
-    rawtext = []
-    for line in raw:
-        line = line.replace('\t',' ')
-        line = line.strip('\t')
-        rawtext.append(line)
-    
-    r_def = re.compile('(define )(?P<defname>[a-zA-Z_]*)({| *{)')
-    r_end = re.compile('(})')
-    r_prop = re.compile('( *)(?P<prop>[a-zA-Z_]*)( *)(?P<val>.*)')
-    r_valcom = re.compile('(?P<realval>.*)(?P<comment>;.*)')
-    anchors = []
-    # go through and find blocks of definitions and add start/stop points to anchors list
-    for i,line in enumerate(rawtext):
-        r_def_match = re.search(r_def,line)
-        r_end_match = re.search(r_end,line)
-        if r_def_match or r_end_match:
-            anchors.append(i)
-    # logging.debug(str(anchors))
-    anchors.sort(reverse=True)
-    # logging.debug(str(anchors))
-    allobjs = []
-    while True:
-        definition = ''
-        currObj = None
-        # loop through anchors blocks of definitions
-        for ln in range(anchors.pop(),anchors.pop()):
-
-            line = rawtext[ln]
-            r_def_match = re.search(r_def,line)
-            r_prop_match = re.search(r_prop,line)
-            if r_def_match:
-                definition = r_def_match.group('defname')
-                # create blank new flex object with typestring = definition
-                currObj = NagObjFlex(definition)
-            elif r_prop_match and not r_def_match:
-                prop = r_prop_match.group('prop')
-                val = r_prop_match.group('val')
-                r_valcom_match = re.search(r_valcom,val)
-                if r_valcom_match:
-                    val = r_valcom_match.group('realval')
-                # first have to set the prop as a NagObjSuperProp() since this is new prop
-                setattr(currObj,prop,ncClasses.NagObjSuperProp(val))
-        allobjs.append(currObj)
-        # print cfgformat.format(definition,prop,val)
-        if len(anchors) < 1:
-            break
-    cfgformat = '{0:30}{1}'
-    '''
-    for obj in allobjs:
-        for thing in obj.dumpself():
-            logging.debug(cfgformat.format(*thing))
-        logging.debug(' ')
-    '''
+    allobjs = list(iter_nag_objs(raw))
     logging.debug("Number of base objects: " + str(len(allobjs)))
     return allobjs
 
 
+def split_cfg_file(filename, size, chunkbytes):
+    """ Splits filename into (filename, start, end) byte ranges of
+    roughly chunkbytes each. Every boundary is moved forward to the
+    next 'define' line so each range holds only whole blocks. An end
+    of None means 'to the end of the file'.
+    """
+    if size <= chunkbytes:
+        return [(filename, 0, None)]
+    starts = [0]
+    with open(filename, 'r') as cf:
+        target = chunkbytes
+        while target < size:
+            cf.seek(target)
+            pos = target + len(cf.readline())  # skip the partial line
+            while True:
+                line = cf.readline()
+                if not line:
+                    pos = size
+                    break
+                if '#' not in line and r_def.search(line.replace('\t', ' ')):
+                    break
+                pos += len(line)
+            if pos >= size:
+                break
+            starts.append(pos)
+            target = pos + chunkbytes
+    ends = starts[1:] + [None]
+    return [(filename, start, end) for start, end in zip(starts, ends)]
+
+
+def iter_chunk_lines(filename, start, end):
+    """ Same as iter_config_lines() but only for the byte
+    range [start, end) of a single file.
+    """
+    with open(filename, 'r') as cf:
+        cf.seek(start)
+        pos = start
+        while end is None or pos < end:
+            line = cf.readline()
+            if not line:
+                break
+            pos += len(line)
+            if '#' not in line:
+                yield line
+
+
+def parse_cfg_chunk(chunk):
+    """ Tokenizes one (filename, start, end) chunk into a list of
+    (definition, props) blocks. This is the unit of work handed to
+    the process pool. Plain tuples of strings are far cheaper to
+    send back to the parent than fully built objects.
+    """
+    return chunk[0], list(iter_nag_blocks(iter_chunk_lines(*chunk)))
+
+
+def iter_cfg_chunks(files):
+    """ Lazily splits each file in files into parsing chunks
+    """
+    for f in files:
+        for chunk in split_cfg_file(f, os.path.getsize(f), parallelChunkBytes):
+            yield chunk
+
+
+def classify_config_parallel(files, jobs):
+    """ Fans tokenizing out across a pool of jobs processes, one task
+    per file (or per chunk of a large file), and builds the objects
+    in the parent. Pool.imap hands results back in submission order
+    so the object order is the same as the serial parser's, and it
+    pulls from files lazily so parsing starts while discovery is
+    still walking directories.
+    """
+    thisfunc = str(giveupthefunc())
+    pool = multiprocessing.Pool(jobs)
+    allobjs = []
+    try:
+        for sourcefile, blocks in pool.imap(parse_cfg_chunk, iter_cfg_chunks(files)):
+            # values arrive as fresh unpickled strings; build_nag_obj()
+            # puts them through the value pool like the serial parser
+            allobjs.extend([build_nag_obj(block, sourcefile) for block in blocks])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    logging.debug(thisfunc + "Number of base objects: " + str(len(allobjs)))
+    return allobjs
+
+
+def load_config(options, files=None):
+    """ Parses every cfg file into objects, using a process
+    pool when options.jobs > 1 and the config is big enough
+    to be worth it. Otherwise streams through the serial parser.
+    """
+    thisfunc = str(giveupthefunc())
+    if files is None:
+        files = iter_config_files(options)
+    files = iter(files)
+    jobs = getattr(options, 'jobs', 1) or 1
+    # nothing we build here is garbage, so don't let the cyclic
+    # collector rescan the growing object list over and over
+    gcwasenabled = gc.isenabled()
+    gc.disable()
+    try:
+        if jobs > 1:
+            # only look as far ahead as it takes to tell it's not a tiny config
+            peeked = []
+            totalbytes = 0
+            for f in files:
+                peeked.append(f)
+                totalbytes += os.path.getsize(f)
+                if totalbytes >= parallelMinBytes:
+                    return classify_config_parallel(itertools.chain(peeked, files), jobs)
+            logging.debug(thisfunc + "Only %s bytes of config, parsing serially" % totalbytes)
+            files = peeked
+        allobjs = list(iter_file_objs(files))
+        logging.debug(thisfunc + "Number of base objects: " + str(len(allobjs)))
+        return allobjs
+    finally:
+        if gcwasenabled:
+            gc.enable()
+
+
 def morph(nco):
-    classed = []
-    for thing in nco.nagObjs:
-        try:
-            # logging.debug("morph(): pre-morph thing classification: '%s'" % thing.classification.value)
-            newthing = thing.morph_to_classed()
-            # logging.debug("morph(): post-morph newthing classification: '%s'" % newthing.classification.value)
-            if newthing is not None:
-                classed.append(newthing)
-        except Exception as ar:
-            # print "--"
-            logging.debug(str(ar))
-    # logging.debug("morph(): Finished running things.morph_to_classed(), attempting nco.dump_s(tats()...")
-    # logging.debug(nco.dump_stats())
-    # logging.debug("morph(): Finished nco.dump_stats(), now running nco.purge()....")
-    nco.purge()
-    # logging.debug("morph(): Finished nco.purge(), trying nco.dump_stats()...")
-    # logging.debug(nco.dump_stats())
-    for thing in classed:
-        nco.nagObjs.append(thing)
-
-    # logging.debug("Now leaving morph()...")
+    """ Used to swap every NagObjFlex for its classed equivalent.
+    The parser now builds classed objects directly (see build_nag_obj())
+    so this is kept only so older callers keep working.
+    """
     return nco
 
 
-def dedupe_sort_list_of_dict(lod, dedupe_field=None, order_field=None):
-    """ Takes a list of dictionaries and
-    eliminates duplicates that have the 
-    same dedupeField.
-    Based on a stackoverflow answer by 
-    http://stackoverflow.com/users/885973/turkesh-patel
+def template_ancestors(nco, name, memo, stack=()):
+    """ Returns the linearized ancestors of the template called name
+    (not including name itself). Each template's chain is only worked
+    out once; after that it comes out of memo.
     """
-    '''
-    E.g.,
-    templatelist = [    {'tpname': 'TPL-windows-server',    'idx': 1}, 
-                        {'tpname': 'TPL-host-pnp',          'idx': 2}, 
-                        {'tpname': 'buddy',                 'idx': 3}, 
-                        {'tpname': 'generic-host',          'idx': 4}, 
-                        {'tpname': 'TPL-windows-server',    'idx': 5}, 
-                        {'tpname': 'TPL-host-pnp',          'idx': 6}, 
-                        {'tpname': 'generic-host',          'idx': 7},
-                    ]
-    dedupe_sort_list_of_dict(templatelist,dedupeField='tpname',orderField='idx')
-
-    '''
-    # first dedupe
-    getvals = operator.itemgetter(dedupe_field)
-    lod.sort(key=getvals)
-    result = []
-    for k, g in itertools.groupby(lod, getvals):
-        result.append(g.next())
-    # now sort
-    getvals = operator.itemgetter(order_field)
-    # since Nagios inheritance works left to right and we're 'popping' to inherit...
-    result.sort(key=getvals,reverse=True) 
-    lod[:] = result
-    msg = pprint.pformat(lod)
-    # logging.debug(msg + '\n')
-    return(lod)
-
-
-def discover_template_chain(nco):
-    templates = []
-    for thing in nco.nagObjs:
+    try:
+        return memo[name]
+    except KeyError:
+        pass
+    uses = []
+    for tpl in nco.get_templates(name):
         try:
-            if thing.name:
-                templates.append(thing)
-        except:
+            uses.extend(ncClasses.split_use(tpl.use.value))
+        except AttributeError:
             pass
-    logging.debug("Number of templates = " + str(len(templates)))
+    ancestors = linearize_templates(nco, uses, memo, stack + (name,))
+    memo[name] = ancestors
+    return ancestors
+
+
+def linearize_templates(nco, uses, memo, stack=()):
+    """ Returns the order Nagios inherits in for an object that uses
+    the templates in uses: each template followed by its own ancestors,
+    depth first and left to right, keeping only the first time each
+    template shows up. stack holds the templates currently being
+    resolved so a template that (indirectly) uses itself is reported
+    and cut out of the chain instead of recursing forever.
+    """
+    chain = []
+    seen = set()
+    for name in uses:
+        if name in stack:
+            logging.warning("Template cycle: %s" % ' -> '.join(stack + (name,)))
+            continue
+        for tpname in (name,) + template_ancestors(nco, name, memo, stack):
+            if tpname not in seen:
+                seen.add(tpname)
+                chain.append(tpname)
+    return tuple(chain)
+
+
+def discover_template_chain(nco, objs=None):
+    """ Works out the template chain of every object in objs
+    (default all of nco.nagObjs). The chain is a tuple of template
+    names, nearest (highest priority) first, and is any depth.
+    """
+    if objs is None:
+        objs = nco.nagObjs
+    logging.debug("Number of templates = " + str(len(nco.indexes['name'])))
+    memo = {}  # template name: tuple of its ancestors
     count = 0
-    count_usingtpls = 0
-    ''' This is a sloppy way of doing this. It only works to discover inheritance
-    for as many levels as there are loops. I think it will go down 5 or 6 levels 
-    unless we add more loops. Nagios inherently supports infinite levels of inheritance
-    so nagConf becomes the limitation here. 
-    '''
-    for thing in nco.nagObjs:
-        i_tpls = [] # holds indexed templates
-        seq = 0  # the index number so we can track inheritance priority.
+    for thing in objs:
         try:
-            tpls = thing.use.value.split(',')
-            count_usingtpls += 1
-            for tp in tpls:
-                seq += 1
-                i_tpls.append({'idx': seq, 'tpname': tp})
-            for thing2 in templates:
-                try:
-                    if thing2.name.value in tpls:
-                        tpls2 = thing2.use.value.split(',')
-                        for a in tpls2:
-                            tpls.append(a)
-                            seq += 1
-                            i_tpls.append({'idx': seq, 'tpname': a})
-                        for thing3 in templates:
-                            try:
-                                if thing3.name.value in tpls2:
-                                    tpls3 = thing3.use.value.split(',')
-                                    for b in tpls3:
-                                        tpls.append(b)
-                                        seq += 1
-                                        i_tpls.append({'idx': seq, 'tpname': b})
-                                    for thing4 in templates:
-                                        try:
-                                            if thing4.name.value in tpls3:
-                                                tpls4 = thing4.use.value.split(',')
-                                                for c in tpls4:
-                                                    tpls.append(c)
-                                                    seq += 1
-                                                    i_tpls.append({'idx': seq, 'tpname': c})
-                                                for thing5 in templates:
-                                                    try:
-                                                        if thing5.name.value in tpls4:
-                                                            tpls5 = thing5.use.value.split(',')
-                                                            for d in tpls5:
-                                                                tpls.append(d)
-                                                                seq += 1
-                                                                i_tpls.append({'idx': seq, 'tpname': d})
-                                                            for thing6 in templates:
-                                                                try:
-                                                                    if thing6.name.value in tpls5:
-                                                                        tpls6 = thing6.use.value.split(',')
-                                                                        for e in tpls5:
-                                                                            tpls.append(e)
-                                                                            seq += 1
-                                                                            i_tpls.append({'idx': seq, 'tpname': e})
-                                                                except:
-                                                                    logging.debug("reached max template " +
-                                                                                  "chain depth (max 5)")
-                                                    except:
-                                                        pass
-                                        except:
-                                            pass
-                            except:
-                                pass
-                except:
-                    pass
-            # remove duplicates
-            i_tpls = dedupe_sort_list_of_dict(i_tpls, dedupe_field='tpname', order_field='idx')
-            # now strip out extra blank space chars
-            for tplll in i_tpls:
-                try:
-                    tplll['tpname'] = tplll.get('tpname').rstrip(' ')
-                except:
-                    pass
-            thing.templateChain.value = i_tpls
-            # logging.debug("Discovered template chain: " )
-            # for tp in i_tpls:
-                # logging.debug("\t\t %s" % str(tp))
-            count += 1
-        except Exception as el:
-            # Slogging.debug(str(el))
-            pass
-    logging.debug("discover_template_chain(): Discovered %s chains." % str(count))
-    logging.debug("discover_template_chain(): Number of objects with the 'use' statement: %s" % str(count_usingtpls))
+            uses = ncClasses.split_use(thing.use.value)
+        except AttributeError:
+            continue
+        try:
+            # a template can't inherit from itself
+            stack = (thing.name.value,)
+        except AttributeError:
+            stack = ()
+        thing.templateChain.value = linearize_templates(nco, uses, memo, stack)
+        count += 1
+    logging.debug("discover_template_chain(): Resolved %s distinct templates." % str(len(memo)))
+    logging.debug("discover_template_chain(): Number of objects with the 'use' statement: %s" % str(count))
     return nco
 
 
-def inherit_from_chain(nco):
-    """ Takes the template chain and cycles through
-    it in reverse overriding properties. 
+# set in each inheritance worker process by init_inherit_worker()
+inheritFlatMaps = None
+
+
+def init_inherit_worker(flatmaps):
+    """ Pool initializer: every worker gets the read only flattened
+    templates ({chain: flat}) once instead of with every task.
     """
-    # lists to hold templates and users of templates
-    tpls = []
-    tpls_strings = []
-    tplsAndUsers = []
-    users = []
-    for obj in nco.nagObjs:
-        try:
-            if obj.name.value and obj.use.value:
-                # go ahead and strip out spaces in the object's name field
-                obj.name.value = obj.name.value.rstrip(' ')
-                # logging.debug("Found template AND user with name = '%s'" % obj.name.value)
-                tplsAndUsers.append(obj)
-                tpls_strings.append(obj.name.value)
-        except:
-            pass
-    for obj in nco.nagObjs:
-        try:
-            # only templates have the .name property
-            if obj.name.value and obj.name.value not in tpls_strings:
-                obj.name.value = obj.name.value.rstrip(' ')
-                # logging.debug("Found original template with name = %s" % obj.name.value)
-                tpls.append(obj)
-        except Exception as er:
-            # logging.debug("Exception filtering templates: " + str(er))
-            pass
-        try:
-            # only things using templates have the .use property
-            if obj.use.value:
-                users.append(obj)
-        except:
-            pass
-    logging.debug("Len(tpls): %s" % str(len(tpls)))
-    logging.debug("Len(users): %s" % str(len(users)))
-    count_copies = 0
-
-    # now combine all templates into one list
-    for t in tplsAndUsers:
-        tpls.append(t)
-    for user in tpls:
-        # if they have a template chain...
-        logging.debug("Working on template with name: " + user.name.value)
-        if len(user.templateChain.value) >= 1:
-            # logging.debug("\tlen(user.templateChain.value): " + str(len(user.templateChain.value)))
-            while True:
-                try:
-                    working = user.templateChain.value.pop()
-                    # logging.debug("\tSearching for template with name: '%s' ..." % working.get('tpname'))
-                except Exception as dog:
-                    # logging.debug("\tException popping from templateChain: " + str(dog))
-                    break
-                # cycle through the template list
-                found = False
-                for tpl in tpls:
-                    # find the matching template
-                    if working.get('tpname') == tpl.name.value:
-                        found = True
-                        # find all set properties from the template, make that list attr_to_copy
-                        attrs_to_copy = tpl.display_filter(transfer=True)
-                        
-                        # logging.debug("\t\tCopying properties from: " + working.get('tpname'))
-                        for prop in attrs_to_copy:
-                            val = getattr(getattr(tpl,prop),'value')
-                            if val is not '':
-                                msg = "\t\t\t%s::%s (%s) came from %s" % (working.get('idx'),prop,val,tpl.name.value)
-                                user.inheritanceLog.value.append(msg)
-                                try:
-                                    existingValue = getattr(getattr(user,prop), 'value', val)
-                                    if existingValue == '':
-                                        raise Exception
-                                    elif '+' in existingValue:
-                                        
-                                        # must honor nagios additive property
-                                        # strip out the '+' from the string
-                                        existingValue = existingValue.strip('+')
-                                        newValue = existingValue + ',' + val
-                                        
-                                        # set the new value
-                                        setattr(getattr(user,prop),'value',newValue)
-                                        # record the history chain
-                                        tHist = getattr(getattr(user,prop), 'inheritanceHistory')
-                                        tHist.append(tpl.name.value)
-                                        setattr(getattr(user,prop), 'inheritanceHistory', tHist)
-                                    else:                                    
-                                        # logging.debug("\t\t\t\tFound existing propery '%s',
-                                        # tracking chain but not changing..." % prop)
-                                        # pull in existing inheritanceHistory if any
-                                        tHist = getattr(getattr(user, prop), 'inheritanceHistory')
-                                        tHist.append(tpl.name.value)
-                                        setattr(getattr(user, prop), 'inheritanceHistory', tHist)
-                                except:
-                                    tempObjSuperProp = ncClasses.NagObjSuperProp(val,
-                                                                                 explicitInheritance=True,
-                                                                                 donor=tpl.name.value)
-                                    setattr(user, prop, tempObjSuperProp)
-                                    count_copies += 1
-                # logging.debug('\t\t\t\tFound: ' + str(found))
-            general =  user.classification.value
-            # logging.debug("History chain for '%s' with name '%s': " % (general,user.name.value))
-            for propString in user.display_filter(transfer=True):
-                prop = getattr(user, propString)
-                try:
-                    histFormat = "{0:55}{1:100}{2:}"
-                    ider = "'%s.%s'" % (general, propString)
-                    hist = "'" + str(prop.return_history()) + "'"
-                    msg = histFormat.format(ider, "'" + prop.value + "'", hist)
-                    # logging.debug('\t\t' + msg)
-                except:
-                    pass
-    # now loop through all the rest of the objects
-    for user in users:
-        # logging.debug("Working on user with uid: " + user.get_uid())
-        # if they have a template chain...
-        try:
-            user.name.value
-            # logging.debug("User has name '%s', which means it's a template so skipping..." % user.name.value)
+    global inheritFlatMaps
+    inheritFlatMaps = flatmaps
+
+
+def inherit_chunk(task):
+    """ Runs in a pool worker. task is (start, [(chain, own), ...])
+    where own holds the (prop, value) pairs an object sets explicitly
+    that its chain hands down too. Returns start and, per object,
+    what merging the chain into those values gives as
+    {prop: (value, history, explicitValue)}.
+    """
+    start, items = task
+    results = []
+    for chain, own in items:
+        flat = inheritFlatMaps[chain]
+        merged = {}
+        for prop, value in own:
+            existing = ncClasses.NagObjSuperProp(value)
+            ncClasses.merge_donors(existing, flat[prop])
+            merged[prop] = (existing.value, existing._history, getattr(existing, 'explicitValue', None))
+        results.append(merged)
+    return start, results
+
+
+def iter_inherit_tasks(cache, leaves, chunksize):
+    """ Lazily cuts leaves into inherit_chunk() tasks
+    """
+    for start in range(0, len(leaves), chunksize):
+        items = []
+        for user in leaves[start:start + chunksize]:
+            chain = user.templateChain.value
+            flat = cache.flatten(chain)[0]
+            own = tuple((prop, p.value) for prop, p in user.__dict__.items()
+                        if prop in flat and p.value != '')
+            items.append((chain, own))
+        yield start, items
+
+
+def inherit_leaves_parallel(cache, leaves, jobs):
+    """ Merges the template chains of leaves (objects that aren't
+    templates) across a pool of jobs processes. The templates are
+    all resolved and every chain flattened in the parent first so
+    the workers only need the flattened maps, which go to each
+    worker once. The results are applied back in the parent.
+    """
+    thisfunc = str(giveupthefunc())
+    for user in leaves:
+        cache.flatten(user.templateChain.value)
+    pool = multiprocessing.Pool(jobs, init_inherit_worker, (cache.flat_maps(),))
+    try:
+        for start, results in pool.imap(inherit_chunk, iter_inherit_tasks(cache, leaves, parallelInheritChunk)):
+            for user, merged in zip(leaves[start:start + len(results)], results):
+                cache.apply(user, merged)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    logging.debug(thisfunc + "Inherited %s objects across %s processes" % (len(leaves), jobs))
+
+
+def inherit_from_chain(nco, objs=None, cow=False, jobs=1):
+    """ Hands template properties down the template chains. Only the
+    objects in objs (default all of nco.nagObjs) inherit but every
+    template in nco can be inherited from. Each distinct chain is
+    flattened once (see ncClasses.NagTemplateCache) and merged into
+    every object that uses it. With cow=True inherited properties
+    are shared per chain and read through instead of copied. With
+    jobs > 1 and enough objects the merging is spread over a
+    process pool.
+    """
+    if objs is None:
+        objs = nco.nagObjs
+        pending = None
+    else:
+        todo = set(id(obj) for obj in objs)
+        pending = set(id(tpl) for tpl in nco.get_templates() if id(tpl) in todo)
+    cache = ncClasses.NagTemplateCache(nco, pending, cow)
+    logging.debug("Len(tpls): %s" % str(len(cache.pending)))
+    leaves = []
+    for user in objs:
+        if not user.templateChain.value:
             continue
-        except:
-            if len(user.templateChain.value) >= 1:
-                # logging.debug("\tlen(user.templateChain.value): " + str(len(user.templateChain.value)))
-                while True:
-                    try:
-                        working = user.templateChain.value.pop()
-                        # logging.debug("\tSearching for template with name: '%s' ..." % working.get('tpname'))
-                    except Exception as dog:
-                        # logging.debug("\tException popping from templateChain: " + str(dog))
-                        break
-                    # cycle through the template list
-                    found = False
-                    for tpl in tpls:
-                        # find the matching template
-                        if working.get('tpname') == tpl.name.value:
-                            found = True
-                            # find all set properties from the template, make that list attr_to_copy
-                            attrs_to_copy = tpl.display_filter(transfer=True)
-                            # logging.debug("\t\tCopying properties from: " + working.get('tpname'))
-                            for prop in attrs_to_copy:
-                                val = getattr(getattr(tpl, prop), 'value')
-                                if val is not '':
-                                    msg = "\t\t\t%s::%s (%s) came from %s" % (working.get('idx'),
-                                                                              prop,
-                                                                              val,
-                                                                              tpl.name.value)
-                                    user.inheritanceLog.value.append(msg)
-                                    try:
-                                        existingValue = getattr(getattr(user, prop), 'value', val)
-                                        if existingValue == '':
-                                            raise Exception
-                                        elif '+' in existingValue:
-                                            #print("found a +")
-                                            # must honor nagios additive property
-                                            # strip out the '+' from the string
-                                            existingValue = existingValue.strip('+')
-                                            newValue = existingValue + ',' + val
-                                            # set the new value
-                                            setattr(getattr(user, prop), 'value', newValue)
-                                            # record the history chain
-                                            tHist = getattr(getattr(user, prop), 'inheritanceHistory')
-                                            tHist.append(tpl.name.value)
-                                            setattr(getattr(user, prop), 'inheritanceHistory', tHist)
-                                        else:
-                                            # pull in existing inheritanceHistory if any
-                                            tHist = getattr(getattr(user, prop), 'inheritanceHistory')
-                                            tHist.append(tpl.name.value)
-                                            setattr(getattr(user, prop), 'inheritanceHistory', tHist)
-                                    except:
-                                        tempObjSuperProp = ncClasses.NagObjSuperProp(val,
-                                                                                     explicitInheritance=True,
-                                                                                     donor=tpl.name.value)
-                                        setattr(user, prop, tempObjSuperProp)
-                                        count_copies += 1
-                    # logging.debug('\t\t\t\tFound: ' + str(found))
-                general = user.classification.value
-                # logging.debug("History chain for '%s': " % user.get_uid())
-                for propString in user.display_filter(transfer=True):
-                    prop = getattr(user,propString) 
-                    try:
-                        histFormat = "{0:55}{1:100}{2:}"
-                        ider = "'%s.%s'" % (general,propString)
-                        hist = "'" + str(prop.return_history()) + "'"
-                        msg = histFormat.format(ider, "'" + prop.value + "'", hist)
-                        # logging.debug('\t\t' + msg)
-                    except:
-                        pass
-
-    logging.debug("inherit_from_chain(): Number of object property copies: %s" % str(count_copies))
+        if 'name' in user.__dict__:
+            # templates are resolved in dependency order
+            cache.resolve(user)
+        else:
+            leaves.append(user)
+    logging.debug("Len(users): %s" % str(len(leaves)))
+    if jobs > 1 and len(leaves) >= parallelMinObjects:
+        inherit_leaves_parallel(cache, leaves, jobs)
+    else:
+        for user in leaves:
+            cache.apply(user)
+    logging.debug("inherit_from_chain(): Flattened %s distinct template chains" % str(len(cache.flattened)))
+    logging.debug("inherit_from_chain(): Number of object property copies: %s" % str(cache.copies))
     return nco
 
 
+def shard_name(name):
+    """ Makes name safe to use as a file name
+    """
+    return re.sub(r'[^\w.-]', '_', name) or '_'
+
+
+def shard_objects(nco, layout='type'):
+    """ Splits nco.nagObjs into the files of a config tree and
+    returns [(relative path, [objs])] with the objects in file order.
+    layout 'type' gives one file per object type, 'hostgroup' one
+    file per hostgroup holding its hosts (by their first hostgroup)
+    and their services (by their first host or hostgroup) with
+    everything else by type, and a number n gives files of n objects.
+    """
+    shards = {}
+    order = []
+
+    def add(relpath, obj):
+        if relpath not in shards:
+            shards[relpath] = []
+            order.append(relpath)
+        shards[relpath].append(obj)
+
+    if layout not in treeLayouts:
+        size = int(layout)
+        for i, obj in enumerate(nco.nagObjs):
+            add(os.path.join('objects', 'objects_%05d.cfg' % (i // size)), obj)
+        return [(relpath, shards[relpath]) for relpath in order]
+    hostshard = {}
+    if layout == 'hostgroup':
+        for host in nco.get_by_class('host'):
+            hostgroups = host.get_prop('hostgroups')
+            hostname = host.get_prop('host_name')
+            if hostgroups is None or hostname is None:
+                continue
+            groups = ncClasses.split_use(hostgroups.value.strip('+'))
+            if groups:
+                for name in ncClasses.split_use(hostname.value):
+                    hostshard.setdefault(name, groups[0])
+    for obj in nco.nagObjs:
+        group = None
+        if layout == 'hostgroup' and obj.get_prop('name') is None:
+            classification = obj.classification.value
+            if classification == 'host':
+                hostname = obj.get_prop('host_name')
+                if hostname is not None:
+                    group = hostshard.get(hostname.value.split(',')[0].strip())
+            elif classification == 'service':
+                hostname = obj.get_prop('host_name')
+                hostgroupname = obj.get_prop('hostgroup_name')
+                if hostname is not None and hostname.value:
+                    group = hostshard.get(hostname.value.split(',')[0].strip())
+                elif hostgroupname is not None and hostgroupname.value:
+                    group = hostgroupname.value.split(',')[0].strip()
+        if group is not None:
+            add(os.path.join('hostgroups', shard_name(group) + '.cfg'), obj)
+        else:
+            add(shard_name(obj.typestring.value) + '.cfg', obj)
+    return [(relpath, shards[relpath]) for relpath in order]
+
+
+outputTree = None
+
+
+def init_tree_worker(nco, outdir, shards, expand, manifest):
+    """ Pool initializer: every worker gets the config, the shard
+    layout and the output manifest once (for free, the pool forks)
+    instead of with every task.
+    """
+    global outputTree
+    outputTree = (nco, outdir, shards, expand, manifest)
+
+
+def write_shard(index):
+    """ Streams shard number index of outputTree to a temp file next
+    to where it belongs ('.cfg.tmp', which Nagios doesn't read),
+    hashing it on the way, and deletes that again if its file already
+    holds that text (see ncClasses.current_cfg_entry()). Returns
+    (index, temp file name or None if unchanged, summary) with the
+    NagConfig.render_cfg_file() summary plus 'entry', the file's new
+    manifest entry when it's unchanged.
+    """
+    nco, outdir, shards, expand, manifest = outputTree
+    relpath, objs = shards[index]
+    filename = os.path.join(outdir, relpath)
+    dirname = os.path.dirname(filename)
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+    tmpname = filename + '.tmp'
+    rendered = nco.render_cfg_file(tmpname, expand, objs)
+    rendered['entry'] = ncClasses.current_cfg_entry(filename, rendered['md5'], rendered['digests'],
+                                                    manifest.get(relpath))
+    if rendered['entry'] is not None:
+        os.remove(tmpname)
+        return index, None, rendered
+    return index, tmpname, rendered
+
+
+def write_cfg_tree(nco, outdir, layout='type', expand=False, jobs=1):
+    """ Writes nco out as a tree of .cfg files under outdir (see
+    shard_objects() for the layouts), rendering the files across a
+    pool of jobs processes. Each file is streamed to a temp file and
+    hashed in one pass, and only replaces what is there when that
+    differs, going by the output manifest in outdir (see
+    write_shard()). The temp files are only renamed into place once
+    all of them have been written, so a failed render leaves the old
+    tree alone. No temp files are left behind. Files the manifest lists
+    that this tree no longer has are deleted (see prune_cfg_tree()).
+    Only each file is replaced atomically, not the tree: until the
+    last rename (or after a failed one) the tree is a mix of old and
+    new files, so reload Nagios after this returns, not during.
+    Returns {'files', 'objects', 'bytes', 'seconds', 'written',
+    'skipped', 'changed', 'pruned'} with 'changed' the number of
+    objects whose text changed.
+    """
+    thisfunc = str(giveupthefunc())
+    start = time.time()
+    shards = shard_objects(nco, layout)
+    manifest = load_output_manifest(outdir)
+    init_tree_worker(nco, outdir, shards, expand, manifest)
+    results = []
+    changed = filesWritten = 0
+    try:
+        if jobs > 1 and len(shards) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(shards)), init_tree_worker, outputTree)
+            try:
+                for result in pool.imap_unordered(write_shard, range(len(shards))):
+                    results.append(result)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            for index in range(len(shards)):
+                results.append(write_shard(index))
+        for index, tmpname, rendered in sorted(results):
+            relpath = shards[index][0]
+            entry = rendered['entry']
+            if tmpname is not None:
+                entry = ncClasses.commit_cfg_file(os.path.join(outdir, relpath), tmpname,
+                                                  rendered['md5'], rendered['digests'])
+                filesWritten += 1
+            changed += ncClasses.count_changed(rendered['digests'], manifest.get(relpath))
+            manifest[relpath] = entry
+        pruned = prune_cfg_tree(outdir, manifest, [path for path, objs in shards])
+    except:
+        # every temp file goes, even ones finished after a failure
+        for relpath, objs in shards:
+            tmpname = os.path.join(outdir, relpath) + '.tmp'
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        raise
+    finally:
+        init_tree_worker(None, None, None, None, None)
+    save_output_manifest(outdir, manifest)
+    summary = {'files': len(results), 'objects': sum(r[2]['objects'] for r in results),
+               'bytes': sum(r[2]['bytes'] for r in results), 'seconds': time.time() - start,
+               'written': filesWritten, 'skipped': len(results) - filesWritten, 'changed': changed,
+               'pruned': pruned}
+    logging.debug(thisfunc + "Wrote %(written)s of %(files)s files, %(changed)s objects changed, "
+                  "deleted %(pruned)s stale files" % summary)
+    return summary
+
+
+def prune_cfg_tree(outdir, manifest, relpaths):
+    """ Deletes the files manifest lists that aren't in relpaths
+    (left there by an earlier layout or a bigger config, Nagios would
+    read their objects twice) and drops their entries, along with any
+    directory that leaves empty. A file that can't be deleted keeps
+    its entry so the next write tries again. Returns how many went.
+    """
+    thisfunc = str(giveupthefunc())
+    pruned = 0
+    for relpath in sorted(set(manifest) - set(relpaths)):
+        filename = os.path.join(outdir, relpath)
+        try:
+            os.remove(filename)
+        except OSError as e:
+            if os.path.exists(filename):
+                logging.warning(thisfunc + "Unable to delete stale '%s': %s" % (filename, str(e)))
+                continue
+        del manifest[relpath]
+        pruned += 1
+        dirname = os.path.dirname(relpath)
+        while dirname:
+            try:
+                os.rmdir(os.path.join(outdir, dirname))
+            except OSError:
+                break
+            dirname = os.path.dirname(dirname)
+    return pruned
+
+
+def load_output_manifest(outdir):
+    """ Returns the output manifest in outdir, {path relative to
+    outdir: (size, mtime, md5, object digests)} of the files written
+    there, or {} if there isn't a usable one.
+    """
+    thisfunc = str(giveupthefunc())
+    try:
+        with open(os.path.join(outdir, outputManifestName), 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError) as e:
+        logging.debug(thisfunc + "No output manifest in '%s': %s" % (outdir, str(e)))
+        return {}
+
+
+def save_output_manifest(outdir, manifest):
+    """ Writes manifest as outdir's output manifest. Like the
+    snapshot it goes through a temp file and a failure only costs
+    re-hashing the files next time.
+    """
+    thisfunc = str(giveupthefunc())
+    filename = os.path.join(outdir, outputManifestName)
+    try:
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        logging.warning(thisfunc + "Unable to write output manifest '%s': %s" % (filename, str(e)))
+
+
+def index_fingerprints(nco):
+    """ Returns {uid: {fingerprint: [(position, obj)]}} for every
+    object in nco (see NagObjFlex.get_uid() and fingerprint()).
+    """
+    index = {}
+    for position, obj in enumerate(nco.nagObjs):
+        index.setdefault(obj.get_uid(), {}).setdefault(obj.fingerprint(), []).append((position, obj))
+    return index
+
+
+def diff_configs(old, new):
+    """ Compares two NagConfigs with a hash join on object uid and
+    fingerprint, so it's linear in the number of objects. Returns
+    {'added': [objs], 'removed': [objs], 'changed': [(old, new)],
+    'unchanged': count}. Objects sharing a uid (e.g., escalations)
+    are matched up by fingerprint first and then in file order.
+    """
+    oldindex = index_fingerprints(old)
+    leftover = {}  # uid: new objects without an identical old one
+    order = []
+    unchanged = 0
+    for obj in new.nagObjs:
+        uid = obj.get_uid()
+        same = oldindex.get(uid, {}).get(obj.fingerprint())
+        if same:
+            same.pop(0)
+            unchanged += 1
+        else:
+            if uid not in leftover:
+                leftover[uid] = []
+                order.append(uid)
+            leftover[uid].append(obj)
+    diff = {'added': [], 'removed': [], 'changed': [], 'unchanged': unchanged}
+    for uid in order:
+        olds = [previous for position, previous in sorted(item for same in oldindex.pop(uid, {}).values()
+                                                          for item in same)]
+        news = leftover[uid]
+        diff['changed'].extend(zip(olds, news))
+        diff['added'].extend(news[len(olds):])
+        diff['removed'].extend(olds[len(news):])
+    gone = sorted(item for byprint in oldindex.values() for same in byprint.values() for item in same)
+    diff['removed'].extend(obj for position, obj in gone)
+    return diff
+
+
+def display_diff(diff):
+    """ Formats a diff_configs() result, with the properties that
+    differ for every changed object.
+    """
+    msg = "Added (%s):\n" % len(diff['added'])
+    for obj in diff['added']:
+        msg += "    + %s\n" % obj.get_uid()
+    msg += "Removed (%s):\n" % len(diff['removed'])
+    for obj in diff['removed']:
+        msg += "    - %s\n" % obj.get_uid()
+    msg += "Changed (%s):\n" % len(diff['changed'])
+    for oldobj, newobj in diff['changed']:
+        msg += "    ~ %s\n" % newobj.get_uid()
+        oldvalues = dict((attr, prop.value) for attr, prop in oldobj.set_props(transfer=True))
+        newvalues = dict((attr, prop.value) for attr, prop in newobj.set_props(transfer=True))
+        for attr in sorted(set(oldvalues) | set(newvalues)):
+            if oldvalues.get(attr, '') != newvalues.get(attr, ''):
+                msg += "        %-30s'%s' -> '%s'\n" % (attr, oldvalues.get(attr, ''), newvalues.get(attr, ''))
+    msg += ("%s added, %s removed, %s changed, %s unchanged" %
+            (len(diff['added']), len(diff['removed']), len(diff['changed']), diff['unchanged']))
+    return msg
+
+
 def get_stats(nco):
     """
     Gets statistics about the current working object database.
@@ -541,11 +912,57 @@ def helpmenu():
 |
 | cmd 'fe+<filename>.cfg'   will generate nagios config file with expanded inheritance
 |
+| cmd 'fd+<dir>[;<layout>]' will generate a tree of nagios config files
+|                           compact under dir, one file per type (layout
+|                           'type', the default), per 'hostgroup' or per
+|                           <number> objects
+|
+| cmd 'fde+<dir>[;<layout>]' same with expanded inheritance
+|
+| cmd 'r'                   will reparse any .cfg files changed on disk
+|
 | cmd 'l+<keyword>'         will display all objects in memory of that 
 |                           keyword (e.g., 'host')
 |
 | cmd 's+<contactname>'     will show all services and hosts with
 |                           notifications going to that contact.
+|
+| cmd 's+*'                 will count the notifications for every contact
+|
+| cmd 'o+<host_name>'       will display the objects for that host
+| cmd 'o+<host>;<service>'  will display just that service of the host
+|
+| cmd 'c'                   will count the actual checks (one per host a
+|                           service is on) per template and hostgroup
+|
+| cmd 'p[+<prop>]'          will simulate today's active checks (within
+|                           their check_period) and show the checks per
+|                           second, per template (or per
+|                           value of prop, e.g. 'p+check_command'). Much
+|                           faster with numpy installed
+|
+| cmd 'p+<prop>;<template>;<prop>=<value>[;<prop>=<value>...]'
+|                           will show how editing the template would
+|                           change that load, without keeping the edit
+|
+| cmd 'tp+<timeperiod>[;<YYYY-MM-DD HH:MM>]'
+|                           will show whether the timeperiod is in effect
+|                           now (or then) and its next transitions
+|
+| cmd 'g+<name>'            will show the members of the groups called name
+|                           and the groups a host, contact or
+|                           '<host>;<service>' called name is in
+|
+| cmd 'w+<host>[;<service>];<prop>'
+|                           will explain where the value of prop came from
+|                           (a template name works in place of a host)
+|
+| cmd 't+<template>;<prop>=<value>[;<prop>=<value>...]'
+|                           will edit a template in memory and re-inherit
+|                           only the objects that use it. An empty value
+|                           removes the prop. The snapshot isn't updated
+|                           again until nagconf restarts.
+|
 | cmd '+++' will exit
 ==================================HELP MENU===========================================
 """
@@ -562,45 +979,295 @@ def out_file(message):
 
 
 def subscriptions(nco, contact_name):
+    """ Lists the groups contact_name is in and every host, service
+    and escalation that notifies it, from the contact index (see
+    ncClasses.NagContactIndex).
+    """
+    index = nco.get_contact_index()
     msg = ""
-    person = contact_name
-    groups = []
-    for nO in nco.nagObjs:
-        if nO.classification.value == 'contactgroup':
-            if person in nO.members.value:
-                groups.append(nO.contactgroup_name.value)
-                
     msg += "'%s' is a member of the following groups:\n\r" % contact_name
-    for group in groups:
+    for group in index.get_groups(contact_name):
         msg += '\t' + group + '\n\r'
     msg += ("'%s' is set to recive notifications from the following objects:\n\r" % contact_name)
-    for n in nco.nagObjs:
-        try:
-            if person in n.contacts.value:
-                msg += '\t' + str(n) + '\n\r'
-        except:
-            pass
-        try:
-            contact_groups = n.contact_groups.value.split(',')
-            for contact_group in contact_groups:
-                if contact_group in groups:
-                    msg += '\t' + str(n) + '\n\r'
-        except:
-            pass
+    for n in index.get_notifiers(contact_name):
+        msg += '\t' + n.get_uid() + '\n\r'
+    return msg
+
+
+def subscriptions_report(nco):
+    """ Counts, for every contact, its groups and the hosts, services
+    and escalations that notify it.
+    """
+    start = time.time()
+    index = nco.get_contact_index()
+    msg = "%-40s%8s%8s%10s%13s\n" % ('contact', 'groups', 'hosts', 'services', 'escalations')
+    contacts = index.contacts()
+    for contact in contacts:
+        counts = {}
+        for n in index.get_notifiers(contact):
+            counts[n.classification.value] = counts.get(n.classification.value, 0) + 1
+        msg += "%-40s%8d%8d%10d%13d\n" % (contact, len(index.get_groups(contact)), counts.get('host', 0),
+                                          counts.get('service', 0),
+                                          counts.get('hostescalation', 0) + counts.get('serviceescalation', 0))
+    msg += "%s contacts in %.3fs" % (len(contacts), time.time() - start)
     return msg
 
 
 def display_basic(nco, classy):
     count = 0
     msg = ""
-    for obj in nco.nagObjs:
-        if obj.classification.value == classy:
-            msg += obj.gen_nag_text(expand=False)
-            count += 1
+    for obj in nco.get_by_class(classy):
+        msg += obj.gen_nag_text(expand=False)
+        count += 1
     msg += ("-=-=-=-=-=-=-=-=-=-=-  NUMBER OF RESULTS:       %s     -=-=-=-=-=-=-=-=-=-=- " % str(count))
     return msg
 
 
+def display_host(nco, host_name, service_description=None):
+    """ Shows the objects defined for host_name (or only its
+    service_description service) straight from nco's indexes.
+    """
+    if service_description is None:
+        found = nco.get_by_host(host_name)
+    else:
+        found = nco.get_service(host_name, service_description)
+    msg = ""
+    for obj in found:
+        msg += obj.gen_nag_text(expand=False)
+    msg += ("-=-=-=-=-=-=-=-=-=-=-  NUMBER OF RESULTS:       %s     -=-=-=-=-=-=-=-=-=-=- " % str(len(found)))
+    return msg
+
+
+def write_cfg_file(nco, filename, expand):
+    """ Writes nco to filename (see NagConfig.gen_cfg_file()) and
+    returns a message with the throughput, or the error if the
+    file couldn't be written.
+    """
+    thisfunc = str(giveupthefunc())
+    outdir, key = os.path.split(os.path.abspath(filename))
+    try:
+        manifest = load_output_manifest(outdir)
+        summary = nco.gen_cfg_file(filename, expand, manifest.get(key))
+    except (IOError, OSError) as e:
+        logging.error(thisfunc + "Unable to write '%s': %s" % (filename, str(e)))
+        return "Unable to write '%s': %s" % (filename, str(e))
+    manifest[key] = summary['entry']
+    save_output_manifest(outdir, manifest)
+    seconds = max(summary['seconds'], 1e-6)
+    msg = ("%s '%s': %s objects (%.1f MB), %s changed, rendered in %.2fs: %.1f MB/s, %.0f objects/s" %
+           ('Wrote' if summary['written'] else 'Skipped unchanged', filename, summary['objects'],
+            summary['bytes'] / 1048576.0, summary['changed'], summary['seconds'],
+            summary['bytes'] / 1048576.0 / seconds, summary['objects'] / seconds))
+    logging.debug(thisfunc + msg)
+    return msg
+
+
+def write_cfg_tree_msg(nco, outdir, layout, expand, jobs):
+    """ Writes nco as a tree under outdir (see write_cfg_tree())
+    and returns a message with the throughput, or the error if the
+    tree couldn't be written.
+    """
+    thisfunc = str(giveupthefunc())
+    if layout not in treeLayouts and not (layout.isdigit() and int(layout) > 0):
+        return "Unknown layout '%s', use one of %s or a number of objects" % (layout, ', '.join(treeLayouts))
+    try:
+        summary = write_cfg_tree(nco, outdir, layout, expand, jobs)
+    except (IOError, OSError) as e:
+        logging.error(thisfunc + "Unable to write '%s': %s" % (outdir, str(e)))
+        return "Unable to write '%s': %s" % (outdir, str(e))
+    seconds = max(summary['seconds'], 1e-6)
+    msg = ("Rendered %s objects (%.1f MB, %s changed) into %s files under '%s' in %.2fs: "
+           "%.1f MB/s, %.0f objects/s. Wrote %s files, skipped %s unchanged, deleted %s stale" %
+           (summary['objects'], summary['bytes'] / 1048576.0, summary['changed'], summary['files'], outdir,
+            summary['seconds'], summary['bytes'] / 1048576.0 / seconds, summary['objects'] / seconds,
+            summary['written'], summary['skipped'], summary['pruned']))
+    logging.debug(thisfunc + msg)
+    return msg
+
+
+def display_groups(nco, name):
+    """ Shows the effective members of every group called name
+    and every group name (a host, contact or host;service) is in,
+    from the group memberships (see ncClasses.NagGroupMembership).
+    """
+    msg = ""
+    member = name
+    if ';' in name:
+        member = tuple(part.strip() for part in name.split(';', 1))
+    for kind in ('hostgroup', 'servicegroup', 'contactgroup'):
+        membership = nco.get_membership(kind)
+        if nco.get_group(kind, name):
+            members = sorted(membership.members(name))
+            msg += "%s '%s' has %s members:\n" % (kind, name, len(members))
+            for m in members:
+                msg += "\t%s\n" % (';'.join(m) if isinstance(m, tuple) else m)
+        groups = sorted(membership.groups_of(member))
+        if groups:
+            msg += "'%s' is in %s %ss:\n" % (name, len(groups), kind)
+            for group in groups:
+                msg += "\t%s\n" % group
+    if not msg:
+        msg = "No groups or group members called '%s'" % name
+    return msg
+
+
+def display_checks(nco, top=20):
+    """ Shows how many actual (host, service) checks the services
+    stand for, in total and for the top templates and hostgroups,
+    counted without expanding them (see NagConfig.count_checks()).
+    """
+    start = time.time()
+    totals = nco.count_checks()
+    msg = "%s services stand for %s checks\n" % (totals['services'], totals['checks'])
+    for what in ('template', 'hostgroup'):
+        counts = sorted(totals[what].items(), key=lambda item: (-item[1], item[0]))
+        msg += "checks per %s (top %s of %s):\n" % (what, min(top, len(counts)), len(counts))
+        for name, checks in counts[:top]:
+            msg += "    %-46s%12d\n" % (name or '(none)', checks)
+    msg += "Counted in %.3fs" % (time.time() - start)
+    return msg
+
+
+def clock(second):
+    return "%02d:%02d:%02d" % (second // 3600, second // 60 % 60, second % 60)
+
+
+def simulate_load(nco, by, failing, day=None):
+    """ Simulates the day starting at epoch time day (default
+    today's midnight), with every check_period as that day has it
+    """
+    if day is None:
+        day = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+    timeperiods = nco.get_timeperiods()
+
+    def period_mask(name):
+        if name not in timeperiods.periods:
+            return None
+        return timeperiods.day_mask(name, int(day), ncClasses.loadDaySeconds)
+    return ncClasses.simulate_load(nco.check_groups(by), failing, intervalLength, period_mask)
+
+
+def display_load(nco, by='template', failing=0.0, top=20):
+    """ Shows the check load a day of the config puts on the
+    poller (see ncClasses.simulate_load()): the mean and peak checks
+    per second, an hourly profile, a histogram of the per-second
+    rates and the top templates (or values of prop by) by mean load.
+    """
+    start = time.time()
+    load = simulate_load(nco, by, failing)
+    mean, peak, second = ncClasses.rate_stats(load['rate'])
+    msg = "%s checks, %.0f%% failing: mean %.2f checks/s, peak %.2f checks/s at %s\n" % (
+        load['checks'], failing * 100, mean, peak, clock(second))
+    hours, histogram = ncClasses.rate_profile(load['rate'])
+    msg += "%-10s%12s%12s\n" % ('hour', 'mean/s', 'peak/s')
+    for hour, (mean, peak) in enumerate(hours):
+        msg += "%-10s%12.2f%12.2f\n" % (clock(hour * 3600)[:5], mean, peak)
+    msg += "%-24s%12s\n" % ('checks/s', 'seconds')
+    for low, high, seconds in histogram:
+        msg += "%10.2f - %-10.2f%12d\n" % (low, high, seconds)
+    labels = sorted(((label, ncClasses.rate_stats(rate)) for label, rate in load['labels'].items()),
+                    key=lambda item: (-item[1][0], item[0]))
+    msg += "%-46s%12s%12s\n" % ('load per ' + by + ' (top %s of %s)' % (min(top, len(labels)), len(labels)),
+                                'mean/s', 'peak/s')
+    for label, (mean, peak, second) in labels[:top]:
+        msg += "    %-42s%12.2f%12.2f\n" % (label or '(none)', mean, peak)
+    if ncClasses.numpy is None:
+        msg += "(numpy isn't installed: simulated in plain Python, which is much slower)\n"
+    msg += "Simulated in %.2fs" % (time.time() - start)
+    return msg
+
+
+def predict_load(nco, by, edits, failing=0.0, cow=False, jobs=1):
+    """ Shows how the template edits (as for update_templates())
+    would change the check load, per template (or value of prop by).
+    The edits are undone again afterwards, template by template.
+    """
+    undo = []
+    seen = set()
+    for name, prop, value in edits:
+        for tpl in nco.get_templates(name):
+            if (id(tpl), prop) not in seen:
+                seen.add((id(tpl), prop))
+                undo.append((tpl, prop, tpl.own_value(prop)))
+    before = simulate_load(nco, by, failing)
+    update_templates(nco, edits, cow, jobs)
+    try:
+        after = simulate_load(nco, by, failing)
+    finally:
+        update_template_objs(nco, undo, cow, jobs)
+    msg = "%-46s%12s%12s\n" % ('', 'before', 'after')
+    msg += "%-46s%12d%12d\n" % ('checks', before['checks'], after['checks'])
+    stats = [ncClasses.rate_stats(load['rate']) for load in (before, after)]
+    msg += "%-46s%12.2f%12.2f\n" % ('mean checks/s', stats[0][0], stats[1][0])
+    msg += "%-46s%12.2f%12.2f\n" % ('peak checks/s', stats[0][1], stats[1][1])
+    msg += "mean checks/s per %s that changed:\n" % by
+    for label in sorted(set(before['labels']) | set(after['labels'])):
+        means = [ncClasses.rate_stats(load['labels'][label])[0] if label in load['labels'] else 0.0
+                 for load in (before, after)]
+        if abs(means[0] - means[1]) > 1e-9:
+            msg += "    %-42s%12.2f%12.2f\n" % (label or '(none)', means[0], means[1])
+    return msg
+
+
+def display_timeperiod(nco, name, when=None, count=5):
+    """ Shows whether timeperiod name is in effect at epoch time
+    when (default now) and when it next starts and stops
+    """
+    timeperiods = nco.get_timeperiods()
+    if name not in timeperiods.periods:
+        return "No timeperiod named '%s'" % name
+    if when is None:
+        when = int(time.time())
+    stamp = lambda when: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+    inside = timeperiods.contains(name, when)
+    msg = "timeperiod '%s' is %s at %s\n" % (name, 'in effect' if inside else 'not in effect', stamp(when))
+    for i in range(count):
+        when = timeperiods.next_transition(name, when)
+        if when is None:
+            msg += "\tand stays that way for at least %s years\n" % ncClasses.transitionYears
+            break
+        inside = not inside
+        msg += "\t%s at %s\n" % ('starts' if inside else 'stops', stamp(when))
+    return msg
+
+
+def display_explain(nco, name, service_description, attr):
+    """ Explains why the host (or template) called name, or its
+    service_description service, has the value it has for attr.
+    Nothing is recorded during inheritance beyond the donor template
+    names so this is all worked out here, see NagConfig.explain().
+    """
+    if service_description is not None:
+        found = nco.get_service(name, service_description)
+    else:
+        found = [obj for obj in nco.get_by_host(name) if obj.classification.value == 'host']
+        if not found:
+            found = nco.get_templates(name)
+    if not found:
+        return "No objects found for '%s'" % name
+    msg = ""
+    for obj in found:
+        label = "%s '%s'" % (obj.classification.value, name)
+        if service_description is not None:
+            label = "%s '%s;%s'" % (obj.classification.value, name, service_description)
+        prop = obj.get_prop(attr)
+        if prop is None or prop.value == '':
+            msg += "%s has no %s\n" % (label, attr)
+            continue
+        msg += "%s %s = '%s'\n" % (label, attr, prop.value)
+        for donor, template, value, used in nco.explain(obj, attr):
+            if donor == 'EXPLICIT_DIRECT':
+                line = "'%s' set on the object itself (%s)" % (value, obj.sourcefile.value)
+            elif template is None:
+                line = "from template '%s' which is no longer loaded" % donor
+            else:
+                line = "'%s' from template '%s' (%s)" % (value, donor, template.sourcefile.value)
+            if not used:
+                line += ", overridden"
+            msg += "\t" + line + "\n"
+    return msg
+
+
 def menu(options, nco):
     """
     Interactive menu for searching and modifying config.
@@ -639,10 +1306,55 @@ def menu(options, nco):
         cplhh = re.compile(cplhhh)
         cplh = re.search(cplhh, userInput)
 
+        # define regex for host/service lookup
+        cpooo = '(^o)(\+)(?P<host_name>[^;]*)(;(?P<service_description>.*))?'
+        cpoo = re.compile(cpooo)
+        cpo = re.search(cpoo, userInput)
+
+        # define regex for check counts
+        cpccc = '(^c$)'
+        cpcc = re.compile(cpccc)
+        cpc = re.search(cpcc, userInput)
+
+        # define regex for the load simulator
+        cplddd = '(^p)(\+(?P<by>[^;]*)(;(?P<template>[^;]+)(?P<edits>(;[^;=]+=[^;]*)+))?)?$'
+        cpldd = re.compile(cplddd)
+        cpld = re.search(cpldd, userInput)
+
+        # define regex for timeperiod lookup
+        cptppp = '(^tp)(\+)(?P<name>[^;]+)(;(?P<when>.*))?$'
+        cptpp = re.compile(cptppp)
+        cptp = re.search(cptpp, userInput)
+
+        # define regex for group membership
+        cpggg = '(^g)(\+)(?P<name>.+)'
+        cpgg = re.compile(cpggg)
+        cpg = re.search(cpgg, userInput)
+
+        # define regex for explaining a property
+        cpwww = '(^w)(\+)(?P<name>[^;]+)(;(?P<service_description>[^;]*))?;(?P<prop>[^;]+)$'
+        cpww = re.compile(cpwww)
+        cpw = re.search(cpww, userInput)
+
+        # define regex for template edit
+        cptttt = '(^t)(\+)(?P<template>[^;]+)(?P<edits>(;[^;=]+=[^;]*)+)$'
+        cpttt = re.compile(cptttt)
+        cpt = re.search(cpttt, userInput)
+
+        # define regex for config tree output
+        cpfddd = '(^fd)(?P<expand>e?)(\+)(?P<outdir>[^;]+)(;(?P<layout>.*))?$'
+        cpfdd = re.compile(cpfddd)
+        cpfd = re.search(cpfdd, userInput)
+
         cpfff = '(^f)(\+)(?P<filename>.*.cfg)'
         cpff = re.compile(cpfff)
         cpf = re.search(cpff, userInput)
 
+        # define regex for reload
+        cprrr = '(^r$)'
+        cprr = re.compile(cprrr)
+        cpr = re.search(cprr, userInput)
+
         cpfffe = '(^fe)(\+)(?P<filename>.*.cfg)'
         cpffe = re.compile(cpfffe)
         cpfe = re.search(cpffe, userInput)
@@ -662,43 +1374,115 @@ def menu(options, nco):
         # handler for information
         elif cpi:
             print(get_stats(nco))
+        elif cpfd:
+            outdir = cpfd.group('outdir').strip()
+            layout = (cpfd.group('layout') or 'type').strip()
+            logging.debug("Parsed output dir '%s' and layout '%s'" % (outdir, layout))
+            print(write_cfg_tree_msg(nco, outdir, layout, bool(cpfd.group('expand')), options.jobs))
         elif cpf:
             filename = cpf.group('filename')
             logging.debug("Filename parsed is: '%s'" % filename)
-            nco.gen_cfg_file(filename, expand=False)
+            print(write_cfg_file(nco, filename, expand=False))
         elif cpfe:
             filename = cpfe.group('filename')
             logging.debug("Filename parsed is: '%s'" % filename)
-            nco.gen_cfg_file(filename, expand=True)
+            print(write_cfg_file(nco, filename, expand=True))
         elif cplh:
             keyword = cplh.group('classy')
             logging.debug("Parsed keyword for classification search: '%s'" % keyword)
             print(display_basic(nco, keyword))
         elif cps:
-            contact_name = cps.group('contact_name')
+            contact_name = cps.group('contact_name').strip()
             logging.debug("Parsed keyword for contact_name search: '%s'" % contact_name)
-            message = (subscriptions(nco, contact_name))
+            if contact_name == '*':
+                message = subscriptions_report(nco)
+            else:
+                message = subscriptions(nco, contact_name)
             print(message)
             out_file(message)
+        elif cpo:
+            host_name = cpo.group('host_name').strip()
+            service_description = cpo.group('service_description')
+            if service_description is not None:
+                service_description = service_description.strip()
+            logging.debug("Parsed host_name '%s' and service_description '%s'" % (host_name, service_description))
+            print(display_host(nco, host_name, service_description))
+        elif cpc:
+            print(display_checks(nco))
+        elif cpld:
+            by = (cpld.group('by') or '').strip() or 'template'
+            template = cpld.group('template')
+            if template is None:
+                print(display_load(nco, by, options.failing))
+            else:
+                template = template.strip()
+                edits = []
+                for edit in cpld.group('edits').split(';')[1:]:
+                    prop, value = edit.split('=', 1)
+                    edits.append((template, prop.strip(), value.strip() or None))
+                logging.debug("Parsed load by '%s' and template edits: '%s'" % (by, edits))
+                if not nco.get_templates(template):
+                    print("No template named '%s'" % template)
+                else:
+                    print(predict_load(nco, by, edits, options.failing, options.cow, options.jobs))
+        elif cptp:
+            name = cptp.group('name').strip()
+            when = cptp.group('when')
+            logging.debug("Parsed timeperiod '%s' and time '%s'" % (name, when))
+            if when is not None:
+                try:
+                    when = int(time.mktime(time.strptime(when.strip(), '%Y-%m-%d %H:%M')))
+                except ValueError:
+                    print("Times look like YYYY-MM-DD HH:MM")
+                    continue
+            print(display_timeperiod(nco, name, when))
+        elif cpg:
+            name = cpg.group('name').strip()
+            logging.debug("Parsed group or member name '%s'" % name)
+            print(display_groups(nco, name))
+        elif cpw:
+            name = cpw.group('name').strip()
+            service_description = cpw.group('service_description')
+            if service_description is not None:
+                service_description = service_description.strip()
+            attr = cpw.group('prop').strip()
+            logging.debug("Parsed name '%s', service_description '%s' and prop '%s'" % (name, service_description, attr))
+            print(display_explain(nco, name, service_description, attr))
+        elif cpt:
+            template = cpt.group('template').strip()
+            edits = []
+            for edit in cpt.group('edits').split(';')[1:]:
+                prop, value = edit.split('=', 1)
+                edits.append((template, prop.strip(), value.strip() or None))
+            logging.debug("Parsed template edits: '%s'" % edits)
+            if not nco.get_templates(template):
+                print("No template named '%s'" % template)
+            else:
+                start = time.time()
+                changed = update_templates(nco, edits, options.cow, options.jobs)
+                print("Updated template '%s': %s objects changed in %.2fs" % (template, len(changed), time.time() - start))
         elif cpe:
             experiment(nco)
+        elif cpr:
+            summary = reload_config(options, nco)
+            print("Reloaded %(files)s changed files: removed %(removed)s objects, added %(added)s, "
+                  "re-inherited %(reinherited)s" % summary)
+            if summary['files'] and options.snapshot:
+                save_snapshot(options.snapshot, nco, options)
 
 
-def main(options):
-    """ The main() method. Program starts here.
+def build_config(options, files=None):
+    """ Runs the full parse/scrub/inherit pipeline over
+    files and returns the resulting NagConfig.
     """
-    # test the logging
-    thisfunc = str(giveupthefunc())
-    cfgrawtext = get_config(options)
     nco = ncClasses.NagConfig()
-    nco.nagObjs = classify_config(cfgrawtext)
-    '''
-    mn = ncClasses.NagObjHost()
-    mn.color = 'red'
-    mn.age = 10
-    mn.something = 'whatever'
-    print mn.dumpself()
-    '''
+    if files is None:
+        # record the files as they're discovered so the parser
+        # doesn't have to wait for the directory walk to finish
+        files = []
+        nco.add_objs(load_config(options, iter_recorded(iter_config_files(options), files)))
+    else:
+        nco.add_objs(load_config(options, files))
     logging.debug(nco.dump_stats())
     logging.debug("About to try and nco.scrub_data()...")
     try:
@@ -708,14 +1492,6 @@ def main(options):
         pass
     logging.debug("Finished nco.scrub_data(), attempting nco.dump_stats()...")
     logging.debug(nco.dump_stats())
-    logging.debug("About to try and morph(nco)...")
-    try:
-        nco = morph(nco)
-    except Exception as eee:
-        # logging.debug(str(eee))
-        pass
-    logging.debug("Finished morph(), now trying nco.dump_stats()")
-    logging.debug(nco.dump_stats())
     try:
         nco = discover_template_chain(nco)
     except Exception as eeee:
@@ -723,10 +1499,282 @@ def main(options):
         pass
 
     try:
-        nco = inherit_from_chain(nco)
+        nco = inherit_from_chain(nco, cow=options.cow, jobs=options.jobs)
     except Exception as ex:
         logging.debug(str(ex))
         pass
+    # inherited host_names etc. need indexing too
+    nco.reindex()
+    nco.manifest = build_manifest(files)
+    return nco
+
+
+def build_manifest(files, previous=None):
+    """ Returns a manifest dict of path: (size, mtime, md5) for
+    every file in files. Files whose size and mtime match the
+    previous manifest reuse its hash instead of being re-read.
+    """
+    if previous is None:
+        previous = {}
+    manifest = {}
+    for f in files:
+        st = os.stat(f)
+        old = previous.get(f)
+        if old is not None and old[0] == st.st_size and old[1] == st.st_mtime:
+            manifest[f] = old
+        else:
+            manifest[f] = (st.st_size, st.st_mtime, ncClasses.hash_file(f))
+    return manifest
+
+
+def changed_sources(old, new):
+    """ Compares two manifests and returns the set of files
+    that were added, removed, or had their size or content
+    hash change. mtime alone is allowed to differ (e.g., a
+    file was touched but not edited).
+    """
+    changed = set(old) ^ set(new)
+    for f in set(old) & set(new):
+        if old[f][0] != new[f][0] or old[f][2] != new[f][2]:
+            changed.add(f)
+    return changed
+
+
+def template_names(objs):
+    """ Returns the set of template names defined by objs
+    """
+    names = set()
+    for obj in objs:
+        try:
+            names.add(obj.name.value.rstrip(' '))
+        except AttributeError:
+            pass
+    return names
+
+
+def update_templates(nco, edits, cow=False, jobs=1):
+    """ Applies edits, a list of (template name, prop, value) with
+    value None to remove prop, to every template of that name (see
+    update_template_objs()). Returns the objects whose effective
+    properties changed. nco no longer matches its cfg files, so it
+    won't be snapshotted again (see save_snapshot()) until it's built
+    from scratch.
+    """
+    nco.editedInMemory = True
+    return update_template_objs(nco, [(tpl, prop, value) for name, prop, value in edits
+                                      for tpl in list(nco.get_templates(name))], cow, jobs)
+
+
+def update_template_objs(nco, edits, cow=False, jobs=1):
+    """ Applies edits, a list of (template, prop, value) with value
+    None to remove prop, and then re-resolves inheritance for just the
+    templates of those names and the objects that depend on them (see
+    NagConfig.get_dependents()). Returns the objects whose effective
+    properties changed.
+    """
+    thisfunc = str(giveupthefunc())
+    names = template_names(tpl for tpl, prop, value in edits)
+    affected = []
+    for name in names:
+        affected.extend(nco.get_templates(name))
+    affected.extend(nco.get_dependents(names))
+    before = dict((id(obj), obj.effective_values()) for obj in affected)
+    for tpl, prop, value in edits:
+        nco.set_prop(tpl, prop, value)
+    # a template's new use (or name) can pull more objects in
+    ids = set(before)
+    for obj in nco.get_dependents(names | template_names(affected)):
+        if id(obj) not in ids:
+            ids.add(id(obj))
+            affected.append(obj)
+            before[id(obj)] = obj.effective_values()
+    oldkeys = dict((id(obj), nco.index_keys(obj)) for obj in affected)
+    for obj in affected:
+        obj.reset_inheritance()
+    discover_template_chain(nco, affected)
+    inherit_from_chain(nco, affected, cow, jobs)
+    changed = []
+    for obj in affected:
+        # inherited host_names etc. can move objects between buckets
+        nco.update_index(obj, oldkeys[id(obj)])
+        if obj.effective_values() != before[id(obj)]:
+            changed.append(obj)
+    logging.debug(thisfunc + "Re-resolved %s objects, %s changed" % (len(affected), len(changed)))
+    return changed
+
+
+def reload_config(options, nco, files=None):
+    """ Brings nco up to date with the cfg files on disk. Only files
+    that were added, changed or removed since nco.manifest was taken
+    are reparsed and only their objects are replaced. Objects whose
+    template chain runs through a template defined in one of those
+    files are re-inherited; everything else is left alone.
+    Returns a dict summarizing what was done.
+    """
+    thisfunc = str(giveupthefunc())
+    if files is None:
+        files = get_config_files(options)
+    manifest = build_manifest(files, nco.manifest)
+    dirty = changed_sources(nco.manifest, manifest)
+    nco.manifest = manifest
+    summary = {'files': len(dirty), 'removed': 0, 'added': 0, 'reinherited': 0}
+    if not dirty:
+        logging.debug(thisfunc + "No cfg files changed")
+        return summary
+    dropped = nco.drop_sources(dirty)
+    changedtpls = template_names(dropped)
+    fresh = ncClasses.NagConfig()
+    fresh.nagObjs = load_config(options, [f for f in files if f in dirty])
+    fresh.scrub_data()
+    changedtpls |= template_names(fresh.nagObjs)
+    affected = list(fresh.nagObjs)
+    reinherited = 0
+    for obj in nco.get_dependents(changedtpls):
+        obj.reset_inheritance()
+        affected.append(obj)
+        reinherited += 1
+    nco.nagObjs.extend(fresh.nagObjs)
+    # put everything back in the order a full build would have produced,
+    # which is file order (the sort is stable within a file)
+    order = dict((f, i) for i, f in enumerate(files))
+    nco.nagObjs.sort(key=lambda obj: order.get(obj.sourcefile.value, -1))
+    nco.reindex()
+    discover_template_chain(nco, affected)
+    inherit_from_chain(nco, affected, options.cow, options.jobs)
+    nco.reindex()
+    summary.update({'removed': len(dropped), 'added': len(fresh.nagObjs), 'reinherited': reinherited})
+    logging.debug(thisfunc + "Reloaded %(files)s files: removed %(removed)s objects, "
+                  "added %(added)s and re-inherited %(reinherited)s others" % summary)
+    return summary
+
+
+def code_fingerprint():
+    """ Hash of nagconf's own source so a snapshot written
+    by a different version of the classes is never loaded.
+    """
+    md5 = hashlib.md5()
+    for mod in (ncClasses.__file__, __file__):
+        md5.update(ncClasses.hash_file(os.path.splitext(mod)[0] + '.py').encode('ascii'))
+    return md5.hexdigest()
+
+
+def snapshot_options(options):
+    """ The options a snapshot's objects depend on: copy-on-write
+    inheritance, the value pool size and the config it was read from.
+    """
+    return {'cow': bool(options.cow), 'poolsize': options.poolsize,
+            'input': os.path.abspath(options.maincfg or options.cfgdir)}
+
+
+def load_snapshot(filename, options):
+    """ Tries to load the processed NagConfig saved in the snapshot
+    filename. Returns None if there's no snapshot or it was written
+    by different code or with different options (see
+    snapshot_options()). The NagConfig may be out of date with the
+    cfg files; reload_config() catches it up.
+    """
+    thisfunc = str(giveupthefunc())
+    try:
+        with open(filename, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('code') != code_fingerprint():
+                logging.debug(thisfunc + "Snapshot '%s' is from different code, ignoring it" % filename)
+                return None
+            if header.get('options') != snapshot_options(options):
+                logging.debug(thisfunc + "Snapshot '%s' was built with %s, not %s, ignoring it" %
+                              (filename, header.get('options'), snapshot_options(options)))
+                return None
+            gcwasenabled = gc.isenabled()
+            gc.disable()
+            try:
+                nco = pickle.load(f)
+            finally:
+                if gcwasenabled:
+                    gc.enable()
+            logging.debug(thisfunc + "Loaded %s objects from snapshot '%s'" % (len(nco.nagObjs), filename))
+            nco.pool_values()
+            return nco
+    except Exception as e:
+        logging.debug(thisfunc + "No usable snapshot '%s': %s" % (filename, str(e)))
+    return None
+
+
+def save_snapshot(filename, nco, options):
+    """ Writes nco to the snapshot in filename. The snapshot is
+    written to a temp file and renamed so a crash never leaves
+    a half-written snapshot behind. An nco with templates edited in
+    memory isn't written: the edits would come back on the next start
+    as if they were in the cfg files.
+    """
+    thisfunc = str(giveupthefunc())
+    if nco.editedInMemory:
+        logging.warning(thisfunc + "Not writing snapshot '%s': templates were edited in memory" % filename)
+        return
+    tmpname = filename + '.tmp'
+    try:
+        with open(tmpname, 'wb') as f:
+            pickle.dump({'code': code_fingerprint(), 'options': snapshot_options(options)}, f,
+                        pickle.HIGHEST_PROTOCOL)
+            pickle.dump(nco, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, filename)
+        logging.debug(thisfunc + "Wrote snapshot '%s'" % filename)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        logging.warning(thisfunc + "Unable to write snapshot '%s': %s" % (filename, str(e)))
+
+
+def diff_trees(options, other):
+    """ Loads the config options point at and the one at other (a
+    nagios.cfg or a directory of .cfg files) and returns the
+    display_diff() report of what changed going from the first to
+    the second. Snapshots aren't used.
+    """
+    thisfunc = str(giveupthefunc())
+    start = time.time()
+    old = build_config(options)
+    otheroptions = copy.copy(options)
+    if os.path.isdir(other):
+        otheroptions.maincfg, otheroptions.cfgdir = None, other
+    else:
+        otheroptions.maincfg = other
+    new = build_config(otheroptions)
+    loaded = time.time()
+    diff = diff_configs(old, new)
+    logging.debug(thisfunc + "Loaded both in %.2fs, compared %s and %s objects in %.2fs" %
+                  (loaded - start, len(old.nagObjs), len(new.nagObjs), time.time() - loaded))
+    return display_diff(diff)
+
+
+def open_config(options):
+    """ Returns the NagConfig options point at: the snapshot caught up
+    with the cfg files (see reload_config()) if there's a usable one,
+    otherwise built from scratch. A changed config is snapshotted
+    again.
+    """
+    nco = None
+    if options.snapshot:
+        nco = load_snapshot(options.snapshot, options)
+    if nco is None:
+        nco = build_config(options)
+        changed = True
+    else:
+        oldmanifest = nco.manifest
+        reload_config(options, nco)
+        changed = nco.manifest != oldmanifest
+    if options.snapshot and changed:
+        save_snapshot(options.snapshot, nco, options)
+    return nco
+
+
+def main(options):
+    """ The main() method. Program starts here.
+    """
+    # test the logging
+    thisfunc = str(giveupthefunc())
+    ncClasses.valuePool.maxsize = options.poolsize
+    if options.diff:
+        print(diff_trees(options, options.diff))
+        return
+    nco = open_config(options)
 
     # now have enough info to launch menu
     menu(options, nco)
@@ -750,6 +1798,46 @@ if __name__ == '__main__':
                       type='string',
                       help="This is the directory containing Nagios .cfg files.",
                       default='.\samples')
+    parser.add_option('-m', '--maincfg',
+                      type='string', metavar='FILE',
+                      help=("Main nagios.cfg to start from. Its cfg_file and cfg_dir "
+                            "directives are followed instead of reading --cfgdir."),
+                      default=None)
+    parser.add_option('-j', '--jobs',
+                      type='int',
+                      help=("Number of worker processes used to parse .cfg files "
+                            "and resolve inheritance. Default is 1 (serial)."),
+                      default=1)
+    parser.add_option('-C', '--cow',
+                      action='store_true', default=False,
+                      help=("Copy-on-write inheritance: objects share one read only "
+                            "copy of what their template chain hands down instead "
+                            "of each getting their own. Uses less memory."))
+    parser.add_option('-P', '--poolsize',
+                      type='int', metavar='COUNT',
+                      help=("Maximum number of distinct property values shared "
+                            "through the value pool. Default is 0 (no limit)."),
+                      default=0)
+    parser.add_option('-s', '--snapshot',
+                      type='string', metavar='FILE',
+                      help=("Snapshot of the fully processed config, reused when no "
+                            "cfg file has changed and it was built with the same "
+                            "--cow, --poolsize and input. Default is not to keep one."),
+                      default='')
+    parser.add_option('-D', '--diff',
+                      type='string', metavar='PATH',
+                      help=("Compare the config against another one (a nagios.cfg "
+                            "or a directory of .cfg files), print the objects "
+                            "added, removed and changed, and exit."),
+                      default=None)
+    parser.add_option('-F', '--failing',
+                      type='float', metavar='SHARE',
+                      help=("Share (0 to 1) of check results the load simulator "
+                            "takes to fail and be retried. Default is 0."),
+                      default=0.0)
+    parser.add_option('-n', '--nosnapshot',
+                      action='store_const', const='', dest='snapshot',
+                      help="Don't read or write a snapshot, even with --snapshot.")
     parser_debug = OptionGroup(parser, 'Debug Options')
     parser_debug.add_option('-d', '--debug', type='string',
         help=('Available levels are CRITICAL (3), ERROR (2), '
@@ -0,0 +1,583 @@
+"""
+ncBench - quick benchmarks for nagconf's in-memory object model.
+
+Usage: python ncBench.py memory [-n 10000]
+       python ncBench.py inherit [-n 10000] [--cow]
+       python ncBench.py write [-n 10000] [--cow]
+       python ncBench.py checks [-n 10000]
+       python ncBench.py load [-n 10000]
+       python ncBench.py timeperiod [-n 10000]
+       python ncBench.py check
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import ncClasses
+
+sversion = 'v0.1'
+
+# a typical host and service as they come out of the parser
+sampleHost = [('use', 'linux-server'), ('host_name', 'web%05d'), ('alias', 'Web server %05d'),
+              ('address', '10.0.%d.%d'), ('hostgroups', 'webservers,linux')]
+sampleService = [('use', 'generic-service'), ('host_name', 'web%05d'),
+                 ('service_description', 'Disk /var'), ('check_command', 'check_nrpe!check_disk')]
+
+
+def fresh(value, i):
+    """ Returns a new string object for value (formatted with i
+    if it takes an argument) the way the parser makes one per line.
+    """
+    if value.count('%') == 1:
+        value = value % i
+    elif value.count('%') == 2:
+        value = value % (i // 256, i % 256)
+    return (value + ' ').rstrip()
+
+
+def deep_sizeof(obj, seen):
+    """ Rough deep size of obj in bytes. Anything whose id is already
+    in seen is skipped (and seen is updated), so shared strings and the
+    shared empty property are only counted once across many calls.
+    """
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if slot not in ('__dict__', '__weakref__') and hasattr(obj, slot):
+                size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+class LegacySuperProp:
+    """ Replica of the original NagObjSuperProp (old style class with
+    a __dict__ and a history list) kept only to measure against.
+    """
+    def __init__(self, value=''):
+        self.donor = '*'
+        self.explicitInheritance = False
+        self.value = value
+        self.inheritanceHistory = ['EXPLICIT_DIRECT' if value != '' else '__']
+
+
+class LegacyObj:
+    """ Replica of an original classed object that eagerly
+    allocated a property for every field in its class.
+    """
+    pass
+
+
+def build_legacy(cls, typestring, values, i):
+    obj = LegacyObj()
+    obj.classification = LegacySuperProp(typestring)
+    obj.typestring = LegacySuperProp(typestring)
+    obj.classified = LegacySuperProp(True)
+    obj.deleteflag = LegacySuperProp(False)
+    obj.templateChain = LegacySuperProp([])
+    obj.inheritanceLog = LegacySuperProp([])
+    for field in cls.fields:
+        setattr(obj, field, LegacySuperProp())
+    for prop, val in values:
+        setattr(obj, prop, LegacySuperProp(fresh(val, i)))
+    return obj
+
+
+def build_compact(cls, typestring, values, i):
+    obj = cls()
+    for prop, val in values:
+        setattr(obj, prop, ncClasses.NagObjSuperProp(fresh(val, i)))
+    return obj
+
+
+def bench_memory(count):
+    """ Builds count hosts and count services in both the legacy
+    and the current representation and returns a report of the
+    average bytes per object.
+    """
+    kinds = [('host', ncClasses.NagObjHost, sampleHost),
+             ('service', ncClasses.NagObjService, sampleService)]
+    msg = "%-10s%15s%15s%10s\n" % ('object', 'before B/obj', 'after B/obj', 'ratio')
+    for typestring, cls, values in kinds:
+        sizes = []
+        for build in (build_legacy, build_compact):
+            seen = set()
+            objs = [build(cls, typestring, values, i) for i in range(count)]
+            sizes.append(sum(deep_sizeof(obj, seen) for obj in objs) / float(count))
+        msg += "%-10s%15.0f%15.0f%9.1fx\n" % (typestring, sizes[0], sizes[1], sizes[0] / sizes[1])
+    return msg
+
+
+def build_inherit_config(count):
+    """ Returns a NagConfig of count services (and count // 10 hosts)
+    sharing a small stack of templates, with template chains discovered
+    but nothing inherited yet.
+    """
+    import nagconf
+    blocks = [('service', [('name', 'generic-service'), ('check_period', '24x7'),
+                           ('max_check_attempts', '3'), ('check_interval', '5'),
+                           ('contact_groups', 'admins'), ('register', '0')]),
+              ('service', [('name', 'local-service'), ('use', 'generic-service'),
+                           ('retry_interval', '1'), ('register', '0')]),
+              ('service', [('name', 'disk-service'), ('use', 'local-service'),
+                           ('contact_groups', '+storage'), ('register', '0')]),
+              ('host', [('name', 'linux-server'), ('check_period', '24x7'),
+                        ('max_check_attempts', '10'), ('register', '0')])]
+    for i in range(count // 10):
+        blocks.append(('host', [(prop, fresh(val, i)) for prop, val in sampleHost]))
+    for i in range(count):
+        values = [(prop, fresh(val, i // 10)) for prop, val in sampleService]
+        if i % 2:
+            values[0] = ('use', 'disk-service')
+        blocks.append(('service', values))
+    nco = ncClasses.NagConfig()
+    nco.add_objs([nagconf.build_nag_obj(block) for block in blocks])
+    nagconf.discover_template_chain(nco)
+    return nco
+
+
+def bench_inherit(count, cow=False):
+    """ Times inherit_from_chain() over count services and returns a
+    report of the throughput in objects per second and the average
+    size of an object once it has inherited.
+    """
+    import nagconf
+    nco = build_inherit_config(count)
+    start = time.time()
+    nagconf.inherit_from_chain(nco, cow=cow)
+    elapsed = time.time() - start
+    seen = set()
+    size = sum(deep_sizeof(obj, seen) for obj in nco.nagObjs) / float(len(nco.nagObjs))
+    msg = "%-10s%15s%15s%15s\n" % ('objects', 'seconds', 'objects/s', 'B/obj')
+    msg += "%-10d%15.3f%15.0f%15.0f\n" % (len(nco.nagObjs), elapsed, len(nco.nagObjs) / elapsed, size)
+    return msg
+
+
+def bench_write(count, cow=False):
+    """ Times NagConfig.gen_cfg_file() writing count inherited
+    services (and count // 10 hosts) both expanded and compact and
+    returns a report of the throughput.
+    """
+    import nagconf
+    nco = build_inherit_config(count)
+    nagconf.inherit_from_chain(nco, cow=cow)
+    fd, filename = tempfile.mkstemp(suffix='.cfg')
+    os.close(fd)
+    msg = "%-10s%10s%15s%15s%15s\n" % ('output', 'objects', 'seconds', 'MB/s', 'objects/s')
+    try:
+        for expand, label in ((True, 'expanded'), (False, 'compact')):
+            summary = nco.gen_cfg_file(filename, expand)
+            msg += "%-10s%10d%15.3f%15.1f%15.0f\n" % (label, summary['objects'], summary['seconds'],
+                                                     summary['bytes'] / 1048576.0 / summary['seconds'],
+                                                     summary['objects'] / summary['seconds'])
+    finally:
+        os.remove(filename)
+    return msg
+
+
+def build_checks_config(count):
+    """ Returns an inherited NagConfig of count hosts spread over 20
+    hostgroups and 4000 services on those hostgroups (count * 200
+    checks) checked every 1, 5, 10 or 15 minutes.
+    """
+    import nagconf
+    blocks = [('service', [('name', 'generic-service'), ('check_interval', '5'), ('register', '0')])]
+    for g in range(20):
+        blocks.append(('hostgroup', [('hostgroup_name', 'hg%02d' % g)]))
+    for i in range(count):
+        blocks.append(('host', [('host_name', fresh('host%06d', i)), ('hostgroups', 'hg%02d' % (i % 20))]))
+    for j in range(4000):
+        blocks.append(('service', [('use', 'generic-service'), ('hostgroup_name', 'hg%02d' % (j % 20)),
+                                   ('service_description', fresh('svc%04d', j)),
+                                   ('check_interval', str((1, 5, 10, 15)[j % 4]))]))
+    nco = ncClasses.NagConfig()
+    nco.add_objs([nagconf.build_nag_obj(block) for block in blocks])
+    nagconf.discover_template_chain(nco)
+    nagconf.inherit_from_chain(nco)
+    nco.reindex()
+    return nco
+
+
+def bench_checks(count):
+    """ Times NagConfig.count_checks() against walking
+    NagConfig.iter_checks() over count * 200 checks.
+    """
+    nco = build_checks_config(count)
+    start = time.time()
+    totals = nco.count_checks()
+    counted = time.time() - start
+    start = time.time()
+    walked = sum(1 for check in nco.iter_checks())
+    iterated = time.time() - start
+    msg = "%-10s%12s%15s%15s\n" % ('mode', 'checks', 'seconds', 'checks/s')
+    msg += "%-10s%12d%15.3f%15.0f\n" % ('count', totals['checks'], counted, totals['checks'] / max(counted, 1e-6))
+    msg += "%-10s%12d%15.3f%15.0f\n" % ('iterate', walked, iterated, walked / max(iterated, 1e-6))
+    return msg
+
+
+def bench_load(count):
+    """ Times simulating a day of count * 200 checks plus count host
+    checks (see ncClasses.simulate_load()), 5% of them failing.
+    """
+    nco = build_checks_config(count)
+    start = time.time()
+    groups = nco.check_groups()
+    grouped = time.time() - start
+    start = time.time()
+    load = ncClasses.simulate_load(groups, 0.05)
+    simulated = time.time() - start
+    mean, peak, second = ncClasses.rate_stats(load['rate'])
+    msg = "%-10s%10s%12s%12s%12s%12s\n" % ('checks', 'groups', 'group s', 'simulate s', 'mean/s', 'peak/s')
+    msg += "%-10d%10d%12.3f%12.3f%12.1f%12.1f\n" % (load['checks'], len(groups), grouped, simulated, mean, peak)
+    return msg
+
+
+def bench_timeperiod(count):
+    """ Times compiling a year of a work hours timeperiod with a
+    dozen exceptions and an excluded holidays timeperiod, then asking
+    whether count * 200 times spread over that year are in it.
+    """
+    import nagconf
+    blocks = [('timeperiod', [('timeperiod_name', 'workhours'), ('exclude', 'holidays')] +
+               [(day, '09:00-12:00,13:00-17:30') for day in ncClasses.weekdayNames[:5]] +
+               [('day', '%d 09:00-20:00' % day) for day in (1, 15, -1)] +
+               [(day, '3 09:00-21:00') for day in ncClasses.weekdayNames[:5]]),
+              ('timeperiod', [('timeperiod_name', 'holidays'), ('january', '1 00:00-24:00'),
+                              ('december', '24 - december 26 00:00-24:00'), ('monday', '1 september 00:00-24:00'),
+                              ('thursday', '-1 november 00:00-24:00')])]
+    nco = ncClasses.NagConfig()
+    nco.add_objs([nagconf.build_nag_obj(block) for block in blocks])
+    timeperiods = nco.get_timeperiods()
+    first = int(time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1)))
+    start = time.time()
+    timeperiods.compile('workhours', 2026, 2026)
+    compiled = time.time() - start
+    if ncClasses.numpy is not None:
+        times = ncClasses.numpy.linspace(first, first + 364 * 86400, count * 200).astype(ncClasses.numpy.int64)
+    else:
+        times = [first + i * 364 * 86400 // (count * 200) for i in range(count * 200)]
+    start = time.time()
+    inside = timeperiods.contains_many('workhours', times)
+    queried = time.time() - start
+    msg = "%-12s%12s%12s%15s%12s\n" % ('times', 'compile s', 'query s', 'times/s', 'inside')
+    msg += "%-12d%12.3f%12.3f%15.0f%12d\n" % (len(times), compiled, queried, len(times) / max(queried, 1e-6), list(inside).count(True))
+    return msg
+
+
+def check_timeperiod_roundtrip():
+    """ Parses timeperiods with long dateranges, writes them out and
+    parses that again: every daterange must come back as it was.
+    """
+    import nagconf
+    cfg = ["define timeperiod {\n", "    timeperiod_name    rota\n", "    monday    09:00-17:00\n",
+           "    tuesday 1 october - friday 3 november    09:00-10:00\n",
+           "    2026-01-05 - 2026-12-31 / 14    00:00-09:00,17:00-24:00\n",
+           "    thursday -1 november    00:00-24:00\n", "    }\n"]
+    objs = list(nagconf.iter_nag_objs(cfg))
+    for expand in (True, False):
+        text = ''.join(obj.gen_nag_text(expand) for obj in objs)
+        for attr, value in objs[0].effective_values():
+            assert ' %s ' % attr in text, attr
+        again = list(nagconf.iter_nag_objs(text.splitlines(True)))
+        assert [obj.effective_values() for obj in again] == [obj.effective_values() for obj in objs], expand
+    assert objs[0].get_prop('tuesday 1 october - friday 3 november').value == '09:00-10:00'
+    return "timeperiod round trip: ok\n"
+
+
+def naive_day_minutes(rules, date):
+    """ Returns, for every minute of date, whether the first of rules
+    ((matches(date), [(start minute, end minute)])) that matches date
+    covers it.
+    """
+    for matches, ranges in rules:
+        if matches(date):
+            return [any(start <= minute < end for start, end in ranges) for minute in range(1440)]
+    return [False] * 1440
+
+
+def check_timeperiods():
+    """ Compares NagTimePeriods.contains(), contains_many() and
+    next_transition() with working out every minute from late 2025
+    to early 2027 by hand: the first exception of the lowest kind
+    (calendar date, month date, day, weekday of a month, weekday of
+    every month) that covers a day wins over its weekday, and an
+    excluded timeperiod is taken out.
+    """
+    import datetime
+    import nagconf
+    blocks = [('timeperiod', [('timeperiod_name', 'workhours'), ('exclude', 'holidays')] +
+               [(day, '09:00-17:00') for day in ncClasses.weekdayNames[:5]] +
+               [('2026-01-05 - 2026-03-30 / 14', '18:00-19:00'), ('2026-12-25', '08:00-09:00'),
+                ('december 24 - december 26', '12:00-13:00'), ('day 15', '10:00-11:00'),
+                ('thursday -1 november', '14:00-16:00'), ('monday 1', '09:00-10:00')]),
+              ('timeperiod', [('timeperiod_name', 'holidays'), ('january 1', '00:00-24:00'),
+                              ('day -1', '16:00-24:00'), ('monday 1 september', '00:00-24:00')])]
+    oneday = datetime.timedelta(1)
+    rules = {'workhours': [(lambda d: datetime.date(2026, 1, 5) <= d <= datetime.date(2026, 3, 30)
+                            and (d - datetime.date(2026, 1, 5)).days % 14 == 0, [(1080, 1140)]),
+                           (lambda d: d == datetime.date(2026, 12, 25), [(480, 540)]),
+                           (lambda d: d.month == 12 and 24 <= d.day <= 26, [(720, 780)]),
+                           (lambda d: d.day == 15, [(600, 660)]),
+                           (lambda d: d.month == 11 and d.weekday() == 3 and (d + 7 * oneday).month == 12,
+                            [(840, 960)]),
+                           (lambda d: d.weekday() == 0 and d.day <= 7, [(540, 600)]),
+                           (lambda d: d.weekday() < 5, [(540, 1020)])],
+             'holidays': [(lambda d: d.month == 1 and d.day == 1, [(0, 1440)]),
+                          (lambda d: (d + oneday).day == 1, [(960, 1440)]),
+                          (lambda d: d.month == 9 and d.weekday() == 0 and d.day <= 7, [(0, 1440)])]}
+    nco = ncClasses.NagConfig()
+    nco.add_objs([nagconf.build_nag_obj(block) for block in blocks])
+    timeperiods = nco.get_timeperiods()
+    first = int(time.mktime((2025, 12, 28, 0, 0, 0, 0, 0, -1)))
+    times = list(range(first, int(time.mktime((2027, 1, 4, 0, 0, 0, 0, 0, -1))), 60))
+    days = {}
+    expected = {'workhours': [], 'holidays': []}
+    for when in times:
+        now = time.localtime(when)
+        date = datetime.date(now.tm_year, now.tm_mon, now.tm_mday)
+        if date not in days:
+            days[date] = dict((name, naive_day_minutes(rules[name], date)) for name in rules)
+        minute = now.tm_hour * 60 + now.tm_min
+        holiday = days[date]['holidays'][minute]
+        expected['holidays'].append(holiday)
+        expected['workhours'].append(days[date]['workhours'][minute] and not holiday)
+    for name in ('workhours', 'holidays'):
+        inside = [bool(value) for value in timeperiods.contains_many(name, times)]
+        for i in range(len(times)):
+            assert inside[i] == expected[name][i], (name, time.ctime(times[i]), expected[name][i])
+        for i in range(0, len(times), 97):
+            assert timeperiods.contains(name, times[i]) == expected[name][i], (name, time.ctime(times[i]))
+        flips = [times[j] for j in range(1, len(times)) if expected[name][j] != expected[name][j - 1]]
+        found = []
+        when = times[0]
+        while True:
+            when = timeperiods.next_transition(name, when)
+            if when is None or when > times[-1]:
+                break
+            found.append(when)
+        assert found == flips, (name, len(found), len(flips))
+    return "timeperiods against %d minutes worked out by hand: ok\n" % len(times)
+
+
+def naive_members(direct, group):
+    """ Returns the set of group's members worked out by hand from
+    direct ({group: (included, excluded, subgroups, excluded
+    subgroups)}, no cycles): what it and its subgroups include, less
+    what it excludes and what its excluded subgroups hold.
+    """
+    if group not in direct:
+        return set()
+    included, excluded, subgroups, notsubgroups = direct[group]
+    members = set(included)
+    for subgroup in subgroups:
+        members |= naive_members(direct, subgroup)
+    notmembers = set(excluded)
+    for subgroup in notsubgroups:
+        notmembers |= naive_members(direct, subgroup)
+    return members - notmembers
+
+
+def build_group_config(rand, kind, members, groups):
+    """ Returns (blocks, direct) for random groups of kind over
+    members (and a few undefined names): every group gets members
+    ('*', names and '!names') and later groups as *_members (some
+    '!'), every member a few groups (some '!') of its own, and a
+    template member with groups that must not count. direct is as
+    naive_members() takes it.
+    """
+    memberClass = ncClasses.NagGroupMembership.memberClasses[kind]
+    ghosts = ['ghost%d' % i for i in range(3)]
+    direct = dict((group, (set(), set(), [], [])) for group in groups)
+    blocks = [(memberClass, [('name', 'template-' + memberClass), (kind + 's', ','.join(groups)), ('register', '0')])]
+    for member in members:
+        joined = rand.sample(groups + ['extra'], rand.randint(0, 3))
+        values = []
+        for group in joined:
+            direct.setdefault(group, (set(), set(), [], []))
+            if rand.random() < 0.2:
+                direct[group][1].add(member)
+                values.append('!' + group)
+            else:
+                direct[group][0].add(member)
+                values.append(group)
+        blocks.append((memberClass, [(memberClass + '_name', member), (kind + 's', ','.join(values))]))
+    for i, group in enumerate(groups):
+        values = [(kind + '_name', group)]
+        names = []
+        if rand.random() < 0.1:
+            direct[group][0].update(members)
+            names.append('*')
+        for name in rand.sample(members + ghosts, rand.randint(0, 8)):
+            if rand.random() < 0.25:
+                direct[group][1].add(name)
+                names.append('!' + name)
+            else:
+                direct[group][0].add(name)
+                names.append(name)
+        if names:
+            values.append(('members', ','.join(names)))
+        subgroups = []
+        for subgroup in rand.sample(groups[i + 1:] + ['nosuch'], min(rand.randint(0, 3), len(groups) - i)):
+            if rand.random() < 0.25:
+                direct[group][3].append(subgroup)
+                subgroups.append('!' + subgroup)
+            else:
+                direct[group][2].append(subgroup)
+                subgroups.append(subgroup)
+        if subgroups:
+            values.append((kind + '_members', ','.join(subgroups)))
+        blocks.append((kind, values))
+    return blocks, direct
+
+
+def check_group_membership():
+    """ Compares NagGroupMembership.members(), is_member() and
+    groups_of() with the transitive closure worked out by hand, for
+    random hostgroups.
+    """
+    import random
+    import nagconf
+    rand = random.Random(22)
+    hosts = ['host%02d' % i for i in range(40)]
+    for trial in range(20):
+        blocks, direct = build_group_config(rand, 'hostgroup', hosts, ['hg%02d' % i for i in range(12)])
+        rand.shuffle(blocks)
+        nco = ncClasses.NagConfig()
+        nco.add_objs([nagconf.build_nag_obj(block) for block in blocks])
+        membership = nco.get_membership('hostgroup')
+        expected = dict((group, naive_members(direct, group)) for group in direct)
+        assert sorted(membership.groups()) == sorted(direct), trial
+        for group, members in expected.items():
+            assert membership.members(group) == members, (trial, group)
+            for member in members:
+                assert membership.is_member(group, member), (trial, group, member)
+        for member in set(hosts).union(*expected.values()):
+            groups = set(group for group, members in expected.items() if member in members)
+            assert membership.groups_of(member) == groups, (trial, member)
+    return "group membership against 20 closures worked out by hand: ok\n"
+
+
+def check_contact_index():
+    """ Compares NagContactIndex.get_notifiers() and get_groups()
+    with expanding the contacts and contact_groups of random hosts,
+    services and escalations (and templates, which notify no one) by
+    hand over random contactgroups.
+    """
+    import random
+    import nagconf
+    rand = random.Random(21)
+    contacts = ['contact%02d' % i for i in range(30)]
+    groups = ['cg%02d' % i for i in range(10)]
+    for trial in range(20):
+        blocks, direct = build_group_config(rand, 'contactgroup', contacts, groups)
+        notified = [None] * len(blocks)  # per block, the contacts it notifies by hand
+        for i in range(60):
+            kind = rand.choice(ncClasses.NagContactIndex.notifiers)
+            values = [('contacts', ','.join(rand.choice(('', '!')) + name
+                                            for name in rand.sample(contacts + ['ghost0'], rand.randint(0, 3)))),
+                      ('contact_groups', ','.join(rand.choice(('', '', '!')) + group
+                                                  for group in rand.sample(groups + ['nosuch'], rand.randint(0, 3))))]
+            names = set()
+            notnames = set()
+            for attr, value in values:
+                included, excluded = ncClasses.split_members(value)
+                if attr == 'contact_groups':
+                    included = set().union(*[naive_members(direct, group) for group in included])
+                    excluded = set().union(*[naive_members(direct, group) for group in excluded])
+                names.update(included)
+                notnames.update(excluded)
+            if i % 10 == 0:
+                values.append(('register', '0'))
+                notified.append(None)
+            else:
+                notified.append(names - notnames)
+            blocks.append((kind, values))
+        order = list(range(len(blocks)))
+        rand.shuffle(order)
+        objs = [nagconf.build_nag_obj(blocks[block]) for block in order]
+        nco = ncClasses.NagConfig()
+        nco.add_objs(objs)
+        index = nco.get_contact_index()
+        expected = dict((group, naive_members(direct, group)) for group in direct)
+        for contact in contacts + ['ghost0']:
+            notifiers = [id(obj) for block, obj in zip(order, objs) if notified[block] and contact in notified[block]]
+            assert [id(obj) for obj in index.get_notifiers(contact)] == notifiers, (trial, contact)
+            groups_of = sorted(group for group, members in expected.items() if contact in members)
+            assert index.get_groups(contact) == groups_of, (trial, contact)
+    return "contact index against 20 expansions worked out by hand: ok\n"
+
+
+def check_snapshot_edits():
+    """ Edits a template in memory, reloads after another cfg file
+    changed and restarts from the snapshot, as the 't+' and 'r' menu
+    commands and a new nagconf would: the edit must not come back
+    from the snapshot as if it were in the cfg files.
+    """
+    import optparse
+    import nagconf
+    cfgdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(cfgdir, 'templates.cfg'), 'w') as f:
+            f.write("define host {\n    name    generic-host\n    notes    from disk\n    register    0\n}\n")
+        with open(os.path.join(cfgdir, 'hosts.cfg'), 'w') as f:
+            f.write("define host {\n    use    generic-host\n    host_name    web01\n}\n")
+        options = optparse.Values({'cfgdir': cfgdir, 'maincfg': None, 'cow': False, 'jobs': 1,
+                                   'poolsize': ncClasses.valuePool.maxsize,
+                                   'snapshot': os.path.join(cfgdir, 'snapshot')})
+        notes = lambda nco: [obj.get_prop('notes').value for obj in nco.nagObjs]
+        nco = nagconf.open_config(options)
+        assert os.path.exists(options.snapshot) and not nco.editedInMemory
+        nagconf.update_templates(nco, [('generic-host', 'notes', 'IN_MEMORY_ONLY')])
+        assert nco.editedInMemory and notes(nco) == ['IN_MEMORY_ONLY'] * 2
+        with open(os.path.join(cfgdir, 'hosts.cfg'), 'a') as f:
+            f.write("define host {\n    use    generic-host\n    host_name    web02\n}\n")
+        assert nagconf.reload_config(options, nco)['files'] == 1
+        nagconf.save_snapshot(options.snapshot, nco, options)
+        assert nco.editedInMemory and notes(nco) == ['IN_MEMORY_ONLY'] * 3
+        nco = nagconf.open_config(options)
+        assert notes(nco) == ['from disk'] * 3, notes(nco)
+        assert not nco.editedInMemory
+        assert notes(nagconf.load_snapshot(options.snapshot, options)) == ['from disk'] * 3
+    finally:
+        shutil.rmtree(cfgdir)
+    return "template edit, reload and restart from the snapshot: ok\n"
+
+
+def run_checks():
+    """ Runs every check_*() and reports them; a failing one raises
+    AssertionError.
+    """
+    return ''.join(check() for check in (check_timeperiod_roundtrip, check_timeperiods, check_group_membership,
+                                                check_contact_index, check_snapshot_edits))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "%prog memory|inherit|write|checks|load|timeperiod|check [-n COUNT] [--cow]"
+    parser = OptionParser(usage, version='%prog ' + sversion)
+    parser.add_option('-n', '--count', type='int', default=10000,
+                      help="Number of objects of each kind to build. Default is 10000.")
+    parser.add_option('-c', '--cow', action='store_true', default=False,
+                      help="Use copy-on-write inheritance for the inherit and write benchmarks.")
+    options, args = parser.parse_args()
+    benches = {'memory': lambda: bench_memory(options.count),
+               'inherit': lambda: bench_inherit(options.count, options.cow),
+               'write': lambda: bench_write(options.count, options.cow),
+               'checks': lambda: bench_checks(options.count),
+               'load': lambda: bench_load(options.count),
+               'timeperiod': lambda: bench_timeperiod(options.count),
+               'check': run_checks}
+    if not args or args[0] not in benches:
+        parser.error("pick one of: " + ', '.join(sorted(benches)))
+    print(benches[args[0]]())
@@ -1,4 +1,17 @@
+import bisect
+import calendar
+import datetime
+import gc
+import hashlib
 import logging
+import os
+import re
+import sys
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class NagConfig(object):
@@ -8,17 +21,423 @@ class NagConfig(object):
     """
     def __init__(self):
         self.nagObjs = []  # stores NagObj objects
+        self.manifest = {}  # path: (size, mtime, md5) of the files nagObjs came from
+        self.indexes = dict((idx, {}) for idx in indexNames)  # index: key: [objs]
+        self.contactIndex = None  # NagContactIndex, built on first use
+        self.membership = {}  # group kind: NagGroupMembership, built on first use
+        self.timeperiods = None  # NagTimePeriods, built on first use
+        self.editedInMemory = False  # templates were edited in memory, not in the cfg files
 
-    def gen_cfg_file(self, filename, expand=None):
+    def __getstate__(self):
+        # the indexes are cheap to rebuild, don't bloat snapshots with them
+        state = self.__dict__.copy()
+        del state['indexes']
+        state['contactIndex'] = None
+        state['membership'] = {}
+        state['timeperiods'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reindex()
+
+    def index_keys(self, obj):
+        """ Returns the (index, key) pairs obj should be filed
+        under given its current property values.
+        """
+        classification = obj.classification.value
+        keys = [('class', classification)]
+        name = obj.get_prop('name')
+        if name is not None and name.value:
+            keys.append(('name', name.value))
+        host = obj.get_prop('host_name')
+        if host is not None and host.value:
+            hosts = [h.strip() for h in host.value.split(',') if h.strip()]
+            for h in hosts:
+                keys.append(('host', h))
+            desc = obj.get_prop('service_description')
+            if desc is not None and desc.value:
+                for h in hosts:
+                    keys.append(('service', (h, desc.value)))
+        if classification in groupClasses:
+            groupname = obj.get_prop(classification + '_name')
+            if groupname is not None and groupname.value:
+                keys.append(('group', (classification, groupname.value)))
+        use = obj.get_prop('use')
+        if use is not None and use.value:
+            for tpname in split_use(use.value):
+                keys.append(('use', tpname))
+        return keys
+
+    def index_obj(self, obj):
+        self.invalidate(obj)
+        for idx, key in self.index_keys(obj):
+            self.indexes[idx].setdefault(key, []).append(obj)
+
+    def index_objs(self, objs):
+        # nothing here can make a reference cycle, so don't let the
+        # collector keep rescanning every object as the buckets grow
+        gcwasenabled = gc.isenabled()
+        gc.disable()
+        try:
+            for obj in objs:
+                self.index_obj(obj)
+        finally:
+            if gcwasenabled:
+                gc.enable()
+
+    def unindex_obj(self, obj):
+        """ Takes obj out of the indexes. The keys are worked out
+        from obj's current values, which is why reindex() has to
+        be run after anything changes values in bulk.
+        """
+        self.invalidate(obj)
+        for idx, key in self.index_keys(obj):
+            bucket = self.indexes[idx].get(key, [])
+            if obj in bucket:
+                bucket.remove(obj)
+                if not bucket:
+                    del self.indexes[idx][key]
+
+    def update_index(self, obj, oldkeys):
+        """ Moves obj to the right buckets after some of its values
+        changed. oldkeys is what index_keys(obj) returned before.
+        """
+        # contacts and group members aren't index keys but they may
+        # have changed too
+        self.invalidate(obj)
+        newkeys = self.index_keys(obj)
+        if newkeys == oldkeys:
+            return
+        for idx, key in oldkeys:
+            if (idx, key) not in newkeys:
+                bucket = self.indexes[idx].get(key, [])
+                if obj in bucket:
+                    bucket.remove(obj)
+                    if not bucket:
+                        del self.indexes[idx][key]
+        for idx, key in newkeys:
+            if (idx, key) not in oldkeys:
+                self.indexes[idx].setdefault(key, []).append(obj)
+
+    def set_prop(self, obj, attr, value):
+        """ Sets property attr of obj to value (or removes it when
+        value is None) keeping the indexes up to date.
+        """
+        oldkeys = self.index_keys(obj)
+        if value is None:
+            if attr in obj.__dict__:
+                delattr(obj, attr)
+        else:
+            setattr(obj, attr, NagObjSuperProp(value))
+        self.update_index(obj, oldkeys)
+
+    def reindex(self):
+        """ Rebuilds every index from self.nagObjs. Needed
+        whenever property values the indexes are keyed on may
+        have changed (scrubbing, inheritance) or the order of
+        self.nagObjs has changed.
+        """
+        self.indexes = dict((idx, {}) for idx in indexNames)
+        self.contactIndex = None
+        self.membership = {}
+        self.timeperiods = None
+        self.index_objs(self.nagObjs)
+
+    def add_obj(self, obj):
+        self.nagObjs.append(obj)
+        self.index_obj(obj)
+
+    def add_objs(self, objs):
+        objs = list(objs)
+        self.nagObjs.extend(objs)
+        self.index_objs(objs)
+
+    def remove_obj(self, obj):
+        self.nagObjs.remove(obj)
+        self.unindex_obj(obj)
+
+    def get_by_class(self, classification):
+        """ Returns the objects of one classification (e.g., 'host') """
+        return self.indexes['class'].get(classification, [])
+
+    def get_templates(self, name=None):
+        """ Returns the objects with the template name 'name',
+        or every template (in self.nagObjs order) when name is None.
+        """
+        if name is None:
+            tplids = set(id(obj) for objs in self.indexes['name'].values() for obj in objs)
+            return [obj for obj in self.nagObjs if id(obj) in tplids]
+        return self.indexes['name'].get(name, [])
+
+    def get_by_host(self, host_name):
+        """ Returns the objects whose host_name includes host_name """
+        return self.indexes['host'].get(host_name, [])
+
+    def get_service(self, host_name, service_description):
+        return self.indexes['service'].get((host_name, service_description), [])
+
+    def get_dependents(self, names):
+        """ Returns every object that inherits from one of the
+        templates called names, directly or through other templates,
+        by walking the reverse template dependency graph (the 'use'
+        index) breadth first.
+        """
+        found = []
+        seen = set()
+        todo = list(names)
+        done = set(todo)
+        while todo:
+            name = todo.pop(0)
+            for obj in self.indexes['use'].get(name, ()):
+                if id(obj) in seen:
+                    continue
+                seen.add(id(obj))
+                found.append(obj)
+                tpname = obj.get_prop('name')
+                if tpname is not None and tpname.value and tpname.value not in done:
+                    done.add(tpname.value)
+                    todo.append(tpname.value)
+        return found
+
+    def explain(self, obj, attr, stack=()):
+        """ Works out where obj's property attr got its value from
+        the donors recorded in its inheritanceHistory. Returns a list
+        of (donor, template, value, used), nearest first, where donor
+        is 'EXPLICIT_DIRECT' or a template name, template is the
+        template it names (None if explicit or no longer loaded),
+        value is what that donor set and used is whether it made it
+        into the effective value (directly, through an additive value
+        or through a template in front of it that inherited it).
+        stack is the templates being explained further up, so a
+        template cycle stops.
+        """
+        prop = obj.get_prop(attr)
+        if prop is None or prop.value == '':
+            return []
+        steps = []
+        current = None
+        taken = {}  # donor: how many templates of that name used so far
+        mergedBy = set()  # templates that reached us through a used template
+        for donor in prop.inheritanceHistory:
+            template = None
+            value = ''
+            if donor == 'EXPLICIT_DIRECT':
+                value = getattr(prop, 'explicitValue', prop.value)
+            else:
+                setters = [tpl for tpl in self.get_templates(donor)
+                           if tpl.get_prop(attr) is not None and tpl.get_prop(attr).value != '']
+                nth = taken.get(donor, 0)
+                taken[donor] = nth + 1
+                if nth < len(setters):
+                    template = setters[nth]
+                    value = template.get_prop(attr).value
+            if current is None:
+                used = True
+                current = value
+            else:
+                # same rule as merge_donors()
+                used = '+' in current
+                if used:
+                    current = current.strip('+') + ',' + value
+                used = used or donor in mergedBy
+            if used and template is not None and donor not in stack:
+                for tpdonor, tpl, tpvalue, tpused in self.explain(template, attr, stack + (donor,)):
+                    if tpused:
+                        mergedBy.add(tpdonor)
+            steps.append((donor, template, value, used))
+        return steps
+
+    def invalidate(self, obj):
+        """ Drops whatever was worked out from obj: the contact
+        index, the group memberships obj can take part in and the
+        compiled timeperiods.
+        """
+        self.contactIndex = None
+        if obj.classification.value == 'timeperiod':
+            self.timeperiods = None
+        if self.membership:
+            for kind in membershipKinds.get(obj.classification.value, ()):
+                self.membership.pop(kind, None)
+
+    def get_membership(self, kind):
+        """ Returns the NagGroupMembership of kind ('hostgroup',
+        'servicegroup' or 'contactgroup'), building it if anything
+        it depends on changed since it was last built.
+        """
+        try:
+            return self.membership[kind]
+        except KeyError:
+            membership = self.membership[kind] = NagGroupMembership(self, kind)
+            return membership
+
+    def get_timeperiods(self):
+        """ Returns the NagTimePeriods for the current timeperiods,
+        building it if any of them changed since it was last built.
+        """
+        if self.timeperiods is None:
+            self.timeperiods = NagTimePeriods(self)
+        return self.timeperiods
+
+    def iter_checks(self, services=None):
+        """ Lazily yields a (host_name, service) pair for every
+        actual check the services (default every registered service)
+        stand for: one per host in their host_name and hostgroup_name.
+        Nothing is built per check.
+        """
+        if services is None:
+            services = self.get_by_class('service')
+        hostgroups = self.get_membership('hostgroup')
+        for service in services:
+            if not is_registered(service):
+                continue
+            for i in iter_bits(hostgroups.service_hosts(service)):
+                yield hostgroups.memberNames[i], service
+
+    def count_checks(self):
+        """ Counts the checks iter_checks() would yield without
+        yielding them, as {'services', 'checks', 'template': {name:
+        checks}, 'hostgroup': {name: checks}}. A service's checks count
+        towards its nearest template ('' for none) and, per host, every
+        hostgroup the host is in. Services with the same host_name and
+        hostgroup_name are counted together from the host bitsets.
+        """
+        hostgroups = self.get_membership('hostgroup')
+        byhosts = {}  # host bitset: [services]
+        for service in self.get_by_class('service'):
+            if is_registered(service):
+                byhosts.setdefault(hostgroups.service_hosts(service), []).append(service)
+        totals = {'services': 0, 'checks': 0, 'template': {}, 'hostgroup': {}}
+        groupbits = [(group, hostgroups.closure(group)) for group in hostgroups.groups()]
+        for bits, services in byhosts.items():
+            checks = count_bits(bits)
+            totals['services'] += len(services)
+            totals['checks'] += checks * len(services)
+            for service in services:
+                chain = service.templateChain.value
+                template = chain[0] if chain else ''
+                totals['template'][template] = totals['template'].get(template, 0) + checks
+            for group, members in groupbits:
+                shared = count_bits(bits & members)
+                if shared:
+                    totals['hostgroup'][group] = totals['hostgroup'].get(group, 0) + shared * len(services)
+        return totals
+
+    def check_groups(self, by='template'):
+        """ Groups the actively checked registered hosts and the
+        checks (see count_checks()) of the registered services by how
+        Nagios schedules them (see check_schedule()) and by label: the
+        nearest template for by='template', else the value of prop by
+        up to any '!' (e.g. the command of check_command), '' for none.
+        Returns {(classification, check_interval, retry_interval,
+        max_check_attempts, check_period, label): checks}.
+        """
+        hostgroups = self.get_membership('hostgroup')
+        counted = {}  # host bitset: checks
+        groups = {}
+        for classification in ('host', 'service'):
+            for obj in self.get_by_class(classification):
+                if not is_registered(obj):
+                    continue
+                schedule = check_schedule(obj)
+                if schedule is None:
+                    continue
+                if classification == 'host':
+                    checks = 1
+                else:
+                    bits = hostgroups.service_hosts(obj)
+                    checks = counted.get(bits)
+                    if checks is None:
+                        checks = counted[bits] = count_bits(bits)
+                if not checks:
+                    continue
+                if by == 'template':
+                    chain = obj.templateChain.value
+                    label = chain[0] if chain else ''
+                else:
+                    prop = obj.get_prop(by)
+                    label = prop.value.split('!', 1)[0].strip() if prop is not None else ''
+                key = (classification,) + schedule + (label,)
+                groups[key] = groups.get(key, 0) + checks
+        return groups
+
+    def get_contact_index(self):
+        """ Returns the NagContactIndex for the current objects,
+        building it if anything changed since it was last built.
+        """
+        if self.contactIndex is None:
+            self.contactIndex = NagContactIndex(self)
+        return self.contactIndex
+
+    def get_group(self, classification, groupname):
+        """ Returns the hostgroup, contactgroup or servicegroup
+        (per classification) called groupname.
+        """
+        return self.indexes['group'].get((classification, groupname), [])
+
+    def gen_cfg_file(self, filename, expand=None, previous=None):
+        """ Writes every object to filename unless that wouldn't change
+        what is there: the text is streamed to a temp file and hashed in
+        one pass (see render_cfg_file()), then renamed over filename if
+        it differs (see current_cfg_entry()) and deleted if it doesn't.
+        previous is filename's entry from the output manifest, if any.
+        Returns {'objects', 'bytes', 'md5', 'seconds', 'written',
+        'changed', 'entry'}: 'changed' counts the objects whose text
+        differs from previous and 'entry' is filename's new manifest
+        entry. IOError/OSError are left to the caller.
+        """
         if expand is None:
             expand = False
+        start = time.time()
+        tmpname = filename + '.tmp'
         try:
-            with open(filename, 'w') as cf:
-                for thing in self.nagObjs:
-                    cf.write(thing.gen_nag_text(expand))
-        except Exception as e:
-            # logging.debug("Exception in NagConfig().gen_cfg_file(): " + str(e))
-            pass
+            summary = self.render_cfg_file(tmpname, expand)
+            summary['entry'] = current_cfg_entry(filename, summary['md5'], summary['digests'], previous)
+            summary['written'] = summary['entry'] is None
+            if summary['written']:
+                summary['entry'] = commit_cfg_file(filename, tmpname, summary['md5'], summary['digests'])
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        summary['changed'] = count_changed(summary.pop('digests'), previous)
+        summary['seconds'] = time.time() - start
+        return summary
+
+    def render_cfg_file(self, filename, expand=False, objs=None):
+        """ Streams objs (default every object) to filename through a
+        large write buffer, fingerprinting the text and each object's
+        block as it goes, so only one chunk is ever held in memory.
+        Returns {'objects', 'bytes', 'md5', 'digests'} with 'digests'
+        the md5 digest of every block in order.
+        """
+        digests = []
+        filehash = hashlib.md5()
+        written = 0
+        with open(filename, 'w', writeBufferSize) as cf:
+            for chunk in self.iter_cfg_chunks(expand, objs, digests):
+                cf.write(chunk)
+                filehash.update(chunk)
+                written += len(chunk)
+        return {'objects': len(digests), 'bytes': written, 'md5': filehash.hexdigest(), 'digests': digests}
+
+    def iter_cfg_chunks(self, expand=False, objs=None, digests=None):
+        """ Yields the cfg text of objs (default every object),
+        writeChunkObjects objects at a time. The md5 digest of each
+        object's block is appended to digests, when given.
+        """
+        if objs is None:
+            objs = self.nagObjs
+        blocks = []
+        for obj in objs:
+            block = ''.join(obj.nag_lines(expand))
+            if digests is not None:
+                digests.append(hashlib.md5(block).digest())
+            blocks.append(block)
+            if len(blocks) == writeChunkObjects:
+                yield ''.join(blocks)
+                blocks = []
+        if blocks:
+            yield ''.join(blocks)
 
     def dump_stats(self):
         msg = ''
@@ -40,6 +459,7 @@ class NagConfig(object):
             msg += ("Count of %s = %s\n" % (c, allclassifications.count(c)))
         msg += ("Classified objects: %s\n" % str(count_classified))
         msg += ("Unclassified objects: %s\n" % str(count_unclassified))
+        msg += valuePool.dump_stats()
         return msg
 
     def purge(self):
@@ -48,32 +468,237 @@ class NagConfig(object):
         """
 
         self.nagObjs = [x for x in self.nagObjs if not x.deleteflag.value]
+        self.reindex()
+
+    def pool_values(self):
+        """ Routes the value of every property through valuePool,
+        e.g., after loading a snapshot (unpickling doesn't go
+        through NagObjSuperProp.__init__).
+        """
+        for obj in self.nagObjs:
+            for prop in obj.__dict__.values():
+                prop.value = valuePool.intern(prop.value)
+
+    def drop_sources(self, sourcefiles):
+        """ Removes every object that was read from one of
+        sourcefiles and returns the removed objects.
+        """
+        kept = []
+        dropped = []
+        for obj in self.nagObjs:
+            if obj.sourcefile.value in sourcefiles:
+                dropped.append(obj)
+            else:
+                kept.append(obj)
+        self.nagObjs = kept
+        if dropped:
+            self.reindex()
+        return dropped
 
     def scrub_data(self):
         """ Runs through the objects in self.nagObjs
         and removes unwanted characters from the property
         values.
         """
+        changed = False
         for obj in self.nagObjs:
-            for attr in dir(obj):
-                if '__' not in attr and 'instancemethod' not in str(type(getattr(obj,attr))):
-                    val = getattr(getattr(obj,attr),'value')
-                    try:
-                        if 'str' in str(type(val)):
-                            newval = val.rstrip()
-                            newval = newval.rstrip(' ')
-                            newval = newval.rstrip('\t')
-                            setattr(getattr(obj,attr),'value',newval)
-                    except:
-                        pass
-
-
-class NagObjSuperProp():
+            for prop in obj.__dict__.values():
+                if isinstance(prop.value, str):
+                    newval = prop.value.rstrip()
+                    if newval != prop.value:
+                        prop.value = valuePool.intern(newval)
+                        changed = True
+        if changed:
+            # host names etc. the indexes are keyed on may have changed
+            self.reindex()
+
+
+# NagConfig index names: 'class' by classification, 'name' by template
+# name, 'host' by each host in host_name, 'service' by (host_name,
+# service_description), 'group' by (classification, group name) and
+# 'use' by each template named in use (the reverse dependency graph)
+indexNames = ('class', 'name', 'host', 'service', 'group', 'use')
+
+
+# identity properties per type for NagObjFlex.get_uid(), 'a|b' takes
+# the first of a and b that is set
+uidFields = {
+    'host': ('host_name',),
+    'hostgroup': ('hostgroup_name',),
+    'service': ('host_name|hostgroup_name', 'service_description'),
+    'servicegroup': ('servicegroup_name',),
+    'contact': ('contact_name',),
+    'contactgroup': ('contactgroup_name',),
+    'timeperiod': ('timeperiod_name',),
+    'command': ('command_name',),
+    'servicedependency': ('host_name', 'hostgroup_name', 'service_description',
+                          'dependent_host_name', 'dependent_hostgroup_name',
+                          'dependent_service_description'),
+    'serviceescalation': ('host_name', 'hostgroup_name', 'service_description',
+                          'first_notification', 'last_notification'),
+    'hostdependency': ('host_name', 'hostgroup_name', 'dependent_host_name',
+                       'dependent_hostgroup_name'),
+    'hostescalation': ('host_name', 'hostgroup_name', 'first_notification', 'last_notification'),
+    'hostextinfo': ('host_name',),
+    'serviceextinfo': ('host_name', 'service_description'),
+}
+
+# gen_cfg_file() output buffering
+writeBufferSize = 1024 * 1024
+writeChunkObjects = 1000
+
+
+def hash_file(filename):
+    """ Returns the md5 hexdigest of filename's contents
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        while True:
+            buf = f.read(1024 * 1024)
+            if not buf:
+                break
+            md5.update(buf)
+    return md5.hexdigest()
+
+
+def current_cfg_entry(filename, md5, digests, previous=None):
+    """ Returns filename's new output manifest entry if it already
+    holds content with hash md5 (so it needn't be replaced), else None.
+    What is on disk is only re-hashed when its size or mtime don't
+    match previous, its (size, mtime, md5, digests) manifest entry.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    if previous is not None and previous[0] == st.st_size and previous[1] == st.st_mtime:
+        current = previous[2]
+    else:
+        current = hash_file(filename)
+    if current != md5:
+        return None
+    return (st.st_size, st.st_mtime, md5, tuple(digests))
+
+
+def commit_cfg_file(filename, tmpname, md5, digests):
+    """ Renames the freshly written tmpname (with content hash md5)
+    over filename and returns filename's new output manifest entry
+    """
+    os.rename(tmpname, filename)
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime, md5, tuple(digests))
+
+
+def count_changed(digests, previous=None):
+    """ Returns how many of the object digests weren't in the
+    previous output manifest entry (objects added or changed).
+    """
+    if previous is None:
+        return len(digests)
+    old = {}
+    for digest in previous[3]:
+        old[digest] = old.get(digest, 0) + 1
+    changed = 0
+    for digest in digests:
+        if old.get(digest):
+            old[digest] -= 1
+        else:
+            changed += 1
+    return changed
+
+
+def split_members(value):
+    """ Splits a list property (members, contacts, ...) into the
+    names it includes and the ones it excludes ('!name'). A leading
+    '+' (additive inheritance) is ignored.
+    """
+    included = []
+    excluded = []
+    for token in value.lstrip('+').split(','):
+        token = token.strip()
+        if token.startswith('!'):
+            token = token[1:].strip()
+            if token:
+                excluded.append(token)
+        elif token:
+            included.append(token)
+    return included, excluded
+
+
+def split_use(value):
+    """ Splits a 'use' value into its template names
+    """
+    return [u.strip() for u in value.split(',') if u.strip()]
+
+
+groupClasses = frozenset(['hostgroup', 'contactgroup', 'servicegroup'])
+
+
+class NagValuePool(object):
+    """ Hands out one shared copy of each distinct property value so
+    the thousands of '24x7', 'generic-service', '5' etc. read from
+    the cfg files don't each keep their own string. Once maxsize
+    distinct values are pooled new values are passed through as is.
+    """
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize  # None or 0 for no limit
+        self.values = {}
+        self.lookups = 0
+        self.hits = 0
+        self.bytesSaved = 0
+
+    def intern(self, value):
+        """ Returns the pooled copy of value, adding value
+        to the pool if it isn't in there yet.
+        """
+        if not isinstance(value, str):
+            return value
+        self.lookups += 1
+        try:
+            shared = self.values[value]
+        except KeyError:
+            if not self.maxsize or len(self.values) < self.maxsize:
+                self.values[value] = value
+            return value
+        if shared is not value:
+            self.hits += 1
+            self.bytesSaved += sys.getsizeof(value)
+        return shared
+
+    def clear(self):
+        self.values.clear()
+        self.lookups = 0
+        self.hits = 0
+        self.bytesSaved = 0
+
+    def dump_stats(self):
+        msg = ''
+        msg += ("Pooled values: %s (limit %s)\n" % (len(self.values), self.maxsize or 'none'))
+        if self.values:
+            ratio = self.lookups / float(len(self.values))
+        else:
+            ratio = 0.0
+        msg += ("Value lookups: %s, dedup ratio %.1f:1\n" % (self.lookups, ratio))
+        msg += ("Duplicate values shared: %s (%s bytes saved)\n" % (self.hits, self.bytesSaved))
+        return msg
+
+
+# the pool every NagObjSuperProp value goes through
+valuePool = NagValuePool()
+
+
+class NagObjSuperProp(object):
     """ This object will be used as a property for several of the other
     NagObj's. e.g., type(NagObjHostGroup.service_description) = NagObjSuperProp
     This way each property can have it's own methods and properties. Want to do
     this so each property can track it's own history. 
+
+    There's one of these for every property of every object so they use
+    __slots__, and the usual one-entry history is kept as a bare string
+    rather than a list. inheritanceHistory still reads and writes as a list.
     """
+    __slots__ = ('value', 'explicitInheritance', '_history', 'explicitValue')
+
     def __init__(self,value=None,explicitInheritance=None,donor=None):
         if value is None:
             value = ''
@@ -81,19 +706,60 @@ class NagObjSuperProp():
             explicitInheritance = False
         if donor is None:
             donor = '*'
-        self.donor = donor
         self.explicitInheritance = explicitInheritance 
-        self.value = value # this is the primary value to be returned on most calls
-        self.inheritanceHistory = []
-        self.set_history()
+        self.value = valuePool.intern(value) # this is the primary value to be returned on most calls
+        self.set_history(donor)
 
-    def set_history(self):
+    def set_history(self, donor='*'):
         if self.value != '' and not self.explicitInheritance:
-            self.inheritanceHistory.append('EXPLICIT_DIRECT')
+            self._history = 'EXPLICIT_DIRECT'
         elif self.value == '':
-            self.inheritanceHistory.append('__')
+            self._history = '__'
+        else:
+            self._history = donor
+
+    def _get_history(self):
+        if isinstance(self._history, tuple):
+            return list(self._history)
+        return [self._history]
+
+    def _set_history(self, history):
+        if len(history) == 1:
+            self._history = history[0]
         else:
-            self.inheritanceHistory.append(self.donor)
+            self._history = tuple(history)
+
+    inheritanceHistory = property(_get_history, _set_history)
+
+    @property
+    def donor(self):
+        if self.explicitInheritance:
+            return self.inheritanceHistory[0]
+        return '*'
+
+    def add_history(self, entry):
+        """ Appends entry to the inheritanceHistory
+        """
+        if isinstance(self._history, tuple):
+            self._history += (entry,)
+        else:
+            self._history = (self._history, entry)
+
+    def copy(self):
+        """ Returns a new (writable) NagObjSuperProp in the same state
+        """
+        prop = NagObjSuperProp(self.value, self.explicitInheritance)
+        prop._history = self._history
+        if hasattr(self, 'explicitValue'):
+            prop.explicitValue = self.explicitValue
+        return prop
+
+    def first_history(self):
+        """ Returns inheritanceHistory[0] without building the list
+        """
+        if isinstance(self._history, tuple):
+            return self._history[0]
+        return self._history
 
     def return_history(self):
         return((self.inheritanceHistory))
@@ -101,47 +767,232 @@ class NagObjSuperProp():
     def __repr__(self):
         return(str(self.value))
 
-                   
-class NagObjFlex():
+
+class NagObjEmptyProp(NagObjSuperProp):
+    """ Read only stand in for a Nagios property an object hasn't
+    set. A single instance (emptyProp) is shared by every object so
+    unset properties cost nothing.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        object.__setattr__(self, 'value', '')
+        object.__setattr__(self, 'explicitInheritance', False)
+        object.__setattr__(self, '_history', '__')
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Can't set '%s' on the shared empty property. "
+                             "Assign a new NagObjSuperProp to the object instead." % attr)
+
+    def __reduce__(self):
+        # always unpickle back to the shared instance
+        return 'emptyProp'
+
+
+emptyProp = NagObjEmptyProp()
+
+
+class NagObjInheritedProp(NagObjSuperProp):
+    """ A property handed down by a template in copy-on-write mode.
+    One instance is shared by every object with the same template
+    chain, so it's read only; NagObjFlex.materialize() gives an
+    object its own copy that can be changed.
+    """
+    __slots__ = ()
+
+    def __init__(self, prop):
+        for slot in NagObjSuperProp.__slots__:
+            if hasattr(prop, slot):
+                object.__setattr__(self, slot, getattr(prop, slot))
+
+    def __getstate__(self):
+        return dict((slot, getattr(self, slot)) for slot in NagObjSuperProp.__slots__
+                    if hasattr(self, slot))
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Can't set '%s' on a shared inherited property. "
+                             "Use materialize() on the object first." % attr)
+
+# nagconf bookkeeping every object carries alongside its Nagios properties
+internalProps = ('classification', 'typestring', 'classified', 'deleteflag',
+                 'templateChain', 'sourcefile')
+# template bookkeeping that never gets copied to an inheriting object
+nontransferProps = ('name', 'use', 'register')
+# gen_nag_text() output
+blockLine = "define %s {\n"
+propLine = '    %-29s '  # the space keeps a long name (e.g. a daterange) apart from its value
+blockEnd = "}\n"
+
+
+class NagPropLabels(dict):
+    """ gen_nag_text() line prefixes by property name, filled in
+    the first time a property outside the schema turns up.
+    """
+    def __missing__(self, prop):
+        label = self[prop] = propLine % prop
+        return label
+
+
+class NagObjSchema(object):
+    """ Precomputed description of the properties of one of the
+    NagObj classes so the hot paths (display_filter(), gen_nag_text(),
+    inheritance) never have to reflect over an object to find them.
+    """
+    __slots__ = ('fields', 'fieldset', 'internal', 'nontransfer', 'displayFields',
+                 'labels', 'headers')
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)  # Nagios properties in definition order
+        self.fieldset = frozenset(fields)
+        self.internal = frozenset(internalProps)
+        self.nontransfer = frozenset(nontransferProps)
+        # what display_filter(display=True) lists even when unset
+        self.displayFields = frozenset(fields) | frozenset(['typestring'])
+        # gen_nag_text() line prefixes ('    <prop padded to 30>') so
+        # writing a line is one concatenation
+        self.labels = NagPropLabels((prop, propLine % prop) for prop in self.fields + nontransferProps)
+        self.headers = {}  # typestring: 'define <typestring> {' line
+
+    def header(self, typestring):
+        """ Returns the gen_nag_text() first line for typestring
+        """
+        try:
+            return self.headers[typestring]
+        except KeyError:
+            header = self.headers[typestring] = blockLine % typestring
+            return header
+
+
+class NagObjFlex(object):
     """ Class to hold Nagios configuration objects
     and their properties. This class cares little
     about what the object is and has very loose
     property definitions.
+
+    Only properties that have actually been set are stored (in the
+    instance __dict__); the internal bookkeeping lives in slots. Any
+    Nagios property in the class's 'fields' that hasn't been set
+    reads as the shared emptyProp. With copy-on-write inheritance
+    'resolved' points at the read only properties shared by every
+    object with the same template chain and they read through too.
     """
-    
-    def __init__(self,typestring):
+    __slots__ = internalProps + ('resolved', '__dict__')
+    fields = ()
+    schema = NagObjSchema(fields)
+
+    def __init__(self,typestring,sourcefile=None):
         ''' init only requires a typestring (e.g., define SERVICE)
+        and optionally the file it was defined in
         '''
         self.classification = NagObjSuperProp('unclassified')
         self.typestring = NagObjSuperProp(typestring)
         self.classified = NagObjSuperProp(False) # by default we don't know what type this obj is
         self.deleteflag = NagObjSuperProp(False) # after we morph ourself we can flag ourself for deletion
-        self.templateChain = NagObjSuperProp([])
-        self.inheritanceLog = NagObjSuperProp([])
+        self.templateChain = NagObjSuperProp(())  # template names, nearest first
+        self.sourcefile = NagObjSuperProp(sourcefile)
+        self.resolved = None  # shared inherited properties (copy-on-write)
+
+    def __getattr__(self, attr):
+        # only called when attr isn't set on the object
+        if attr != 'resolved':
+            resolved = self.resolved
+            if resolved is not None and attr in resolved:
+                return resolved[attr]
+        if attr in self.schema.fieldset:
+            return emptyProp
+        raise AttributeError(attr)
+
+    def get_prop(self, attr):
+        """ Returns property attr if it's set on (or inherited by)
+        this object, otherwise None.
+        """
+        prop = self.__dict__.get(attr)
+        if prop is None and self.resolved is not None:
+            prop = self.resolved.get(attr)
+        return prop
+
+    def own_value(self, attr):
+        """ Returns the value attr is set to on this object itself
+        (as written, before any '+' merging), or None if it isn't.
+        """
+        prop = self.__dict__.get(attr)
+        if prop is None or prop.explicitInheritance:
+            return None
+        return getattr(prop, 'explicitValue', prop.value)
+
+    def materialize(self, attr):
+        """ Returns this object's own copy of property attr, copying
+        it from the shared inherited property (or emptyProp) first if
+        need be, so it can be changed without touching other objects.
+        """
+        prop = self.__dict__.get(attr)
+        if prop is None:
+            prop = getattr(self, attr).copy()
+            setattr(self, attr, prop)
+        return prop
+
+    def set_attrs(self, unset=None):
+        """ Returns the sorted names of the Nagios (and custom)
+        properties set on this object. With unset=True the unset
+        fields from the class schema are included too.
+        """
+        attrs = set(self.__dict__)
+        if self.resolved:
+            attrs.update(self.resolved)
+        if unset:
+            attrs.update(self.schema.displayFields)
+        return sorted(attrs)
+
+    def set_props(self, transfer=None):
+        """ Returns sorted (name, NagObjSuperProp) pairs for every
+        property set on (or inherited by) this object. With
+        transfer=True the template bookkeeping (name/use/register)
+        is left out.
+        """
+        props = self.__dict__
+        items = list(props.items())
+        if self.resolved:
+            items.extend((attr, prop) for attr, prop in self.resolved.items()
+                         if attr not in props)
+        if transfer:
+            nontransfer = self.schema.nontransfer
+            return sorted((attr, prop) for attr, prop in items
+                          if attr not in nontransfer)
+        return sorted(items)
 
     def dumpself(self):
         msgs = []
-        for attr in dir(self):
-            if ('__' not in attr and 
-                'instancemethod' not in str(type(getattr(self,attr)))
-                ):
+        for attr in internalProps:
+            if hasattr(self, attr):
                 msgs.append([attr,getattr(self,attr)])
+        for attr, prop in self.set_props():
+            msgs.append([attr,prop])
         return(msgs)
 
+    def effective_values(self):
+        """ Returns the sorted (name, value) pairs of every property
+        set on or inherited by this object, for spotting changes.
+        """
+        return [(attr, prop.value) for attr, prop in self.set_props()]
+
     def dumpself_min(self):
         """ Returns only the properties and values
         of the properties that have set values from default
         """
         msgs = []
-        for attr in self.display_filter():
-            msgs.append([   attr,
-                            getattr(getattr(self,attr),'value'),
-                        ])
+        for attr, prop in self.set_props():
+            msgs.append([attr, prop.value])
         return(msgs)
 
     def display_filter(self,transfer=None,display=None):
         """ returns list of valid objects for
-        display, e.g., filters out non-nagios properties
+        display, e.g., filters out non-nagios properties.
+        The answer comes straight from the class schema and
+        the properties stored on the object.
         """
 
         ''' If we're trying to copy properties from
@@ -149,51 +1000,11 @@ class NagObjFlex():
         strip out non-transferrable properties like
         template name/use info.
         '''
-        if transfer is None:
-            transfer = False # default to false for display purposes
-        if display is None:
-            display = False
-        returnlist = []
         if display:
-            for attr in dir(self):
-                val = getattr(self,attr)
-                logging.debug("\t\tValue: '%s'" % val)
-                if ('__' not in attr and 
-                    'instancemethod' not in str(type(val)) and
-                    'classification' not in attr and
-                    'classified' not in attr and
-                    'deleteflag' not in attr and
-                    'templateChain' not in attr and
-                    'inheritanceLog' not in attr
-                    ):
-                    logging.debug("\t\tValue: '%s'" % val)
-                    returnlist.append(attr)
-        else:
-            for attr in dir(self):
-                val = getattr(self,attr)
-                if ('__' not in attr and 
-                    'instancemethod' not in str(type(val)) and
-                    'classification' not in attr and
-                    'classified' not in attr and
-                    'deleteflag' not in attr and
-                    val != '' and
-                    'typestring' not in attr and
-                    'templateChain' not in attr and
-                    'inheritanceLog' not in attr
-                    ):
-                    returnlist.append(attr)
-
-            # filter even further
-            if transfer:
-                templist = []
-                for attr in returnlist:
-                    if (    attr != 'name' and
-                            attr != 'use' and
-                            attr != 'register'
-                            ):
-                        templist.append(attr)
-                returnlist[:] = templist
-        return(returnlist)
+            return self.set_attrs(unset=True)
+        if transfer:
+            return [attr for attr, prop in self.set_props(transfer=True)]
+        return self.set_attrs()
 
     def gen_nag_text(self,expand=None):
         """ Generates nagios cfg file text
@@ -201,66 +1012,65 @@ class NagObjFlex():
         """
         if expand is None:
             expand = True
-        line_definition = "define {0} {{\n"
-        fmt_propval = '    {0:<30}{1:<}\n'
-        fmt_propval_tpl = '    {0:<30}{1:<90}{2:<}\n'
-        line_end = "}\n"
-        msg = ''
-        msg += line_definition.format(self.typestring.value)
+        return ''.join(self.nag_lines(expand))
+
+    def nag_lines(self, expand=True):
+        """ Returns the lines of gen_nag_text() as a list. With
+        expand=False only the properties set directly on the object
+        are listed. Line prefixes come precomputed from the schema.
+        """
+        schema = self.schema
+        labels = schema.labels
+        lines = [schema.header(self.typestring.value)]
         if expand:
-            for attr in self.display_filter():
-                prop = attr
-                val = getattr(self,prop).value
-                #logging.debug("prop = '%s', val = '%s'" % (prop,val))
-                if val == '':
-                    pass
-                else:
-                    msg += fmt_propval.format(prop,val)
-            msg += line_end
+            lines.extend([labels[prop] + superprop.value + '\n' for prop, superprop in self.set_props()
+                          if superprop.value != ''])
         else:
-            for attr in self.display_filter():
-                prop = attr
-                val = getattr(self,prop).value
-                firstHist = getattr(self,prop).inheritanceHistory[0]
-                if 'EXPLICIT_DIRECT' in firstHist and val != '':
-                    #logging.debug("prop = '%s', val = '%s'" % (prop,val))
-                    msg += fmt_propval.format(prop,val)
-            msg += line_end
-        return(msg)
+            lines.extend([labels[prop] + superprop.value + '\n' for prop, superprop in self.set_props()
+                          if superprop.value != '' and 'EXPLICIT_DIRECT' in superprop.first_history()])
+        lines.append(blockEnd)
+        return lines
 
     def morph_to_classed(self):
         """ Takes this object and attempts
-        to create a new object of type newclass
+        to create a new object of type newclass.
+        The parser already builds classed objects (see new_nag_obj())
+        so this is only needed for a NagObjFlex built by hand.
         """
         workingobj = None
-        # logging.debug("I'm inside NagObjFlex().morph_to_classed(): ")
-        # logging.debug("NagObjFlex().morph_to_classed(): self.typestring.value = '%s'" % self.typestring.value)
         try:
-            found = False
-            for c in classDictionary:
-                if c.get('typestring') == self.typestring.value:
-                    workingobj = c.get('classname')() # instantiates a new class object
-                    found = True
-                    break
-                else:
-                    found = False
-            if workingobj is not None:
-                # logging.debug("NagObjFlex().morph_to_classed(): workingobj must not be 'None'....")
-                # print("\tworkingobj is not None, length of dumpself(): " + str(len(self.dumpself())))
-
+            newclass = classMap.get(self.typestring.value)
+            if newclass is not None:
+                workingobj = newclass()
                 for propval in self.dumpself():
                     prop = propval[0]
                     val = propval[1]
-                    # logging.debug("NagObjFlex().morph_to_classed(): prop = %s , val = %s" % (prop,val))
                     setattr(workingobj,prop,val)
-                    workingobj.classification.value = self.typestring.value
-                    workingobj.classified.value = True
-                    self.deleteflag.value = True
+                workingobj.classification.value = self.typestring.value
+                workingobj.classified.value = True
+                self.deleteflag.value = True
             return(workingobj)
         except Exception as ex:
             # logging.debug("NagObjFlex().morph_to_classed(): Exception: '%s'" % str(ex))
             return(str(ex))
 
+    def reset_inheritance(self):
+        """ Throws away everything inherit_from_chain() did
+        to this object so it can be re-inherited from scratch.
+        """
+        for attr, prop in list(self.__dict__.items()):
+            if prop.explicitInheritance:
+                delattr(self, attr)
+            else:
+                # additive ('+') values remember what they were before merging
+                original = getattr(prop, 'explicitValue', None)
+                if original is not None:
+                    prop.value = original
+                    del prop.explicitValue
+                prop.inheritanceHistory = prop.inheritanceHistory[:1]
+        self.templateChain.value = ()
+        self.resolved = None
+
     def copy_from_obj(self, obj):
         """ takes select properties from obj
         and copies to self. returns list of 
@@ -272,94 +1082,1071 @@ class NagObjFlex():
         """
         returns some unique string for type of definition
         to make debugging easier. Templates have unique 'name'
-        properties but the uid for a service might be the 
-        command+host or something """
-        returnvalue = 'uid'  # generic filler
+        properties, everything else is keyed on the uidFields of
+        its type (e.g., host_name and service_description for a
+        service). Escalations and dependencies can share a uid. """
         r = self.typestring.value
-        if r == 'host':
-            try:
-                returnvalue = "%s_%s" % (r, self.host_name.value)
-            except:
-                pass
-        elif r == 'service':
-            try:
-                returnvalue = "%s_%s___%s" % (r, self.host_name.value, self.service_description.value)
-            except:
-                returnvalue = "%s_%s___%s" % (r, self.host_name.value, self.display_name.value)
-        else:
-            returnvalue = r + "_genericuid_"
-        return(returnvalue)
+        name = self.get_prop('name')
+        keys = uidFields.get(r, ())
+        values = []
+        for attrs in keys:
+            value = ''
+            for attr in attrs.split('|'):
+                prop = self.get_prop(attr)
+                if prop is not None and prop.value:
+                    value = prop.value
+                    break
+            values.append(value)
+        if name is not None and name.value and not ''.join(values):
+            return "%s_template_%s" % (r, name.value)
+        if not keys:
+            return r + "_genericuid_"
+        return "%s_%s" % (r, '___'.join(values))
+
+    def fingerprint(self):
+        """ Returns an md5 hexdigest of get_uid() and every effective
+        property (name/use/register aside), in sorted order, so two
+        objects that come out the same hash the same however their
+        templates got them there.
+        """
+        parts = [self.get_uid()]
+        for attr, prop in self.set_props(transfer=True):
+            if prop.value != '':
+                parts.append(attr + '\x01' + prop.value)
+        return hashlib.md5('\x00'.join(parts)).hexdigest()
 
     def dict_format(self):
         """
         returns keyed list of attribute:value
         """
-        results = []
-        for attr in self.display_filter(display=True):
-            results.append([   attr,
-                            getattr(getattr(self,attr),'value'),
-                        ])
         keyed = []
-        for i, tup in enumerate(results):
-            keyed.append({tup[0]: tup[1]})
+        for attr in self.display_filter(display=True):
+            keyed.append({attr: getattr(self,attr).value})
         return keyed
 
 
+def merge_donors(existing, donors):
+    """ Runs the (idx, tpname, value) donors past the property
+    existing: additive ('+') values are joined with the inherited
+    ones, and every donor is recorded in its inheritanceHistory.
+    """
+    for idx, tpname, val in donors:
+        if '+' in existing.value:
+            # remember the explicit value for reset_inheritance()
+            if not hasattr(existing, 'explicitValue'):
+                existing.explicitValue = existing.value
+            # must honor nagios additive property
+            existing.value = valuePool.intern(existing.value.strip('+') + ',' + val)
+        existing.add_history(tpname)
+
+
+class NagTemplateCache(object):
+    """ Applies template inheritance for a NagConfig. Every distinct
+    template chain is flattened once into a map of the properties it
+    hands down, along with one resolved property per entry, so
+    inheriting is a single merge per object rather than a walk over
+    every property of every template in its chain.
+
+    Only templates whose ids are in pending still have to inherit
+    themselves; they are resolved (in dependency order) the first
+    time a chain needs them.
+
+    With cow=True (copy-on-write) the resolved properties aren't
+    copied onto each object. They are read only and shared by every
+    object using the chain, which reads through to them (see
+    NagObjFlex.resolved); an object only keeps its own properties.
+    """
+    def __init__(self, nco, pending=None, cow=False):
+        self.nco = nco
+        if pending is None:
+            pending = set(id(tpl) for tpl in nco.get_templates())
+        self.pending = pending
+        self.cow = cow
+        # chain: ({prop: ((idx, tpname, value), ...)}, {prop: resolved prop})
+        self.flattened = {}
+        self.resolving = set()  # ids of templates part way through resolve()
+        self.copies = 0
+
+    def flatten(self, chain):
+        """ Returns what an object with the template chain 'chain'
+        inherits as {prop: ((idx, tpname, value), ...)}, one entry
+        for every template in the chain that sets prop, nearest first,
+        along with the resolved (read only) property for each entry.
+        name/use/register are never handed down.
+        """
+        try:
+            return self.flattened[chain]
+        except KeyError:
+            pass
+        flat = {}
+        partial = False
+        for idx, tpname in enumerate(chain, 1):
+            for tpl in self.nco.get_templates(tpname):
+                self.resolve(tpl)
+                # only happens in a template cycle
+                partial = partial or id(tpl) in self.resolving
+                for prop, tplprop in tpl.set_props(transfer=True):
+                    if tplprop.value != '':
+                        flat.setdefault(prop, []).append((idx, tpname, tplprop.value))
+        flat = dict((prop, tuple(donors)) for prop, donors in flat.items())
+        shared = {}
+        for prop, donors in flat.items():
+            idx, tpname, val = donors[0]
+            inherited = NagObjSuperProp(val, explicitInheritance=True, donor=tpname)
+            merge_donors(inherited, donors[1:])
+            shared[prop] = NagObjInheritedProp(inherited)
+        if not partial:
+            self.flattened[chain] = (flat, shared)
+        return flat, shared
+
+    def flat_maps(self):
+        """ Returns {chain: flat} for every chain flattened so far,
+        which is all a worker process needs to merge values.
+        """
+        return dict((chain, entry[0]) for chain, entry in self.flattened.items())
+
+    def resolve(self, tpl):
+        """ Makes sure template tpl has inherited from its own chain
+        before anything inherits from it. A template in a cycle is
+        handed down as far as it got.
+        """
+        if id(tpl) not in self.pending:
+            return
+        self.pending.discard(id(tpl))
+        self.resolving.add(id(tpl))
+        try:
+            self.apply(tpl)
+        finally:
+            self.resolving.discard(id(tpl))
+
+    def apply(self, user, merged=None):
+        """ Merges the flattened map for user's template chain into
+        user. Explicit values win and anything user doesn't set
+        (or sets to '') is inherited. merged, if given, is what
+        merge_donors() made of user's explicit values in a worker
+        process as {prop: (value, history, explicitValue)}.
+        """
+        chain = user.templateChain.value
+        if not chain:
+            return
+        flat, shared = self.flatten(chain)
+        props = user.__dict__
+        if self.cow:
+            user.resolved = shared
+        for prop, donors in flat.items():
+            existing = props.get(prop)
+            if existing is not None and existing.value != '':
+                if merged is None:
+                    merge_donors(existing, donors)
+                else:
+                    value, history, explicitValue = merged[prop]
+                    existing.value = valuePool.intern(value)
+                    existing._history = history
+                    if explicitValue is not None:
+                        existing.explicitValue = explicitValue
+            elif self.cow:
+                # read through to the shared property
+                if existing is not None:
+                    delattr(user, prop)
+            else:
+                setattr(user, prop, shared[prop].copy())
+                self.copies += 1
+
+
+# group kinds an object of each classification can change the membership of
+membershipKinds = {
+    'host': ('hostgroup', 'servicegroup'),
+    'hostgroup': ('hostgroup', 'servicegroup'),
+    'service': ('servicegroup',),
+    'servicegroup': ('servicegroup',),
+    'contact': ('contactgroup',),
+    'contactgroup': ('contactgroup',),
+}
+
+
+def is_registered(obj):
+    """ False for templates that aren't real objects (register 0)
+    """
+    register = obj.get_prop('register')
+    return register is None or register.value.strip() != '0'
+
+
+def count_bits(bits):
+    """ Returns the number of set bits in the int bits
+    """
+    return bin(bits).count('1')
+
+
+def iter_bits(bits):
+    """ Yields the positions of the set bits of the int bits
+    """
+    for position, bit in enumerate(reversed(bin(bits)[2:])):
+        if bit == '1':
+            yield position
+
+
+class NagGroupMembership(object):
+    """ Effective membership of one kind of group ('hostgroup',
+    'servicegroup' or 'contactgroup'). Every member and every group
+    gets an integer id and a group's members, nested *_members groups
+    included, are worked out once into a bitset (an int with a bit
+    per member id). Each member gets a bitset of its groups too, so
+    "is M in G", "members of G" and "groups of M" are lookups.
+
+    Members come from the group's members ('*' is every host and
+    '!name' excludes), its nested groups ('!group' excludes all of
+    a group's members) and from the hostgroups/servicegroups/
+    contactgroups property of the members themselves. A nesting
+    cycle is logged and cut. Hosts and contacts are known by name,
+    services by (host_name, service_description) for every host
+    they're defined on.
+    """
+    memberClasses = {'hostgroup': 'host', 'servicegroup': 'service', 'contactgroup': 'contact'}
+
+    def __init__(self, nco, kind):
+        self.nco = nco
+        self.kind = kind
+        self.memberIds = {}  # member: id
+        self.memberNames = []  # id: member
+        self.groupIds = {}  # group name: id
+        self.groupNames = []  # id: group name
+        self.direct = {}  # group name: [included bits, excluded bits, subgroups, excluded subgroups]
+        self.closed = {}  # group name: bitset of members
+        self.partial = set()  # groups cut short by a cycle, not to be memoized
+        self.memberGroups = {}  # member id: bitset of group ids
+        self.decoded = {}  # group name: frozenset of members
+        self.everyone = 0  # bitset of every defined member
+        self.serviceHosts = {}  # (host_name, hostgroup_name): bitset of hosts
+        self.build()
+
+    def member_bit(self, member):
+        try:
+            return 1 << self.memberIds[member]
+        except KeyError:
+            self.memberIds[member] = len(self.memberNames)
+            self.memberNames.append(member)
+            return 1 << self.memberIds[member]
+
+    def group_entry(self, group):
+        if group not in self.groupIds:
+            self.groupIds[group] = len(self.groupNames)
+            self.groupNames.append(group)
+            self.direct[group] = [0, 0, [], []]
+        return self.direct[group]
+
+    def host_bits(self, names, everyone):
+        bits = 0
+        for name in names:
+            bits |= everyone if name == '*' else self.member_bit(name)
+        return bits
+
+    def service_members(self, service):
+        """ Returns the (host_name, service_description) pairs
+        service is defined for
+        """
+        desc = service.get_prop('service_description')
+        if desc is None or not desc.value:
+            return []
+        hostgroups = self.nco.get_membership('hostgroup')
+        return [(hostgroups.memberNames[i], desc.value) for i in iter_bits(hostgroups.service_hosts(service))]
+
+    def service_hosts(self, service):
+        """ For the hostgroup kind only: returns the bitset of the
+        hosts service is defined for through its host_name ('*' and
+        '!host' work) and hostgroup_name ('!group' works). Worked out
+        once per distinct (host_name, hostgroup_name).
+        """
+        hostname = service.get_prop('host_name')
+        hostgroupname = service.get_prop('hostgroup_name')
+        key = (hostname.value if hostname is not None else '',
+               hostgroupname.value if hostgroupname is not None else '')
+        try:
+            return self.serviceHosts[key]
+        except KeyError:
+            pass
+        included, excluded = split_members(key[0])
+        bits = self.host_bits(included, self.everyone)
+        notbits = self.host_bits(excluded, self.everyone)
+        included, excluded = split_members(key[1])
+        for group in included:
+            bits |= self.closure(group)
+        for group in excluded:
+            notbits |= self.closure(group)
+        bits = self.serviceHosts[key] = bits & ~notbits
+        return bits
+
+    def build(self):
+        kind = self.kind
+        memberClass = self.memberClasses[kind]
+        members = []
+        for obj in self.nco.get_by_class(memberClass):
+            if not is_registered(obj):
+                continue
+            if memberClass == 'service':
+                # services only need ids if they join groups themselves,
+                # servicegroup members name theirs
+                prop = obj.get_prop('servicegroups')
+                names = self.service_members(obj) if prop is not None and prop.value else []
+            else:
+                prop = obj.get_prop(memberClass + '_name')
+                names = split_use(prop.value) if prop is not None and prop.value else []
+            for name in names:
+                self.member_bit(name)
+            if names:
+                members.append((obj, names))
+        # only the members defined so far have ids
+        everyone = self.everyone = (1 << len(self.memberNames)) - 1
+        for obj in self.nco.get_by_class(kind):
+            name = obj.get_prop(kind + '_name')
+            if name is None or not name.value or not is_registered(obj):
+                continue
+            entry = self.group_entry(name.value)
+            prop = obj.get_prop('members')
+            if prop is not None and prop.value:
+                if kind == 'servicegroup':
+                    # host,service,host,service... with '!host,service' excluding
+                    tokens = [token.strip() for token in prop.value.lstrip('+').split(',') if token.strip()]
+                    for host, desc in zip(tokens[::2], tokens[1::2]):
+                        if host.startswith('!'):
+                            entry[1] |= self.member_bit((host[1:].strip(), desc))
+                        else:
+                            entry[0] |= self.member_bit((host, desc))
+                else:
+                    included, excluded = split_members(prop.value)
+                    entry[0] |= self.host_bits(included, everyone)
+                    entry[1] |= self.host_bits(excluded, everyone)
+            prop = obj.get_prop(kind + '_members')
+            if prop is not None and prop.value:
+                included, excluded = split_members(prop.value)
+                entry[2].extend(included)
+                entry[3].extend(excluded)
+        # members can join groups themselves (a host's hostgroups, ...)
+        for obj, names in members:
+            prop = obj.get_prop(kind + 's')
+            if prop is None or not prop.value or not names:
+                continue
+            bits = 0
+            for name in names:
+                bits |= self.member_bit(name)
+            included, excluded = split_members(prop.value)
+            for group in included:
+                self.group_entry(group)[0] |= bits
+            for group in excluded:
+                self.group_entry(group)[1] |= bits
+        for group in list(self.groupNames):
+            groupbit = 1 << self.groupIds[group]
+            for member in iter_bits(self.closure(group)):
+                self.memberGroups[member] = self.memberGroups.get(member, 0) | groupbit
+
+    def closure(self, group, stack=()):
+        """ Returns the bitset of group's members, nested groups
+        included
+        """
+        try:
+            return self.closed[group]
+        except KeyError:
+            pass
+        if group in stack:
+            logging.warning("%s cycle: %s" % (self.kind.capitalize(), ' -> '.join(stack + (group,))))
+            # the groups after group in the cycle only see part of it
+            self.partial.update(stack[stack.index(group) + 1:])
+            return 0
+        if group not in self.direct:
+            logging.debug("NagGroupMembership.closure(): Unknown %s '%s'" % (self.kind, group))
+            return 0
+        stack = stack + (group,)
+        included, excluded, subgroups, notsubgroups = self.direct[group]
+        for subgroup in subgroups:
+            included |= self.closure(subgroup, stack)
+        for subgroup in notsubgroups:
+            excluded |= self.closure(subgroup, stack)
+        bits = included & ~excluded
+        if group in self.partial:
+            self.partial.discard(group)
+        else:
+            self.closed[group] = bits
+        return bits
+
+    def members(self, group):
+        """ Returns the frozenset of group's members
+        """
+        try:
+            return self.decoded[group]
+        except KeyError:
+            members = self.decoded[group] = frozenset(self.memberNames[i] for i in iter_bits(self.closure(group)))
+            return members
+
+    def is_member(self, group, member):
+        """ Whether member is in group
+        """
+        try:
+            return bool(self.closed[group] >> self.memberIds[member] & 1)
+        except KeyError:
+            return False
+
+    def groups_of(self, member):
+        """ Returns the frozenset of groups member is in
+        """
+        try:
+            bits = self.memberGroups[self.memberIds[member]]
+        except KeyError:
+            return frozenset()
+        return frozenset(self.groupNames[i] for i in iter_bits(bits))
+
+    def groups(self):
+        """ Returns every group name, in definition order
+        """
+        return list(self.groupNames)
+
+
+class NagContactIndex(object):
+    """ Reverse index of notifications: for every contact, the
+    hosts, services and escalations that notify it through their
+    contacts or contact_groups (expanded by the contactgroup
+    NagGroupMembership). '!name' excludes a contact, or every member
+    of a group, again. Objects with register 0 are templates and
+    left out.
+    """
+    notifiers = ('host', 'service', 'hostescalation', 'serviceescalation')
+
+    def __init__(self, nco):
+        self.nco = nco
+        self.groups = nco.get_membership('contactgroup')
+        self.notified = {}  # contact name: [objs], in nagObjs order
+        self.build()
+
+    def contacts_of(self, obj):
+        """ Returns the set of contacts obj notifies
+        """
+        contacts = set()
+        excluded = set()
+        prop = obj.get_prop('contacts')
+        if prop is not None and prop.value:
+            included, notincluded = split_members(prop.value)
+            contacts.update(included)
+            excluded.update(notincluded)
+        prop = obj.get_prop('contact_groups')
+        if prop is not None and prop.value:
+            included, notincluded = split_members(prop.value)
+            for group in included:
+                contacts.update(self.groups.members(group))
+            for group in notincluded:
+                excluded.update(self.groups.members(group))
+        return contacts - excluded
+
+    def build(self):
+        for obj in self.nco.nagObjs:
+            if obj.classification.value not in self.notifiers or not is_registered(obj):
+                continue
+            for contact in self.contacts_of(obj):
+                self.notified.setdefault(contact, []).append(obj)
+
+    def get_notifiers(self, contact):
+        """ Returns the objects that notify contact, in file order
+        """
+        return self.notified.get(contact, [])
+
+    def get_groups(self, contact):
+        """ Returns the sorted contactgroups contact is in
+        """
+        return sorted(self.groups.groups_of(contact))
+
+    def contacts(self):
+        """ Returns every contact that is defined or gets notified
+        """
+        names = set(self.notified)
+        names.update(name for name in self.groups.memberNames)
+        return sorted(names)
+
+
+# what Nagios schedules with when an object leaves these out
+checkDefaults = {'check_interval': '5', 'retry_interval': '1', 'max_check_attempts': '1'}
+# seconds in the day simulate_load() simulates
+loadDaySeconds = 86400
+
+
+def check_schedule(obj):
+    """ Returns the (check_interval, retry_interval,
+    max_check_attempts, check_period) obj is actively checked with,
+    going by checkDefaults for what's left out, or None if it isn't
+    actively checked (active_checks_enabled 0, a check_interval of
+    0 or values that aren't numbers).
+    """
+    values = {}
+    for attr in ('active_checks_enabled', 'check_period') + tuple(checkDefaults):
+        prop = obj.get_prop(attr)
+        values[attr] = prop.value.strip() if prop is not None and prop.value else checkDefaults.get(attr, '')
+    if values['active_checks_enabled'] == '0':
+        return None
+    try:
+        schedule = (float(values['check_interval']), float(values['retry_interval']),
+                    int(values['max_check_attempts']), values['check_period'])
+    except ValueError:
+        logging.debug("check_schedule(): unschedulable %s '%s'" % (obj.classification.value, obj.get_uid()))
+        return None
+    if schedule[0] <= 0:
+        return None
+    return schedule
+
+
+def simulate_load(groups, failing=0.0, intervalLength=60, periodMask=None):
+    """ Simulates the checks in groups (as from
+    NagConfig.check_groups()) over a day of loadDaySeconds with numpy
+    (or simulate_load_python() without it). Like Nagios, the first
+    checks of the hosts (and of the services) are started one
+    inter-check delay (their average interval over their number of
+    checks) apart and each repeats every interval, so one interval is
+    built per group with a bincount and tiled over the day. A share failing of the results is taken to be a
+    soft problem that gets retried max_check_attempts - 1 times,
+    retry_interval apart. periodMask, if given, maps a check_period
+    name to a boolean array of the seconds of the day it covers, or
+    None for all of them. Intervals are in units of intervalLength
+    seconds. Returns {'rate': checks per second for every second of
+    the day, 'labels': {label: the same for just those checks},
+    'checks'}.
+    """
+    if numpy is None:
+        return simulate_load_python(groups, failing, intervalLength, periodMask)
+    rate = numpy.zeros(loadDaySeconds)
+    labels = {}
+    masks = {}
+    byclass = {}  # classification: [group keys]
+    for group in groups:
+        byclass.setdefault(group[0], []).append(group)
+    for keys in byclass.values():
+        keys.sort()
+        counts = numpy.array([groups[key] for key in keys], dtype=numpy.int64)
+        intervals = numpy.array([max(1, int(round(key[1] * intervalLength))) for key in keys], dtype=numpy.int64)
+        ends = numpy.cumsum(counts)
+        delay = float((counts * intervals).sum()) / float(ends[-1]) ** 2
+        for interval in numpy.unique(intervals):
+            chosen = numpy.flatnonzero(intervals == interval)
+            starts = numpy.concatenate([numpy.arange(ends[g] - counts[g], ends[g]) for g in chosen]) * delay
+            owners = numpy.repeat(numpy.arange(len(chosen)), counts[chosen])
+            periods = numpy.bincount(owners * interval + (starts % interval).astype(numpy.int64),
+                                     minlength=len(chosen) * interval).reshape(len(chosen), interval)
+            repeats = -(-loadDaySeconds // interval)
+            for g, period in zip(chosen, periods):
+                classification, checkInterval, retryInterval, attempts, checkPeriod, label = keys[g]
+                day = numpy.tile(period, repeats)[:loadDaySeconds].astype(float)
+                if failing and attempts > 1:
+                    first = day.copy()
+                    retry = max(1, int(round(retryInterval * intervalLength)))
+                    for attempt in range(1, attempts):
+                        day += failing * numpy.roll(first, attempt * retry)
+                if periodMask is not None:
+                    if checkPeriod not in masks:
+                        masks[checkPeriod] = periodMask(checkPeriod)
+                    if masks[checkPeriod] is not None:
+                        day *= masks[checkPeriod]
+                rate += day
+                if label in labels:
+                    labels[label] += day
+                else:
+                    labels[label] = day
+    return {'rate': rate, 'labels': labels, 'checks': sum(groups.values())}
+
+
+def simulate_load_python(groups, failing=0.0, intervalLength=60, periodMask=None):
+    """ simulate_load() in plain Python, for when numpy isn't
+    installed: the same simulation, much more slowly, with lists for
+    the rates.
+    """
+    rate = [0.0] * loadDaySeconds
+    labels = {}
+    masks = {}
+    byclass = {}  # classification: [group keys]
+    for group in groups:
+        byclass.setdefault(group[0], []).append(group)
+    for keys in byclass.values():
+        keys.sort()
+        counts = [groups[key] for key in keys]
+        intervals = [max(1, int(round(key[1] * intervalLength))) for key in keys]
+        delay = float(sum(c * i for c, i in zip(counts, intervals))) / float(sum(counts)) ** 2
+        start = 0
+        for key, count, interval in zip(keys, counts, intervals):
+            classification, checkInterval, retryInterval, attempts, checkPeriod, label = key
+            period = [0.0] * interval
+            for check in range(start, start + count):
+                period[int(check * delay % interval)] += 1
+            start += count
+            day = (period * -(-loadDaySeconds // interval))[:loadDaySeconds]
+            if failing and attempts > 1:
+                first = day
+                retry = max(1, int(round(retryInterval * intervalLength)))
+                for attempt in range(1, attempts):
+                    shift = attempt * retry % loadDaySeconds
+                    rolled = first[loadDaySeconds - shift:] + first[:loadDaySeconds - shift]
+                    day = [checks + failing * retried for checks, retried in zip(day, rolled)]
+            if periodMask is not None:
+                if checkPeriod not in masks:
+                    masks[checkPeriod] = periodMask(checkPeriod)
+                if masks[checkPeriod] is not None:
+                    day = [checks if inside else 0.0 for checks, inside in zip(day, masks[checkPeriod])]
+            rate = [a + b for a, b in zip(rate, day)]
+            if label in labels:
+                labels[label] = [a + b for a, b in zip(labels[label], day)]
+            else:
+                labels[label] = day
+    return {'rate': rate, 'labels': labels, 'checks': sum(groups.values())}
+
+
+def rate_stats(rate):
+    """ Returns the (mean, peak, second of the peak) of a rate from
+    simulate_load()
+    """
+    if numpy is not None:
+        return float(rate.mean()), float(rate.max()), int(rate.argmax())
+    peak = max(rate)
+    return sum(rate) / len(rate), peak, rate.index(peak)
+
+
+def rate_profile(rate, bins=10):
+    """ Returns ([(mean, peak)] of every hour, [(low, high, seconds)])
+    of a rate from simulate_load(), the second being a histogram of
+    bins equal-width bins between the lowest and highest rate (as
+    numpy.histogram() has it).
+    """
+    if numpy is not None:
+        hours = rate.reshape(-1, 3600)
+        seconds, edges = numpy.histogram(rate, bins=bins)
+        return (list(zip(hours.mean(axis=1), hours.max(axis=1))),
+                list(zip(edges[:-1], edges[1:], seconds)))
+    hours = [rate[hour:hour + 3600] for hour in range(0, len(rate), 3600)]
+    low, high = min(rate), max(rate)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    seconds = [0] * bins
+    for checks in rate:
+        seconds[min(int((checks - low) / width), bins - 1)] += 1
+    return ([(sum(hour) / len(hour), max(hour)) for hour in hours],
+            [(low + width * i, low + width * (i + 1), seconds[i]) for i in range(bins)])
+
+
+# timeperiod weekdays in time.struct_time.tm_wday (and date.weekday()) order
+weekdayNames = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+monthNames = ('january', 'february', 'march', 'april', 'may', 'june', 'july',
+              'august', 'september', 'october', 'november', 'december')
+# timeperiod props that aren't a daterange and its timeranges
+timeperiodProps = frozenset(['timeperiod_name', 'alias', 'exclude', 'name', 'use', 'register'])
+# how many years NagTimePeriods.next_transition() looks ahead
+transitionYears = 8
+r_timeranges = re.compile(r'^(?P<daterange>.*?)\s+(?P<times>\d{1,2}:\d\d-\d{1,2}:\d\d(\s*,\s*\d{1,2}:\d\d-\d{1,2}:\d\d)*)\s*$')
+r_timerange = re.compile(r'^(\d{1,2}):(\d\d)-(\d{1,2}):(\d\d)$')
+_skip = r'(?:\s*/\s*(\d+))?$'
+_weekdays = '(' + '|'.join(weekdayNames) + ')'
+_months = '(' + '|'.join(monthNames) + ')'
+# the exception dateranges, in the order Nagios gives them precedence
+dateranges = (
+    ('calendar', re.compile(r'^(\d{4})-(\d\d)-(\d\d)(?:\s*-\s*(\d{4})-(\d\d)-(\d\d))?' + _skip)),
+    ('monthdate', re.compile(r'^%s\s+(-?\d+)(?:\s*-\s*(?:%s\s+)?(-?\d+))?' % (_months, _months) + _skip)),
+    ('monthday', re.compile(r'^day\s+(-?\d+)(?:\s*-\s*(-?\d+))?' + _skip)),
+    ('monthweekday', re.compile(r'^%s\s+(-?\d+)\s+%s(?:\s*-\s*%s\s+(-?\d+)\s+%s)?'
+                                % (_weekdays, _months, _weekdays, _months) + _skip)),
+    ('weekday', re.compile(r'^%s\s+(-?\d+)(?:\s*-\s*%s\s+(-?\d+))?' % (_weekdays, _weekdays) + _skip)),
+)
+
+
+def split_daterange(line):
+    """ Splits a timeperiod line such as 'monday 09:00-17:00' or
+    'december 25 - january 2 00:00-24:00' into its daterange and its
+    timeranges, or returns None if it doesn't end in timeranges.
+    Nagios keys these lines by the whole daterange, so should we.
+    """
+    match = r_timeranges.match(line.strip())
+    if match is None or not match.group('daterange'):
+        return None
+    return ' '.join(match.group('daterange').split()), match.group('times')
+
+
+def timerange_bits(value):
+    """ Returns the bitmap (bit n for minute n of the day) of the
+    timeranges in value, e.g. '00:00-09:00,17:00-24:00'.
+    """
+    bits = 0
+    for timerange in value.split(','):
+        match = r_timerange.match(timerange.strip())
+        if match is None:
+            logging.debug("timerange_bits(): Bad timerange '%s'" % timerange)
+            continue
+        hours, minutes, endhours, endminutes = [int(part) for part in match.groups()]
+        start = min(hours * 60 + minutes, 1440)
+        end = min(endhours * 60 + endminutes, 1440)
+        if end > start:
+            bits |= ((1 << (end - start)) - 1) << start
+    return bits
+
+
+def iter_runs(bits):
+    """ Yields the (start, end) of every run of set bits in bits
+    """
+    while bits:
+        start = (bits & -bits).bit_length() - 1
+        shifted = bits >> start
+        length = (~shifted & (shifted + 1)).bit_length() - 1
+        yield start, start + length
+        bits &= ~(((1 << length) - 1) << start)
+
+
+def month_date(year, month, day):
+    """ Returns the date of day (counted back from the end of the
+    month when negative) in month, or None if there's no such day.
+    """
+    days = calendar.monthrange(year, month)[1]
+    if day < 0:
+        day += days + 1
+    if 1 <= day <= days:
+        return datetime.date(year, month, day)
+    return None
+
+
+def nth_weekday(year, month, weekday, n):
+    """ Returns the date of the nth weekday (0 for monday) of month,
+    counted back from the end of the month when n is negative, or
+    None if there's no such day.
+    """
+    days = calendar.monthrange(year, month)[1]
+    if n > 0:
+        day = 1 + (weekday - datetime.date(year, month, 1).weekday()) % 7 + 7 * (n - 1)
+    else:
+        day = days - (datetime.date(year, month, days).weekday() - weekday) % 7 - 7 * (-n - 1)
+    return month_date(year, month, day) if 1 <= day <= days else None
+
+
+def add_months(year, month, months):
+    month += months - 1
+    return year + month // 12, month % 12 + 1
+
+
+def parse_daterange(daterange):
+    """ Returns (kind, spans, skip) for an exception daterange, where
+    spans(date) returns the candidate (start, end) dates of the
+    daterange around date and skip is its '/ N', or None if daterange
+    isn't one Nagios knows.
+    """
+    daterange = daterange.lower()
+    for kind, regex in dateranges:
+        match = regex.match(daterange)
+        if match is not None:
+            break
+    else:
+        return None
+    groups = list(match.groups())
+    skip = int(groups.pop() or 1)
+    if kind == 'calendar':
+        start = datetime.date(*[int(part) for part in groups[:3]])
+        end = datetime.date(*[int(part) for part in groups[3:]]) if groups[3] else start
+        spans = lambda date: [(start, end)]
+    elif kind in ('monthdate', 'monthweekday'):
+        if kind == 'monthdate':
+            month, day, endmonth, endday = groups
+            endmonth = endmonth or month
+            endday = endday or day
+            first = lambda year: month_date(year, monthNames.index(month) + 1, int(day))
+            last = lambda year: month_date(year, monthNames.index(endmonth) + 1, int(endday))
+        else:
+            weekday, n, month, endweekday, endn, endmonth = groups
+            if endweekday is None:
+                endweekday, endn, endmonth = weekday, n, month
+            first = lambda year: nth_weekday(year, monthNames.index(month) + 1, weekdayNames.index(weekday), int(n))
+            last = lambda year: nth_weekday(year, monthNames.index(endmonth) + 1,
+                                            weekdayNames.index(endweekday), int(endn))
+
+        def spans(date):
+            found = []
+            for year in (date.year - 1, date.year):
+                start, end = first(year), last(year)
+                if start is not None and end is not None and end < start:
+                    end = last(year + 1)
+                found.append((start, end))
+            return found
+    else:
+        if kind == 'monthday':
+            day, endday = groups
+            endday = endday or day
+            first = lambda year, month: month_date(year, month, int(day))
+            last = lambda year, month: month_date(year, month, int(endday))
+        else:
+            weekday, n, endweekday, endn = groups
+            if endweekday is None:
+                endweekday, endn = weekday, n
+            first = lambda year, month: nth_weekday(year, month, weekdayNames.index(weekday), int(n))
+            last = lambda year, month: nth_weekday(year, month, weekdayNames.index(endweekday), int(endn))
+
+        def spans(date):
+            found = []
+            for months in (-1, 0):
+                year, month = add_months(date.year, date.month, months)
+                start, end = first(year, month), last(year, month)
+                if start is not None and end is not None and end < start:
+                    end = last(*add_months(year, month, 1))
+                found.append((start, end))
+            return found
+    return kind, spans, skip
+
+
+def merge_intervals(intervals):
+    """ Returns the union of (start, end) intervals, sorted
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(intervals, removed):
+    """ Returns the sorted, disjoint (start, end) intervals with the
+    sorted, disjoint removed intervals taken out.
+    """
+    result = []
+    j = 0
+    for start, end in intervals:
+        while j < len(removed) and removed[j][1] <= start:
+            j += 1
+        k = j
+        while k < len(removed) and removed[k][0] < end:
+            if removed[k][0] > start:
+                result.append((start, removed[k][0]))
+            start = max(start, removed[k][1])
+            k += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def local_time(date, minute):
+    """ Returns the epoch seconds of minute of date, local time
+    """
+    return int(time.mktime((date.year, date.month, date.day, minute // 60, minute % 60, 0, 0, 0, -1)))
+
+
+class NagTimePeriods(object):
+    """ Compiled timeperiods. Each (timeperiod, year) is worked out
+    once, day by day: the timeranges of the first exception daterange
+    that covers the day (in the order of dateranges; by daterange
+    within a kind), else of its weekday, as a per-minute bitmap, less
+    the timeperiods it excludes (recursively, a cycle is logged and
+    cut). What's left is kept as a flat sorted list of the epoch
+    seconds where the timeperiod starts and stops, so whether a time
+    is in it and when it next changes are a bisect away, and numpy
+    can search millions of times at once. Times are local time.
+    """
+    def __init__(self, nco):
+        self.periods = {}  # timeperiod_name: (weekday bitmaps, exceptions, excludes)
+        self.years = {}  # (timeperiod_name, year): [(start, end)]
+        self.edges = {}  # timeperiod_name: [first year, last year, [start, end, start, ...]]
+        self.partial = set()  # timeperiods cut short by a cycle, not to be memoized
+        for obj in nco.get_by_class('timeperiod'):
+            name = obj.get_prop('timeperiod_name')
+            if is_registered(obj) and name is not None and name.value:
+                self.periods[name.value.strip()] = self.compile_rules(obj)
+
+    def compile_rules(self, obj):
+        weekdays = [0] * 7
+        exceptions = []
+        excludes = []
+        for attr, prop in obj.set_props():
+            if attr == 'exclude':
+                excludes = split_members(prop.value)[0]
+            elif attr in timeperiodProps or not prop.value:
+                continue
+            elif attr.lower() in weekdayNames:
+                weekdays[weekdayNames.index(attr.lower())] |= timerange_bits(prop.value)
+            else:
+                rule = parse_daterange(attr)
+                if rule is None:
+                    logging.debug("NagTimePeriods.compile_rules(): Unknown daterange '%s'" % attr)
+                    continue
+                kind, spans, skip = rule
+                order = [entry[0] for entry in dateranges].index(kind)
+                exceptions.append((order, attr, spans, skip, timerange_bits(prop.value)))
+        exceptions.sort(key=lambda rule: rule[:2])
+        return weekdays, exceptions, excludes
+
+    def day_bits(self, name, date):
+        """ Returns the bitmap of the minutes of date timeperiod
+        name covers, before exclusions.
+        """
+        weekdays, exceptions, excludes = self.periods[name]
+        for order, attr, spans, skip, bits in exceptions:
+            for start, end in spans(date):
+                if start is not None and end is not None and start <= date <= end \
+                        and (date - start).days % skip == 0:
+                    return bits
+        return weekdays[date.weekday()]
+
+    def year_intervals(self, name, year, stack=()):
+        """ Returns the sorted, disjoint (start, end) epoch intervals
+        of year that timeperiod name covers
+        """
+        key = (name, year)
+        try:
+            return self.years[key]
+        except KeyError:
+            pass
+        if name in stack:
+            logging.warning("Timeperiod exclude cycle: %s" % ' -> '.join(stack + (name,)))
+            self.partial.update(stack[stack.index(name) + 1:])
+            return []
+        if name not in self.periods:
+            logging.debug("NagTimePeriods.year_intervals(): Unknown timeperiod '%s'" % name)
+            return []
+        stack = stack + (name,)
+        intervals = []
+        date = datetime.date(year, 1, 1)
+        oneday = datetime.timedelta(1)
+        while date.year == year:
+            for start, end in iter_runs(self.day_bits(name, date)):
+                start, end = local_time(date, start), local_time(date, end)
+                if intervals and intervals[-1][1] == start:
+                    intervals[-1] = (intervals[-1][0], end)
+                else:
+                    intervals.append((start, end))
+            date += oneday
+        removed = []
+        for other in self.periods[name][2]:
+            removed.extend(self.year_intervals(other, year, stack))
+        if removed:
+            intervals = subtract_intervals(intervals, merge_intervals(removed))
+        if name in self.partial:
+            self.partial.discard(name)
+        else:
+            self.years[key] = intervals
+        return intervals
+
+    def compile(self, name, first, last):
+        """ Makes sure the edges of timeperiod name cover the years
+        first to last, and returns them.
+        """
+        flatten = lambda years: [edge for year in years for interval in self.year_intervals(name, year)
+                                 for edge in interval]
+        if name not in self.periods:
+            raise KeyError(name)
+        entry = self.edges.get(name)
+        if entry is None:
+            entry = self.edges[name] = [first, last, flatten(range(first, last + 1))]
+        if first < entry[0]:
+            entry[2][:0] = flatten(range(first, entry[0]))
+            entry[0] = first
+        if last > entry[1]:
+            entry[2].extend(flatten(range(entry[1] + 1, last + 1)))
+            entry[1] = last
+        return entry[2]
+
+    def contains(self, name, when):
+        """ Returns whether the epoch time when is inside timeperiod
+        name (KeyError if there's no such timeperiod)
+        """
+        year = time.localtime(when).tm_year
+        edges = self.compile(name, year, year)
+        return bisect.bisect_right(edges, when) % 2 == 1
+
+    def contains_many(self, name, times):
+        """ Returns, for every epoch time in times, whether it's inside
+        timeperiod name: a numpy boolean array if numpy is there,
+        otherwise a list.
+        """
+        if numpy is not None:
+            times = numpy.asarray(times)
+            if not len(times):
+                return numpy.zeros(0, dtype=bool)
+            first, last = times.min(), times.max()
+        elif not times:
+            return []
+        else:
+            first, last = min(times), max(times)
+        edges = self.compile(name, time.localtime(int(first)).tm_year, time.localtime(int(last)).tm_year)
+        if numpy is not None:
+            return numpy.searchsorted(numpy.array(edges, dtype=numpy.float64), times, side='right') % 2 == 1
+        return [bisect.bisect_right(edges, when) % 2 == 1 for when in times]
+
+    def next_transition(self, name, when):
+        """ Returns the first epoch time after when at which timeperiod
+        name starts or stops, or None if it doesn't within
+        transitionYears.
+        """
+        year = time.localtime(when).tm_year
+        for last in range(year, year + transitionYears):
+            edges = self.compile(name, year, last)
+            i = bisect.bisect_right(edges, when)
+            # an interval ending where the next one starts (e.g. at midnight
+            # on new year's eve) is no transition
+            while i + 1 < len(edges) and edges[i] == edges[i + 1]:
+                i += 2
+            if i + 1 < len(edges) or (i < len(edges) and self.contains(name, edges[i]) != (i % 2 == 1)):
+                return edges[i]
+        return None
+
+    def day_mask(self, name, day, seconds=86400):
+        """ Returns which of the seconds seconds from the epoch time
+        day are in timeperiod name (see contains_many()).
+        """
+        if numpy is not None:
+            return self.contains_many(name, numpy.arange(day, day + seconds))
+        return self.contains_many(name, range(day, day + seconds))
+
+
 class NagObjHost(NagObjFlex):
     """ For making a clearly defined
     Nagios host object with set properties.
     """
+    __slots__ = ()
+    fields = (
+        'host_name',                          #host_name
+        'alias',                              #alias
+        'display_name',                       #display_name
+        'address',                            #address
+        'parents',                            #host_names
+        'hostgroups',                         #hostgroup_names
+        'check_command',                      #command_name
+        'initial_state',                      #[o,d,u]
+        'max_check_attempts',                 ##
+        'check_interval',                     ##
+        'retry_interval',                     ##
+        'active_checks_enabled',              #[0/1]
+        'passive_checks_enabled',             #[0/1]
+        'check_period',                       #timeperiod_name
+        'obsess_over_host',                   #[0/1]
+        'check_freshness',                    #[0/1]
+        'freshness_threshold',                ##
+        'event_handler',                      #command_name
+        'event_handler_enabled',              #[0/1]
+        'low_flap_threshold',                 ##
+        'high_flap_threshold',                ##
+        'flap_detection_enabled',             #[0/1]
+        'flap_detection_options',             #[o,d,u]
+        'process_perf_data',                  #[0/1]
+        'retain_status_information',          #[0/1]
+        'retain_nonstatus_information',       #[0/1]
+        'contacts',                           #contacts
+        'contact_groups',                     #contact_groups
+        'notification_interval',              ##
+        'first_notification_delay',           ##
+        'notification_period',                #timeperiod_name
+        'notification_options',               #[d,u,r,f,s]
+        'notifications_enabled',              #[0/1]
+        'stalking_options',                   #[o,d,u]
+        'notes',                              #note_string
+        'notes_url',                          #url
+        'action_url',                         #url
+        'icon_image',                         #image_file
+        'icon_image_alt',                     #alt_string
+        'vrml_image',                         #image_file
+        'statusmap_image',                    #image_file
+        'twod_coords',                        #x_coord,y_coord
+        'threed_coords',                      #x_coord,y_coord,z_coord
+    )
+    schema = NagObjSchema(fields)
 
-    def __init__(self):
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'host', sourcefile)
         self.classification                 =   NagObjSuperProp('host')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.host_name                      =   NagObjSuperProp()      #host_name
-        self.alias                          =   NagObjSuperProp()      #alias
-        self.display_name                   =   NagObjSuperProp()      #display_name
-        self.address                        =   NagObjSuperProp()      #address
-        self.parents                        =   NagObjSuperProp()      #host_names
-        self.hostgroups                     =   NagObjSuperProp()      #hostgroup_names
-        self.check_command                  =   NagObjSuperProp()      #command_name
-        self.initial_state                  =   NagObjSuperProp()      #[o,d,u]
-        self.max_check_attempts             =   NagObjSuperProp()      ##
-        self.check_interval                 =   NagObjSuperProp()      ##
-        self.retry_interval                 =   NagObjSuperProp()      ##
-        self.active_checks_enabled          =   NagObjSuperProp()      #[0/1]
-        self.passive_checks_enabled         =   NagObjSuperProp()      #[0/1]
-        self.check_period                   =   NagObjSuperProp()      #timeperiod_name
-        self.obsess_over_host               =   NagObjSuperProp()      #[0/1]
-        self.check_freshness                =   NagObjSuperProp()      #[0/1]
-        self.freshness_threshold            =   NagObjSuperProp()      ##
-        self.event_handler                  =   NagObjSuperProp()      #command_name
-        self.event_handler_enabled          =   NagObjSuperProp()      #[0/1]
-        self.low_flap_threshold             =   NagObjSuperProp()      ##
-        self.high_flap_threshold            =   NagObjSuperProp()      ##
-        self.flap_detection_enabled         =   NagObjSuperProp()      #[0/1]
-        self.flap_detection_options         =   NagObjSuperProp()      #[o,d,u]
-        self.process_perf_data              =   NagObjSuperProp()      #[0/1]
-        self.retain_status_information      =   NagObjSuperProp()      #[0/1]
-        self.retain_nonstatus_information   =   NagObjSuperProp()      #[0/1]
-        self.contacts                       =   NagObjSuperProp()      #contacts
-        self.contact_groups                 =   NagObjSuperProp()      #contact_groups
-        self.notification_interval          =   NagObjSuperProp()      ##
-        self.first_notification_delay       =   NagObjSuperProp()      ##
-        self.notification_period            =   NagObjSuperProp()      #timeperiod_name
-        self.notification_options           =   NagObjSuperProp()      #[d,u,r,f,s]
-        self.notifications_enabled          =   NagObjSuperProp()      #[0/1]
-        self.stalking_options               =   NagObjSuperProp()      #[o,d,u]
-        self.notes                          =   NagObjSuperProp()      #note_string
-        self.notes_url                      =   NagObjSuperProp()      #url
-        self.action_url                     =   NagObjSuperProp()      #url
-        self.icon_image                     =   NagObjSuperProp()      #image_file
-        self.icon_image_alt                 =   NagObjSuperProp()      #alt_string
-        self.vrml_image                     =   NagObjSuperProp()      #image_file
-        self.statusmap_image                =   NagObjSuperProp()      #image_file
-        self.twod_coords                    =   NagObjSuperProp()      #x_coord,y_coord
-        self.threed_coords                  =   NagObjSuperProp()      #x_coord,y_coord,z_coord
 
     def __repr__(self):
         msg = ''
@@ -373,56 +2160,58 @@ class NagObjService(NagObjFlex):
     """ For making a clearly defined
     Nagios service object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'host_name',                          #host_name
+        'hostgroup_name',                     #hostgroup_name
+        'service_description',                #service_description
+        'display_name',                       #display_name
+        'servicegroups',                      #servicegroup_names
+        'is_volatile',                        #[0/1]
+        'check_command',                      #command_name
+        'initial_state',                      #[o,w,u,c]
+        'max_check_attempts',                 ##
+        'check_interval',                     ##
+        'retry_interval',                     ##
+        'normal_check_interval',              ##
+        'active_checks_enabled',              #[0/1]
+        'passive_checks_enabled',             #[0/1]
+        'parallelize_check',                  #[0/1]
+        'check_period',                       #timeperiod_name
+        'obsess_over_service',                #[0/1]
+        'check_freshness',                    #[0/1]
+        'freshness_threshold',                ##
+        'event_handler',                      #command_name
+        'event_handler_enabled',              #[0/1]
+        'low_flap_threshold',                 ##
+        'high_flap_threshold',                ##
+        'flap_detection_enabled',             #[0/1]
+        'flap_detection_options',             #[o,w,c,u]
+        'process_perf_data',                  #[0/1]
+        'retain_status_information',          #[0/1]
+        'retain_nonstatus_information',       #[0/1]
+        'notification_interval',              ##
+        'first_notification_delay',           ##
+        'notification_period',                #timeperiod_name
+        'notification_options',               #[w,u,c,r,f,s]
+        'notifications_enabled',              #[0/1]
+        'contacts',                           #contacts
+        'contact_groups',                     #contact_groups
+        'stalking_options',                   #[o,w,u,c]
+        'notes',                              #note_string
+        'notes_url',                          #url
+        'action_url',                         #url
+        'icon_image',                         #image_file
+        'icon_image_alt',                     #alt_string
+        'failure_prediction_enabled',         ##
+        'retry_check_interval',               ##
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'service', sourcefile)
         self.classification                 =   NagObjSuperProp('service')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.host_name                      =   NagObjSuperProp()      #host_name
-        self.hostgroup_name                 =   NagObjSuperProp()      #hostgroup_name
-        self.service_description            =   NagObjSuperProp()      #service_description
-        self.display_name                   =   NagObjSuperProp()      #display_name
-        self.servicegroups                  =   NagObjSuperProp()      #servicegroup_names
-        self.is_volatile                    =   NagObjSuperProp()      #[0/1]
-        self.check_command                  =   NagObjSuperProp()      #command_name
-        self.initial_state                  =   NagObjSuperProp()      #[o,w,u,c]
-        self.max_check_attempts             =   NagObjSuperProp()      ##
-        self.check_interval                 =   NagObjSuperProp()      ##
-        self.retry_interval                 =   NagObjSuperProp()      ##
-        self.normal_check_interval          =   NagObjSuperProp()      ##
-        self.active_checks_enabled          =   NagObjSuperProp()      #[0/1]
-        self.passive_checks_enabled         =   NagObjSuperProp()      #[0/1]
-        self.parallelize_check              =   NagObjSuperProp()      #[0/1]
-        self.check_period                   =   NagObjSuperProp()      #timeperiod_name
-        self.obsess_over_service            =   NagObjSuperProp()      #[0/1]
-        self.check_freshness                =   NagObjSuperProp()      #[0/1]
-        self.freshness_threshold            =   NagObjSuperProp()      ##
-        self.event_handler                  =   NagObjSuperProp()      #command_name
-        self.event_handler_enabled          =   NagObjSuperProp()      #[0/1]
-        self.low_flap_threshold             =   NagObjSuperProp()      ##
-        self.high_flap_threshold            =   NagObjSuperProp()      ##
-        self.flap_detection_enabled         =   NagObjSuperProp()      #[0/1]
-        self.flap_detection_options         =   NagObjSuperProp()      #[o,w,c,u]
-        self.process_perf_data              =   NagObjSuperProp()      #[0/1]
-        self.retain_status_information      =   NagObjSuperProp()      #[0/1]
-        self.retain_nonstatus_information   =   NagObjSuperProp()      #[0/1]
-        self.notification_interval          =   NagObjSuperProp()      ##
-        self.first_notification_delay       =   NagObjSuperProp()      ##
-        self.notification_period            =   NagObjSuperProp()      #timeperiod_name
-        self.notification_options           =   NagObjSuperProp()      #[w,u,c,r,f,s]
-        self.notifications_enabled          =   NagObjSuperProp()      #[0/1]
-        self.contacts                       =   NagObjSuperProp()      #contacts
-        self.contact_groups                 =   NagObjSuperProp()      #contact_groups
-        self.stalking_options               =   NagObjSuperProp()      #[o,w,u,c]
-        self.notes                          =   NagObjSuperProp()      #note_string
-        self.notes_url                      =   NagObjSuperProp()      #url
-        self.action_url                     =   NagObjSuperProp()      #url
-        self.icon_image                     =   NagObjSuperProp()      #image_file
-        self.icon_image_alt                 =   NagObjSuperProp()      #alt_string
-        self.failure_prediction_enabled     =   NagObjSuperProp()      ##
-        self.retry_check_interval           =   NagObjSuperProp()      ##
 
     def __repr__(self):
         msg = ''
@@ -441,82 +2230,90 @@ class NagObjServiceGroup(NagObjFlex):
     """ For making a clearly defined
     Nagios servicegroup object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'servicegroup_name',          #servicegroup_name
+        'alias',                      #alias
+        'members',                    #services
+        'servicegroup_members',       #servicegroups
+        'notes',                      #note_string
+        'notes_url',                  #url
+        'action_url',                 #url
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'servicegroup', sourcefile)
         self.classification                 =   NagObjSuperProp('servicegroup')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.servicegroup_name       =   NagObjSuperProp()      #servicegroup_name
-        self.alias                   =   NagObjSuperProp()      #alias
-        self.members                 =   NagObjSuperProp()      #services
-        self.servicegroup_members    =   NagObjSuperProp()      #servicegroups
-        self.notes                   =   NagObjSuperProp()      #note_string
-        self.notes_url               =   NagObjSuperProp()      #url
-        self.action_url              =   NagObjSuperProp()      #url
 
 
 class NagObjContact(NagObjFlex):
     """ For making a clearly defined
     Nagios contact object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'contact_name',                        #contact_name
+        'alias',                               #alias
+        'contactgroups',                       #contactgroup_names
+        'host_notifications_enabled',          #[0/1]
+        'service_notifications_enabled',       #[0/1]
+        'host_notification_period',            #timeperiod_name
+        'service_notification_period',         #timeperiod_name
+        'host_notification_options',           #[d,u,r,f,s,n]
+        'service_notification_options',        #[w,u,c,r,f,s,n]
+        'host_notification_commands',          #command_name
+        'service_notification_commands',       #command_name
+        'email',                               #email_address
+        'pager',                               #pager_number or pager_email_gateway
+        'addressx',                            #additional_contact_address
+        'can_submit_commands',                 #[0/1]
+        'retain_status_information',           #[0/1]
+        'retain_nonstatus_information',        #[0/1]
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'contact', sourcefile)
         self.classification                 =   NagObjSuperProp('contact')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.contact_name                     =   NagObjSuperProp()      #contact_name
-        self.alias                            =   NagObjSuperProp()      #alias
-        self.contactgroups                    =   NagObjSuperProp()      #contactgroup_names
-        self.host_notifications_enabled       =   NagObjSuperProp()      #[0/1]
-        self.service_notifications_enabled    =   NagObjSuperProp()      #[0/1]
-        self.host_notification_period         =   NagObjSuperProp()      #timeperiod_name
-        self.service_notification_period      =   NagObjSuperProp()      #timeperiod_name
-        self.host_notification_options        =   NagObjSuperProp()      #[d,u,r,f,s,n]
-        self.service_notification_options     =   NagObjSuperProp()      #[w,u,c,r,f,s,n]
-        self.host_notification_commands       =   NagObjSuperProp()      #command_name
-        self.service_notification_commands    =   NagObjSuperProp()      #command_name
-        self.email                            =   NagObjSuperProp()      #email_address
-        self.pager                            =   NagObjSuperProp()      #pager_number or pager_email_gateway
-        self.addressx                         =   NagObjSuperProp()      #additional_contact_address
-        self.can_submit_commands              =   NagObjSuperProp()      #[0/1]
-        self.retain_status_information        =   NagObjSuperProp()      #[0/1]
-        self.retain_nonstatus_information     =   NagObjSuperProp()      #[0/1]
 
 
 class NagObjCommand(NagObjFlex):
     """ For making a clearly defined
     Nagios command object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'command_name',       #command_name
+        'command_line',       #command_line
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'command', sourcefile)
         self.classification                 =   NagObjSuperProp('command')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.command_name        =   NagObjSuperProp()    #command_name
-        self.command_line        =   NagObjSuperProp()    #command_line
 
 class NagObjTimePeriod(NagObjFlex):
     """ For making a clearly defined
     Nagios timeperiod object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'timeperiod_name',       #timeperiod_name
+        'alias',                 #alias
+        'exclude',               #[timeperiod1,timeperiod2,...,timeperiodn]
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'timeperiod', sourcefile)
         self.classification                 =   NagObjSuperProp('timeperiod')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.timeperiod_name =   NagObjSuperProp()   #timeperiod_name
-        self.alias           =   NagObjSuperProp()   #alias
-        self.exclude         =   NagObjSuperProp()   #[timeperiod1,timeperiod2,...,timeperiodn]
         #self.[weekday]   timeranges
-        #self.[exception] timeranges
+        #self.[exception] timeranges, keyed by the whole daterange (see split_daterange())
         ''' E.g.,
         self.sunday      =   '00:00-24:00'                 ; Every Sunday of every week
         self.monday      =   '00:00-09:00,17:00-24:00'     ; Every Monday of every week
@@ -531,23 +2328,25 @@ class NagObjServiceEscalation(NagObjFlex):
     """ For making a clearly defined
     Nagios serviceescalation object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'host_name',                   #host_name
+        'hostgroup_name',              #hostgroup_name
+        'service_description',         #service_description
+        'contacts',                    #contacts
+        'contact_groups',              #contactgroup_name
+        'first_notification',          ##
+        'last_notification',           ##
+        'notification_interval',       ##
+        'escalation_period',           #timeperiod_name
+        'escalation_options',          #[w,u,c,r]
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'serviceescalation', sourcefile)
         self.classification                 =   NagObjSuperProp('serviceescalation')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.host_name              =   NagObjSuperProp()      #host_name
-        self.hostgroup_name         =   NagObjSuperProp()      #hostgroup_name
-        self.service_description    =   NagObjSuperProp()      #service_description
-        self.contacts               =   NagObjSuperProp()      #contacts
-        self.contact_groups         =   NagObjSuperProp()      #contactgroup_name
-        self.first_notification     =   NagObjSuperProp()      ##
-        self.last_notification      =   NagObjSuperProp()      ##
-        self.notification_interval  =   NagObjSuperProp()      ##
-        self.escalation_period      =   NagObjSuperProp()      #timeperiod_name
-        self.escalation_options     =   NagObjSuperProp()      #[w,u,c,r]
 
     def __repr__(self):
         if self.hostgroup_name.value == '':
@@ -559,62 +2358,68 @@ class NagObjHostGroup(NagObjFlex):
     """ For making a clearly defined
     Nagios hostgroup object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'hostgroup_name',          #hostgroup_name
+        'alias',                   #alias
+        'members',                 #hosts
+        'hostgroup_members',       #hostgroups
+        'notes',                   #note_string
+        'notes_url',               #url
+        'action_url',              #url
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'hostgroup', sourcefile)
         self.classification                 =   NagObjSuperProp('hostgroup')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.hostgroup_name       =   NagObjSuperProp()      #hostgroup_name
-        self.alias                =   NagObjSuperProp()      #alias
-        self.members              =   NagObjSuperProp()      #hosts
-        self.hostgroup_members    =   NagObjSuperProp()      #hostgroups
-        self.notes                =   NagObjSuperProp()      #note_string
-        self.notes_url            =   NagObjSuperProp()      #url
-        self.action_url           =   NagObjSuperProp()      #url
 
 class NagObjHostExtInfo(NagObjFlex):
     """ For making a clearly defined
     Nagios hostextinfo object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'host_name',             #netware1
+        'notes',                 #This is the primary Netware file server
+        'notes_url',             #http://webserver.localhost.localdomain/hostinfo.pl?host=netware1
+        'icon_image',            #novell40.png 
+        'icon_image_alt',        #IntranetWare 4.11
+        'vrml_image',            #novell40.png
+        'statusmap_image',       #novell40.gd2
+        'twod_coords',           #100,250
+        'threed_coords',         #100.0,50.0,75.0
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'hostextinfo', sourcefile)
         self.classification                 =   NagObjSuperProp('hostextinfo')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.host_name          =   NagObjSuperProp()      #netware1
-        self.notes              =   NagObjSuperProp()      #This is the primary Netware file server
-        self.notes_url          =   NagObjSuperProp()      #http://webserver.localhost.localdomain/hostinfo.pl?host=netware1
-        self.icon_image         =   NagObjSuperProp()      #novell40.png 
-        self.icon_image_alt     =   NagObjSuperProp()      #IntranetWare 4.11
-        self.vrml_image         =   NagObjSuperProp()      #novell40.png
-        self.statusmap_image    =   NagObjSuperProp()      #novell40.gd2
-        self.twod_coords        =   NagObjSuperProp()      #100,250
-        self.threed_coords      =   NagObjSuperProp()      #100.0,50.0,75.0
 
 class NagObjHostEscalation(NagObjFlex):
     """ For making a clearly defined
     Nagios hostescalation object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'host_name',                   #host_name
+        'hostgroup_name',              #hostgroup_name
+        'contacts',                    #contacts
+        'contact_groups',              #contactgroup_name
+        'first_notification',          ##
+        'last_notification',           ##
+        'notification_interval',       ##
+        'escalation_period',           #timeperiod_name
+        'escalation_options',          #[d,u,r]
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'hostescalation', sourcefile)
         self.classification                 =   NagObjSuperProp('hostescalation')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.host_name              =   NagObjSuperProp()      #host_name
-        self.hostgroup_name         =   NagObjSuperProp()      #hostgroup_name
-        self.contacts               =   NagObjSuperProp()      #contacts
-        self.contact_groups         =   NagObjSuperProp()      #contactgroup_name
-        self.first_notification     =   NagObjSuperProp()      ##
-        self.last_notification      =   NagObjSuperProp()      ##
-        self.notification_interval  =   NagObjSuperProp()      ##
-        self.escalation_period      =   NagObjSuperProp()      #timeperiod_name
-        self.escalation_options     =   NagObjSuperProp()      #[d,u,r]
 
     def __repr__(self):
         if self.hostgroup_name.value == '':
@@ -633,33 +2438,51 @@ class NagObjContactGroup(NagObjFlex):
     """ For making a clearly defined
     Nagios contactgroup object with set properties.
     """
-    def __init__(self):
+    __slots__ = ()
+    fields = (
+        'contactgroup_name',          #contactgroup_name
+        'alias',                      #alias
+        'members',                    #contacts
+        'contactgroup_members',       #contactgroups
+    )
+    schema = NagObjSchema(fields)
+
+    def __init__(self,sourcefile=None):
+        NagObjFlex.__init__(self, 'contactgroup', sourcefile)
         self.classification                 =   NagObjSuperProp('contactgroup')  # fixed classification string
         self.classified                     =   NagObjSuperProp(True)
-        # Everything above here is nagconf internal usage
-        #
-        # Everything below here is Nagios inherited
-        ##################################################################
-        self.contactgroup_name      =   NagObjSuperProp()      #contactgroup_name
-        self.alias                  =   NagObjSuperProp()      #alias
-        self.members                =   NagObjSuperProp()      #contacts
-        self.contactgroup_members   =   NagObjSuperProp()      #contactgroups
 
 ''' Used for retrieving the type of custom object
 we want to create on the fly from a string.
 '''
 classDictionary = [
-    {'classname'    :   NagConfig,                 'typestring' : 'config'},
-    {'classname'    :   NagObjFlex,                'typestring' : 'flex'},
-    {'classname'    :   NagObjHost,                'typestring' : 'host'},
-    {'classname'    :   NagObjService,             'typestring' : 'service'},
-    {'classname'    :   NagObjServiceGroup,        'typestring' : 'servicegroup'},
-    {'classname'    :   NagObjContact,             'typestring' : 'contact'},
-    {'classname'    :   NagObjCommand,             'typestring' : 'command'},
-    {'classname'    :   NagObjTimePeriod,          'typestring' : 'timeperiod'},
-    {'classname'    :   NagObjServiceEscalation,   'typestring' : 'serviceescalation'},
-    {'classname'    :   NagObjHostGroup,           'typestring' : 'hostgroup'},
-    {'classname'    :   NagObjHostExtInfo,         'typestring' : 'hostextinfo'},
-    {'classname'    :   NagObjHostEscalation,      'typestring' : 'hostescalation'},
-    {'classname'    :   NagObjContactGroup,        'typestring' : 'contactgroup'},
+    {'classname'    :   NagConfig,                'typestring' : 'config',           'schema' : None},
+    {'classname'    :   NagObjFlex,               'typestring' : 'flex',             'schema' : NagObjFlex.schema},
+    {'classname'    :   NagObjHost,               'typestring' : 'host',             'schema' : NagObjHost.schema},
+    {'classname'    :   NagObjService,            'typestring' : 'service',          'schema' : NagObjService.schema},
+    {'classname'    :   NagObjServiceGroup,       'typestring' : 'servicegroup',     'schema' : NagObjServiceGroup.schema},
+    {'classname'    :   NagObjContact,            'typestring' : 'contact',          'schema' : NagObjContact.schema},
+    {'classname'    :   NagObjCommand,            'typestring' : 'command',          'schema' : NagObjCommand.schema},
+    {'classname'    :   NagObjTimePeriod,         'typestring' : 'timeperiod',       'schema' : NagObjTimePeriod.schema},
+    {'classname'    :   NagObjServiceEscalation,  'typestring' : 'serviceescalation', 'schema' : NagObjServiceEscalation.schema},
+    {'classname'    :   NagObjHostGroup,          'typestring' : 'hostgroup',        'schema' : NagObjHostGroup.schema},
+    {'classname'    :   NagObjHostExtInfo,        'typestring' : 'hostextinfo',      'schema' : NagObjHostExtInfo.schema},
+    {'classname'    :   NagObjHostEscalation,     'typestring' : 'hostescalation',   'schema' : NagObjHostEscalation.schema},
+    {'classname'    :   NagObjContactGroup,       'typestring' : 'contactgroup',     'schema' : NagObjContactGroup.schema},
 ]
+
+# typestring -> class for every classed Nagios object; anything
+# not in here stays a NagObjFlex
+classMap = dict((c.get('typestring'), c.get('classname')) for c in classDictionary
+                if c.get('typestring') not in ('config', 'flex'))
+
+
+def new_nag_obj(typestring, sourcefile=None):
+    """ Returns a new empty object of the right class for
+    typestring (e.g., NagObjHost for 'host'), falling back
+    to NagObjFlex for object types we don't know about.
+    """
+    newclass = classMap.get(typestring)
+    if newclass is None:
+        return NagObjFlex(typestring, sourcefile)
+    return newclass(sourcefile)